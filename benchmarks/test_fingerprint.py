@@ -0,0 +1,64 @@
+"""
+Cost of the request fingerprints on URLs with long query strings
+
+    python -m pytest benchmarks/test_fingerprint.py
+"""
+import pytest
+from scrapy.http import Request
+from scrapy.settings import Settings
+
+from scrapy_httpcache.extensions.fingerprint import (
+    HashFingerprinter,
+    RequestFingerprinter,
+    xxhash,
+)
+
+
+def _url(params):
+    query = "&".join(
+        "param%03d=value%%20%d&utm_source=feed%d" % (i, i, i) for i in range(params)
+    )
+    return "http://www.example.com/search/results?%s&sid=8f14e45fceea167a" % query
+
+
+FINGERPRINTERS = {
+    "scrapy": (RequestFingerprinter, {}),
+    "sha1": (HashFingerprinter, {"HTTPCACHE_FINGERPRINT_HASH": "sha1"}),
+    "blake2b": (HashFingerprinter, {"HTTPCACHE_FINGERPRINT_HASH": "blake2b"}),
+    "xxhash": (HashFingerprinter, {"HTTPCACHE_FINGERPRINT_HASH": "xxhash"}),
+    "blake2b-exclude": (
+        HashFingerprinter,
+        {
+            "HTTPCACHE_FINGERPRINT_HASH": "blake2b",
+            "HTTPCACHE_FINGERPRINT_EXCLUDE_QUERY_PARAMS": ["utm_source", "sid"],
+        },
+    ),
+}
+
+
+def _fingerprinter(name):
+    if name == "xxhash" and xxhash is None:
+        pytest.skip("xxhash is not installed")
+    cls, settings = FINGERPRINTERS[name]
+    return cls(Settings(settings))
+
+
+@pytest.mark.parametrize("params", [10, 200], ids=["10params", "200params"])
+@pytest.mark.parametrize("name", list(FINGERPRINTERS))
+def test_first_fingerprint(benchmark, name, params):
+    """The first lookup of a request"""
+    fingerprinter = _fingerprinter(name)
+    url = _url(params)
+    requests = iter([Request(url) for _ in range(200000)])
+    benchmark.pedantic(
+        lambda: fingerprinter.fingerprint(next(requests)), rounds=2000, iterations=1
+    )
+
+
+@pytest.mark.parametrize("name", ["scrapy", "blake2b"])
+def test_memoized_fingerprint(benchmark, name):
+    """The following lookups of the same request, e.g. read then write"""
+    fingerprinter = _fingerprinter(name)
+    request = Request(_url(200))
+    fingerprinter.fingerprint(request)
+    benchmark(fingerprinter.fingerprint, request)
@@ -0,0 +1,221 @@
+"""
+Throughput and latency of the middleware hot path, process_request then
+process_response, against the storage backends
+
+    python -m pytest benchmarks/test_middleware.py --benchmark-autosave
+    python -m pytest benchmarks/test_middleware.py --benchmark-compare \\
+        --benchmark-compare-fail=median:15%
+
+The first command saves a baseline in .benchmarks/, the second compares with
+the last saved run and fails when a benchmark got 15% slower. Besides the
+timings, extra_info holds the p50/p99 latencies in microseconds, the bytes
+on disk and the peak resident memory, which is the peak of the whole
+session: select a single benchmark with -k to measure it alone.
+
+The MongoDB storage runs against mongomock, or against the mongod of
+BENCHMARK_MONGODB_HOST when set.
+"""
+import email.utils
+import json
+import os
+import resource
+import shutil
+import tempfile
+from itertools import cycle
+from unittest import mock
+
+import pytest
+from scrapy.http import Request, Response
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+
+from scrapy_httpcache.downloadermiddlewares.httpcache import HttpCacheMiddleware
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+MONGODB_HOST = os.environ.get("BENCHMARK_MONGODB_HOST")
+
+STORAGES = {
+    "dbm": {
+        "HTTPCACHE_STORAGE": "scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage"
+    },
+    "filesystem": {
+        "HTTPCACHE_STORAGE": "scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage",
+        "HTTPCACHE_GZIP": False,
+    },
+    "filesystem-gzip": {
+        "HTTPCACHE_STORAGE": "scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage",
+        "HTTPCACHE_GZIP": True,
+    },
+    "mongo": {
+        "HTTPCACHE_STORAGE": "scrapy_httpcache.extensions.cache_storage.mongo.MongoCacheStorage",
+        "HTTPCACHE_MONGO_MONGOCLIENT_HOST": MONGODB_HOST or "localhost",
+        "HTTPCACHE_MONGO_DATABASE": "httpcache_benchmark",
+        "HTTPCACHE_MONGO_COLLECTION": "cache",
+    },
+}
+
+# the distinct cached entries the hits and revalidations cycle over
+CACHED_ENTRIES = 50
+# a bounded random block, the binaries only differ by their first bytes
+BINARY_BLOCK = os.urandom(1024 * 1024)
+
+
+def _json_body(i):
+    items = [
+        {"id": i * 10 + j, "name": "item %d" % j, "price": j * 1.5} for j in range(12)
+    ]
+    return json.dumps({"page": i, "items": items}).encode()
+
+
+def _html_body(i):
+    row = b"<tr><td>lorem ipsum dolor sit amet</td><td>%d</td></tr>" % i
+    return (
+        b"<html><body><table>"
+        + row * (100 * 1024 // len(row))
+        + b"</table></body></html>"
+    )
+
+
+def _binary_body(i):
+    return b"%08d" % i + (BINARY_BLOCK * 10)[8:]
+
+
+# content type, body and number of rounds
+CORPORA = {
+    "json-1KB": ("application/json", _json_body, 2000),
+    "html-100KB": ("text/html; charset=utf-8", _html_body, 300),
+    "binary-10MB": ("application/octet-stream", _binary_body, 8),
+}
+
+# the kind of every request, cycled over
+MIXES = {
+    "hit": ["hit"],
+    "miss": ["miss"],
+    "stale": ["stale"],
+    "mixed": ["hit"] * 7 + ["miss"] * 2 + ["stale"],
+}
+
+
+def _response(url, content_type, body, kind):
+    headers = {
+        "Content-Type": content_type,
+        "Date": email.utils.formatdate(usegmt=True),
+        "Last-Modified": email.utils.formatdate(0, usegmt=True),
+        "ETag": '"%08x"' % hash(url),
+        # the stale ones are revalidated, every time
+        "Cache-Control": "max-age=0" if kind == "stale" else "max-age=86400",
+    }
+    return Response(url, headers=headers, body=body)
+
+
+def disk_usage(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def peak_rss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@pytest.fixture
+def cachedir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def mongoclient():
+    if MONGODB_HOST:
+        yield
+        return
+    if mongomock is None:
+        pytest.skip("mongomock is not installed, nor BENCHMARK_MONGODB_HOST set")
+    with mock.patch(
+        "scrapy_httpcache.extensions.cache_storage.mongo.MongoClient",
+        mongomock.MongoClient,
+    ):
+        yield
+
+
+@pytest.mark.parametrize("mix", list(MIXES))
+@pytest.mark.parametrize("corpus", list(CORPORA))
+@pytest.mark.parametrize("storage", list(STORAGES))
+def test_middleware(benchmark, request, cachedir, storage, corpus, mix):
+    if storage == "mongo":
+        request.getfixturevalue("mongoclient")
+    content_type, make_body, rounds = CORPORA[corpus]
+    settings = dict(
+        STORAGES[storage],
+        HTTPCACHE_ENABLED=True,
+        HTTPCACHE_DIR=cachedir,
+        HTTPCACHE_POLICY="scrapy_httpcache.extensions.policy.rfc2616.RFC2616Policy",
+    )
+    crawler = get_crawler(Spider, settings)
+    spider = crawler._create_spider("benchmark")
+    crawler.stats.open_spider(spider)
+    mw = HttpCacheMiddleware.from_crawler(crawler)
+    mw.spider_opened(spider)
+    try:
+        if storage == "mongo":
+            mw.storage.collection.delete_many({})
+        # the cached entries, then a fresh request for every round
+        cached = {}
+        for kind in ("hit", "stale"):
+            for i in range(min(rounds, CACHED_ENTRIES)):
+                url = "http://www.example.com/%s/%d" % (kind, i)
+                response = _response(url, content_type, make_body(i), kind)
+                mw.storage.store_response(spider, Request(url), response)
+                cached.setdefault(kind, []).append(url)
+        hit_urls, stale_urls = cycle(cached["hit"]), cycle(cached["stale"])
+        plan = []
+        for i, kind in zip(range(rounds), cycle(MIXES[mix])):
+            if kind == "miss":
+                url = "http://www.example.com/miss/%d" % i
+                downloaded = _response(url, content_type, make_body(i), kind)
+            elif kind == "hit":
+                url, downloaded = next(hit_urls), None
+            else:
+                url = next(stale_urls)
+                downloaded = Response(url, status=304)
+            plan.append((Request(url), downloaded))
+        plan = iter(plan)
+
+        def process():
+            req, downloaded = next(plan)
+            response = mw.process_request(req, spider)
+            if response is not None:
+                return response
+            return mw.process_response(req, downloaded, spider)
+
+        peak_before = peak_rss()
+        benchmark.pedantic(process, rounds=rounds, iterations=1)
+
+        if storage == "mongo":
+            import bson
+
+            size = sum(len(bson.encode(d)) for d in mw.storage.collection.find())
+        else:
+            size = disk_usage(cachedir)
+        benchmark.extra_info["bytes_on_disk"] = size
+        benchmark.extra_info["peak_rss_mb"] = peak_rss() / 1024 / 1024
+        benchmark.extra_info["peak_rss_growth_mb"] = (
+            (peak_rss() - peak_before) / 1024 / 1024
+        )
+        if benchmark.stats is not None:
+            data = sorted(benchmark.stats.stats.data)
+            benchmark.extra_info["p50_us"] = data[len(data) // 2] * 1e6
+            benchmark.extra_info["p99_us"] = data[int(len(data) * 0.99)] * 1e6
+        for kind in ("hit", "miss", "revalidate"):
+            benchmark.extra_info[kind] = crawler.stats.get_value("httpcache/" + kind, 0)
+    finally:
+        mw.spider_closed(spider)
+        crawler.stats.close_spider(spider, "finished")
@@ -0,0 +1,81 @@
+"""
+Resident memory of replaying a filesystem cache of large bodies, read or
+memory-mapped
+
+    python -m pytest benchmarks/test_mmap_read.py
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+import pytest
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+
+from scrapy_httpcache.extensions.cache_storage.file_system import (
+    FilesystemCacheStorage,
+)
+
+BODY_SIZE = 8 * 1024 * 1024
+ENTRIES = 16
+
+
+def rss() -> int:
+    """
+    The anonymous resident memory, mapped file pages are clean page cache that
+    the kernel can reclaim
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) * 1024
+
+
+@pytest.fixture(scope="module")
+def cachedir():
+    path = tempfile.mkdtemp()
+    storage = FilesystemCacheStorage(Settings({"HTTPCACHE_DIR": path}))
+    spider = Spider("replay")
+    for i in range(ENTRIES):
+        request = Request("http://www.example.com/%d.pdf" % i)
+        body = os.urandom(1024) * (BODY_SIZE // 1024)
+        response = Response(
+            request.url, headers={"Content-Type": "application/pdf"}, body=body
+        )
+        storage.store_response(spider, request, response)
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.mark.parametrize(
+    "mmap_min_size,consume",
+    [(0, "none"), (1024 * 1024, "none"), (1024 * 1024, "buffer")],
+    ids=["read", "mmap", "mmap-buffer"],
+)
+def test_replay_large_bodies(benchmark, cachedir, mmap_min_size, consume):
+    storage = FilesystemCacheStorage(
+        Settings({"HTTPCACHE_DIR": cachedir, "HTTPCACHE_MMAP_MIN_SIZE": mmap_min_size})
+    )
+    spider = Spider("replay")
+    requests = [Request("http://www.example.com/%d.pdf" % i) for i in range(ENTRIES)]
+    deltas = []
+
+    def replay():
+        gc.collect()
+        before = rss()
+        # keep the responses alive, as the scheduler and callbacks would
+        responses = [storage.retrieve_response(spider, r) for r in requests]
+        if consume == "buffer":
+            for response in responses:
+                sum(response.body_buffer[::4096])
+        deltas.append(rss() - before)
+        return responses
+
+    benchmark.pedantic(replay, rounds=3)
+    benchmark.extra_info["rss_delta_mb"] = max(deltas) / 1024 / 1024
+    print(
+        "\nmmap_min_size=%d consume=%s: anonymous memory +%.1f MB"
+        % (mmap_min_size, consume, max(deltas) / 1024 / 1024)
+    )
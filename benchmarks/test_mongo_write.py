@@ -0,0 +1,50 @@
+"""
+Write path of MongoCacheStorage with and without the data_for_human projection
+
+    python -m pytest benchmarks/test_mongo_write.py
+"""
+import email.utils
+
+import bson
+import pytest
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+
+from scrapy_httpcache.extensions.cache_storage.mongo import MongoCacheStorage
+
+
+def _response(size):
+    body = (
+        b"<html><body>"
+        + b"<p>lorem ipsum dolor sit amet</p>" * (size // 33)
+        + b"</body></html>"
+    )
+    return HtmlResponse(
+        "http://www.example.com/page",
+        headers={
+            "Content-Type": "text/html; charset=utf-8",
+            "Date": email.utils.formatdate(usegmt=True),
+            "Set-Cookie": [
+                "session=abc; expires=Wed, 21 Oct 2037 07:28:00 GMT; Path=/",
+                "tracking=def; Path=/; HttpOnly",
+            ],
+        },
+        body=body,
+    )
+
+
+@pytest.mark.parametrize("size", [10 * 1024, 2 * 1024 * 1024], ids=["10KB", "2MB"])
+@pytest.mark.parametrize("data_for_human", [True, False], ids=["human", "raw"])
+def test_build_update(benchmark, size, data_for_human):
+    storage = MongoCacheStorage(
+        Settings({"HTTPCACHE_MONGO_DATA_FOR_HUMAN": data_for_human})
+    )
+    request = Request("http://www.example.com/page")
+    response = _response(size)
+
+    def build():
+        # a fresh response, as the decoded text is cached on the instance
+        return bson.encode(storage._build_update(request, response.replace())["$set"])
+
+    document = benchmark(build)
+    benchmark.extra_info["document_size"] = len(document)
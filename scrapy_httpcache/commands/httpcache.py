@@ -0,0 +1,555 @@
+"""
+The ``httpcache`` command, available with
+``COMMANDS_MODULE = "scrapy_httpcache.commands"``
+"""
+import gzip
+import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from time import time
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from scrapy.commands import ScrapyCommand
+from scrapy.crawler import Crawler
+from scrapy.exceptions import UsageError
+from scrapy.http import Request
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.misc import load_object
+from twisted.internet.defer import Deferred
+
+from scrapy_httpcache import TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage import CacheStorage
+from scrapy_httpcache.extensions.cache_storage.export import dump_entry, iter_entries
+from scrapy_httpcache.extensions.cache_storage.file_system import (
+    FilesystemCacheStorage,
+)
+from scrapy_httpcache.extensions.gc import CacheCollector
+
+#: The upper bounds of the age histogram of ``stats``, in seconds
+AGE_BUCKETS: Tuple[Tuple[str, float], ...] = (
+    ("<1h", 3600),
+    ("<1d", 86400),
+    ("<1w", 7 * 86400),
+    ("<30d", 30 * 86400),
+    (">=30d", float("inf")),
+)
+DELETE_BATCH_SIZE = 1000
+# every entry is read, whether it expired or not, headers first
+READ_SETTINGS = {"HTTPCACHE_EXPIRATION_SECS": 0, "HTTPCACHE_LAZY_BODY": True}
+
+TResult = Dict[str, Any]
+
+
+def open_storage(settings: Dict[str, Any], name: str) -> Tuple[TSpider, CacheStorage]:
+    """
+    Open the storage of a spider outside of a crawl, the storage methods
+    return their results rather than Deferreds
+
+    :param settings: the settings of the spider
+    :type settings: Dict[str, Any]
+    :param name: the name of the spider
+    :type name: str
+    :return:
+    :rtype: Tuple[TSpider, CacheStorage]
+    :raises UsageError: if the storage is asynchronous
+    """
+    settings = dict(settings, HTTPCACHE_THREADED=False, TWISTED_REACTOR=None)
+    crawler = Crawler(Spider, Settings(settings))
+    spider = Spider.from_crawler(crawler, name=name)
+    storage = load_object(crawler.settings["HTTPCACHE_STORAGE"])(crawler.settings)
+    if isinstance(storage.open_spider(spider), Deferred):
+        raise UsageError("Asynchronous storages cannot be used outside of a crawl")
+    return spider, storage
+
+
+def retrieve_entry(
+    storage: CacheStorage, spider: TSpider, key: str
+) -> Optional[TResponse]:
+    """
+    Read a response listed by its key
+
+    :param storage:
+    :type storage: CacheStorage
+    :param spider:
+    :type spider: TSpider
+    :param key:
+    :type key: str
+    :return:
+    :rtype: Optional[TResponse]
+    """
+    request = Request("http://httpcache.invalid/%s" % key)
+    storage.fingerprinter.remember(request, key)
+    try:
+        return storage.retrieve_response(spider, request)
+    except (ValueError, IOError):
+        return  # corrupted
+
+
+@contextmanager
+def open_export(path: str, mode: str, compress: bool = False) -> Iterator[BinaryIO]:
+    """
+
+    :param path: the path of the export, ``-`` for stdin or stdout
+    :type path: str
+    :param mode: ``"rb"`` or ``"wb"``
+    :type mode: str
+    :param compress: whether the file is gzipped
+    :type compress: bool
+    :return:
+    :rtype: Iterator[BinaryIO]
+    """
+    if path == "-":
+        f = sys.stdin.buffer if mode == "rb" else sys.stdout.buffer
+        yield f
+        if mode == "wb":
+            f.flush()
+        return
+    with (gzip.open if compress else open)(path, mode) as f:
+        yield f
+
+
+def shard_stats(
+    spider: TSpider, storage: CacheStorage, shard: int, shards: int, options: TResult
+) -> TResult:
+    now = time()
+    result = {
+        "entries": 0,
+        "size": 0,
+        "unreadable": 0,
+        "ages": Counter(),
+        "statuses": Counter(),
+    }
+    for key, timestamp, size in storage.iter_shard_entries(spider, shard, shards):
+        result["entries"] += 1
+        result["size"] += size
+        age = now - timestamp
+        result["ages"][next(name for name, bound in AGE_BUCKETS if age < bound)] += 1
+        response = retrieve_entry(storage, spider, key)
+        if response is None:
+            result["unreadable"] += 1
+        else:
+            result["statuses"][response.status] += 1
+    return result
+
+
+def shard_prune(
+    spider: TSpider, storage: CacheStorage, shard: int, shards: int, options: TResult
+) -> TResult:
+    now = time()
+    older_than: int = options["older_than"]
+    statuses: List[int] = options["statuses"]
+    pattern = re.compile(options["url"]) if options["url"] else None
+    result = {"entries": 0, "deleted": 0}
+    batch: List[str] = []
+    for key, timestamp, _ in storage.iter_shard_entries(spider, shard, shards):
+        result["entries"] += 1
+        if older_than and now - timestamp < older_than:
+            continue
+        if statuses or pattern is not None:
+            response = retrieve_entry(storage, spider, key)
+            if response is None:
+                continue
+            if statuses and response.status not in statuses:
+                continue
+            if pattern is not None and not pattern.search(response.url):
+                continue
+        batch.append(key)
+        if len(batch) >= DELETE_BATCH_SIZE:
+            storage.delete_responses(spider, batch)
+            result["deleted"] += len(batch)
+            batch = []
+    if batch:
+        storage.delete_responses(spider, batch)
+        result["deleted"] += len(batch)
+    return result
+
+
+def shard_export(
+    spider: TSpider, storage: CacheStorage, shard: int, shards: int, options: TResult
+) -> TResult:
+    result = {"entries": 0, "size": 0}
+    with open_export(options["path"], "wb", options["compress"]) as f:
+        for key, timestamp, _ in storage.iter_shard_entries(spider, shard, shards):
+            response = retrieve_entry(storage, spider, key)
+            if response is None:
+                continue
+            entry = dump_entry(key, timestamp, response)
+            f.write(entry)
+            result["entries"] += 1
+            result["size"] += len(entry)
+    return result
+
+
+SHARD_ACTIONS: Dict[str, Callable[..., TResult]] = {
+    "stats": shard_stats,
+    "prune": shard_prune,
+    "export": shard_export,
+}
+
+
+def run_shard(
+    action: str,
+    settings: Dict[str, Any],
+    name: str,
+    shard: int,
+    shards: int,
+    options: TResult,
+) -> TResult:
+    """
+    Run an action over a shard of the entries of a spider, in a worker
+    process of the pool
+
+    :param action: ``"stats"``, ``"prune"`` or ``"export"``
+    :type action: str
+    :param settings:
+    :type settings: Dict[str, Any]
+    :param name: the name of the spider
+    :type name: str
+    :param shard:
+    :type shard: int
+    :param shards:
+    :type shards: int
+    :param options:
+    :type options: TResult
+    :return:
+    :rtype: TResult
+    """
+    spider, storage = open_storage(settings, name)
+    try:
+        return SHARD_ACTIONS[action](spider, storage, shard, shards, options)
+    finally:
+        storage.close_spider(spider)
+
+
+def merge_results(results: List[TResult]) -> TResult:
+    """
+    Sum the results of the shards, counts and counters
+
+    :param results:
+    :type results: List[TResult]
+    :return:
+    :rtype: TResult
+    """
+    merged: TResult = {}
+    for result in results:
+        for name, value in result.items():
+            merged[name] = merged[name] + value if name in merged else value
+    return merged
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_LEVEL": "WARNING"}
+
+    def syntax(self) -> str:
+        return (
+            "stats|prune|compact|reshard <spider> [<spider> ...]\n"
+            "       export|import <spider> <path>"
+        )
+
+    def short_desc(self) -> str:
+        return "Maintain the HTTP cache of spiders"
+
+    def long_desc(self) -> str:
+        return (
+            "Maintain the HTTP cache of spiders outside of a crawl, with the "
+            "HTTPCACHE_* settings of the project and spiders.\n\n"
+            "stats: the number, size, age and status of the entries\n"
+            "prune: delete the entries matching --older-than, --status and "
+            "--url, without any, delete the expired entries and beyond "
+            "HTTPCACHE_GC_MAX_SIZE bytes the least recently or frequently "
+            "used ones\n"
+            "compact: reclaim the space of the deleted entries\n"
+            "reshard: move the entries of the filesystem storage to the "
+            "directories of HTTPCACHE_FILESYSTEM_SHARD_DEPTH and _WIDTH\n"
+            "export: write the entries to a file, - for stdout, gzipped if "
+            "it ends with .gz\n"
+            "import: store the entries of an export, - for stdin, e.g. "
+            "piped from an export with another HTTPCACHE_STORAGE\n\n"
+            "The entries are split in shards by fingerprint, processed by "
+            "--jobs processes when the storage allows it."
+        )
+
+    def add_options(self, parser) -> None:
+        super(Command, self).add_options(parser)
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="number of processes (default: 1)",
+        )
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=0,
+            metavar="SECONDS",
+            help="prune the entries stored at least that long ago",
+        )
+        parser.add_argument(
+            "--status",
+            default="",
+            metavar="CODES",
+            help="prune the entries with these comma-separated statuses",
+        )
+        parser.add_argument(
+            "--url",
+            default="",
+            metavar="REGEX",
+            help="prune the entries whose URL matches",
+        )
+
+    def run(self, args: List[str], opts) -> None:
+        if len(args) < 2:
+            raise UsageError()
+        action, names = args[0], args[1:]
+        actions: Dict[str, Callable] = {
+            "stats": self.stats,
+            "prune": self.prune,
+            "compact": self.compact,
+            "reshard": self.reshard,
+            "export": self.export,
+            "import": self.import_,
+        }
+        if action not in actions:
+            raise UsageError("Unknown action: %s" % action)
+        if action in ("export", "import"):
+            if len(names) != 2:
+                raise UsageError("%s takes a spider and a path" % action)
+            actions[action](names[0], names[1], opts)
+            return
+        for name in names:
+            actions[action](name, opts)
+
+    def stats(self, name: str, opts) -> None:
+        """
+
+        :param name: the name of the spider
+        :type name: str
+        :param opts:
+        """
+        result = self._run_shards("stats", name, opts, READ_SETTINGS)
+        if result is None:
+            return  # cannot be listed
+        average = result["size"] // result["entries"] if result["entries"] else 0
+        print(
+            "%s: %d entries, %d bytes, %d bytes on average"
+            % (name, result["entries"], result["size"], average)
+        )
+        print(
+            "  age: %s"
+            % ", ".join(
+                "%s %d" % (bucket, result["ages"][bucket]) for bucket, _ in AGE_BUCKETS
+            )
+        )
+        print(
+            "  status: %s"
+            % ", ".join(
+                "%d %d" % (status, count)
+                for status, count in sorted(result["statuses"].items())
+            )
+        )
+        if result["unreadable"]:
+            print("  unreadable: %d" % result["unreadable"])
+
+    def prune(self, name: str, opts) -> None:
+        """
+
+        :param name: the name of the spider
+        :type name: str
+        :param opts:
+        """
+        statuses = [int(s) for s in opts.status.split(",") if s.strip()]
+        if not (opts.older_than or statuses or opts.url):
+            self._collect(name)
+            return
+        options = {"older_than": opts.older_than, "statuses": statuses, "url": opts.url}
+        result = self._run_shards("prune", name, opts, READ_SETTINGS, options)
+        if result is None:
+            return  # cannot be listed
+        print(
+            "%s: %d entries, %d deleted" % (name, result["entries"], result["deleted"])
+        )
+
+    def compact(self, name: str, opts) -> None:
+        """
+
+        :param name: the name of the spider
+        :type name: str
+        :param opts:
+        """
+        spider, storage = open_storage(self._settings(name), name)
+        try:
+            storage.compact(spider)
+        except NotImplementedError as e:
+            print("%s: cannot be compacted: %s" % (name, e))
+            return
+        finally:
+            storage.close_spider(spider)
+        print("%s: compacted" % name)
+
+    def reshard(self, name: str, opts) -> None:
+        """
+
+        :param name: the name of the spider
+        :type name: str
+        :param opts:
+        """
+        spider, storage = open_storage(self._settings(name), name)
+        try:
+            if not isinstance(storage, FilesystemCacheStorage):
+                print(
+                    "%s: cannot be resharded: %s is not sharded"
+                    % (name, type(storage).__name__)
+                )
+                return
+            moved = storage.reshard(spider)
+        finally:
+            storage.close_spider(spider)
+        print(
+            "%s: %d entries moved to %d levels of %d-character shards"
+            % ((name, moved) + storage.layout)
+        )
+
+    def export(self, name: str, path: str, opts) -> None:
+        """
+
+        :param name: the name of the spider
+        :type name: str
+        :param path:
+        :type path: str
+        :param opts:
+        """
+        compress = path.endswith(".gz")
+        jobs = self._jobs(name, opts)
+        if jobs == 1:
+            options = [{"path": path, "compress": compress}]
+            result = self._run_shards("export", name, opts, READ_SETTINGS, options)
+        else:
+            # the parts are concatenated, so are gzip members
+            tmpdir = tempfile.mkdtemp(
+                dir=None if path == "-" else os.path.dirname(os.path.abspath(path))
+            )
+            try:
+                options = [
+                    {
+                        "path": os.path.join(tmpdir, "%d.part" % shard),
+                        "compress": compress,
+                    }
+                    for shard in range(jobs)
+                ]
+                result = self._run_shards("export", name, opts, READ_SETTINGS, options)
+                if result is not None:
+                    with open_export(path, "wb") as f:
+                        for part in options:
+                            with open(part["path"], "rb") as p:
+                                shutil.copyfileobj(p, f)
+            finally:
+                shutil.rmtree(tmpdir)
+        if result is None:
+            return  # cannot be listed
+        print(
+            "%s: %d entries exported, %d bytes"
+            % (name, result["entries"], result["size"]),
+            file=sys.stderr if path == "-" else sys.stdout,
+        )
+
+    def import_(self, name: str, path: str, opts) -> None:
+        """
+        Store the entries of an export, at the time they were stored, so that
+        they keep their age
+
+        :param name: the name of the spider
+        :type name: str
+        :param path:
+        :type path: str
+        :param opts:
+        """
+        spider, storage = open_storage(self._settings(name), name)
+        count = 0
+        try:
+            with open_export(path, "rb", path.endswith(".gz")) as f:
+                for key, timestamp, response in iter_entries(f):
+                    request = Request(response.url)
+                    storage.fingerprinter.remember(request, key)
+                    storage.store_response(spider, request, response, timestamp)
+                    count += 1
+        finally:
+            storage.close_spider(spider)
+        print("%s: %d entries imported" % (name, count))
+
+    def _collect(self, name: str) -> None:
+        spider, storage = open_storage(self._settings(name), name)
+        try:
+            collector = CacheCollector(storage, spider.settings, spider.crawler.stats)
+            collector.open(spider)
+            try:
+                counts = collector.collect(spider)
+            except NotImplementedError as e:
+                print("%s: cannot be pruned: %s" % (name, e))
+                return
+            collector.close(spider)
+        finally:
+            storage.close_spider(spider)
+        print(
+            "%(name)s: %(entries)d entries, %(expired)d expired, %(evicted)d "
+            "evicted (%(evicted_bytes)d bytes), %(size)d bytes left"
+            % dict(counts, name=name)
+        )
+
+    def _run_shards(
+        self,
+        action: str,
+        name: str,
+        opts,
+        overrides: Dict[str, Any],
+        options: Optional[Any] = None,
+    ) -> Optional[TResult]:
+        # None if the storage cannot list its entries
+        settings = dict(self._settings(name), **overrides)
+        jobs = self._jobs(name, opts)
+        if not isinstance(options, list):
+            options = [options or {}] * jobs
+        try:
+            if jobs == 1:
+                return run_shard(action, settings, name, 0, 1, options[0])
+            with ProcessPoolExecutor(jobs) as pool:
+                futures = [
+                    pool.submit(
+                        run_shard, action, settings, name, shard, jobs, options[shard]
+                    )
+                    for shard in range(jobs)
+                ]
+                return merge_results([future.result() for future in futures])
+        except NotImplementedError as e:
+            print("%s: cannot be listed: %s" % (name, e))
+
+    def _jobs(self, name: str, opts) -> int:
+        if opts.jobs <= 1:
+            return 1
+        settings = Settings(self._settings(name))
+        storage = load_object(settings["HTTPCACHE_STORAGE"])(settings)
+        if not storage.multiprocess:
+            print(
+                "%s: %s cannot be used by several processes, using one"
+                % (name, type(storage).__name__),
+                file=sys.stderr,
+            )
+            return 1
+        return opts.jobs
+
+    def _settings(self, name: str) -> Dict[str, Any]:
+        # the cache settings of the spider apply, if it is one of the project
+        try:
+            spidercls = self.crawler_process.spider_loader.load(name)
+        except KeyError:
+            spidercls = Spider
+        settings = self.settings.copy()
+        spidercls.update_settings(settings)
+        return settings.copy_to_dict()
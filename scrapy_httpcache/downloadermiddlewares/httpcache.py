@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import logging
 from email.utils import formatdate
-from typing import Optional, Tuple, Union
+from time import perf_counter, time
+from typing import Dict, List, Optional, Tuple, Union
+from weakref import WeakKeyDictionary, WeakSet
 
 from scrapy import signals
 from scrapy.exceptions import IgnoreRequest, NotConfigured
@@ -27,16 +30,22 @@ from scrapy_httpcache import (
     TSpider,
     TStatsCollector,
 )
-from scrapy_httpcache.extensions.cache_storage.dbm import DbmCacheStorage
-from scrapy_httpcache.extensions.cache_storage.file_system import (
-    FilesystemCacheStorage,
-)
+from scrapy_httpcache import signals as httpcache_signals
+from scrapy_httpcache.extensions.cache_storage import AsyncCacheStorage, CacheStorage
+from scrapy_httpcache.extensions.cache_storage.threaded import ThreadedCacheStorage
+from scrapy_httpcache.extensions.cache_storage.wrapper import WrapperCacheStorage
+from scrapy_httpcache.extensions.gc import CacheCollector
+from scrapy_httpcache.extensions.metrics import CacheMetrics
 from scrapy_httpcache.extensions.policy.dummy import DummyPolicy
 from scrapy_httpcache.extensions.policy.rfc2616 import RFC2616Policy
 
+logger = logging.getLogger(__name__)
 
-class HttpCacheMiddleware(object):
+# the result of a prefetched lookup to be made again
+_LOOKUP = object()
 
+
+class HttpCacheMiddleware(object):
     DOWNLOAD_EXCEPTIONS: Tuple = (
         defer.TimeoutError,
         TimeoutError,
@@ -56,38 +65,286 @@ class HttpCacheMiddleware(object):
         self.policy: Union[DummyPolicy, RFC2616Policy] = load_object(
             settings["HTTPCACHE_POLICY"]
         )(settings)
-        self.storage: Union[DbmCacheStorage, FilesystemCacheStorage] = load_object(
-            settings["HTTPCACHE_STORAGE"]
-        )(settings)
+        self.storage: CacheStorage = load_object(settings["HTTPCACHE_STORAGE"])(
+            settings
+        )
+        # the wrapper storages only run their backend in threads
+        if settings.getbool("HTTPCACHE_THREADED") and not isinstance(
+            self.storage, (AsyncCacheStorage, WrapperCacheStorage)
+        ):
+            self.storage = ThreadedCacheStorage(settings, self.storage)
         self.ignore_missing: bool = settings.getbool("HTTPCACHE_IGNORE_MISSING")
+        self.max_body_size: int = settings.getint("HTTPCACHE_MAX_BODY_SIZE", 0)
         self.stats: TStatsCollector = stats
+        self.collector: Optional[CacheCollector] = (
+            CacheCollector(self.storage, settings, stats)
+            if settings.getbool("HTTPCACHE_GC_ENABLED")
+            else None
+        )
+        # the storages time their own phases too
+        self.metrics: Optional[CacheMetrics] = self.storage.metrics
+
+        # the lookups of the scheduled requests are batched and their results
+        # staged until the requests reach the middleware
+        self.prefetch_size: int = settings.getint("HTTPCACHE_PREFETCH_BATCH_SIZE", 0)
+        self.prefetch_max_staged: int = settings.getint(
+            "HTTPCACHE_PREFETCH_MAX_STAGED", 1000
+        )
+        self.prefetch_max_age: float = settings.getfloat(
+            "HTTPCACHE_PREFETCH_MAX_AGE", 60
+        )
+        self.prefetch_queue: List[TRequest] = []
+        # the response or None of every staged request, and the time it was
+        # looked up
+        self.staged: WeakKeyDictionary = WeakKeyDictionary()
+        # the requests of the batches in flight, and the Deferred of the
+        # middleware waiting for the lookup if the request reached it already
+        self.prefetching: WeakKeyDictionary = WeakKeyDictionary()
+        # the staged and in flight requests by fingerprint, for a store or a
+        # delete to drop theirs without fingerprinting all of them
+        self.staged_keys: Dict[str, WeakSet] = {}
 
     @classmethod
     def from_crawler(cls, crawler: TCrawler) -> HttpCacheMiddleware:
         o: HttpCacheMiddleware = cls(crawler.settings, crawler.stats)
         crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            o.response_delete, signal=httpcache_signals.response_delete
+        )
+        crawler.signals.connect(
+            o.responses_delete, signal=httpcache_signals.responses_delete
+        )
+        if o.prefetch_size > 0:
+            crawler.signals.connect(
+                o.request_scheduled, signal=signals.request_scheduled
+            )
         return o
 
-    def spider_opened(self, spider: TSpider) -> None:
-        self.storage.open_spider(spider)
+    def spider_opened(self, spider: TSpider) -> Optional[defer.Deferred]:
+        if self.metrics is not None:
+            self.metrics.start(spider, self.stats)
+        opened = self.storage.open_spider(spider)
+        if self.collector is None:
+            return opened
+        if isinstance(opened, defer.Deferred):
+            return opened.addCallback(lambda _: self._start_collector(spider))
+        self._start_collector(spider)
+
+    def _start_collector(self, spider: TSpider) -> None:
+        self.collector.open(spider)
+        self.collector.start(spider)
+
+    def spider_closed(self, spider: TSpider) -> Optional[defer.Deferred]:
+        if self.metrics is not None:
+            self.metrics.stop(spider)
+        if self.collector is None:
+            return self.storage.close_spider(spider)
+        # the storage is closed once the running slice of the collector is done
+        stopped = self.collector.stop()
+        self.collector.close(spider)
+        if isinstance(stopped, defer.Deferred):
+            return stopped.addCallback(lambda _: self.storage.close_spider(spider))
+        return self.storage.close_spider(spider)
+
+    def response_delete(
+        self,
+        request: TRequest,
+        spider: TSpider,
+        response: Optional[TResponse] = None,
+    ) -> Optional[defer.Deferred]:
+        # neither the staged lookup nor the stale response are served anymore
+        self._unstage(request)
+        request.meta.pop("cached_response", None)
+        self.stats.inc_value("httpcache/delete", spider=spider)
+        if self.collector is not None:
+            self.collector.accesses.discard(
+                [self.storage.fingerprinter.fingerprint(request)]
+            )
+        return self.storage.delete_response(request, response, spider)
+
+    def responses_delete(
+        self, fingerprints: List[str], spider: TSpider
+    ) -> Optional[defer.Deferred]:
+        self._unstage(None)
+        self.stats.inc_value("httpcache/delete", len(fingerprints), spider=spider)
+        if self.collector is not None:
+            self.collector.accesses.discard(fingerprints)
+        return self.storage.delete_responses(spider, fingerprints)
+
+    def request_scheduled(self, request: TRequest, spider: TSpider) -> None:
+        if request.meta.get("dont_cache", False):
+            return
+        if not self.policy.should_cache_request(request):
+            return
+        staged = len(self.staged) + len(self.prefetching) + len(self.prefetch_queue)
+        if staged >= self.prefetch_max_staged:
+            return  # looked up when it reaches the middleware
+        self.prefetch_queue.append(request)
+        if len(self.prefetch_queue) >= self.prefetch_size:
+            self._prefetch(spider)
+
+    def _prefetch(self, spider: TSpider) -> None:
+        requests, self.prefetch_queue = self.prefetch_queue, []
+        self.stats.inc_value("httpcache/prefetch/batch", spider=spider)
+        responses = self.storage.retrieve_responses(spider, requests)
+        for request in requests:
+            self._index(request)
+        if isinstance(responses, defer.Deferred):
+            # the requests reaching the middleware meanwhile wait for the batch
+            for request in requests:
+                self.prefetching[request] = None
+            responses.addCallbacks(
+                self._stage,
+                self._prefetch_failed,
+                callbackArgs=(requests,),
+                errbackArgs=(requests, spider),
+            )
+        else:
+            staged = time()
+            for request, response in zip(requests, responses):
+                self.staged[request] = (response, staged)
+
+    def _stage(
+        self, responses: List[Optional[TResponse]], requests: List[TRequest]
+    ) -> None:
+        staged = time()
+        for request, response in zip(requests, responses):
+            if request not in self.prefetching:
+                continue  # stored or deleted meanwhile
+            waiting = self.prefetching.pop(request)
+            if waiting is None:
+                self.staged[request] = (response, staged)
+            else:
+                self._unindex(request)
+                waiting.callback(response)
+
+    def _prefetch_failed(
+        self, failure, requests: List[TRequest], spider: TSpider
+    ) -> None:
+        logger.warning(
+            "Prefetching cached responses failed: %(error)s"
+            % {"error": failure.getErrorMessage()},
+            extra={"spider": spider},
+        )
+        for request in requests:
+            if request not in self.prefetching:
+                continue  # stored or deleted meanwhile
+            self._unindex(request)
+            waiting = self.prefetching.pop(request)
+            if waiting is not None:
+                waiting.callback(_LOOKUP)
 
-    def spider_closed(self, spider: TSpider) -> None:
-        self.storage.close_spider(spider)
+    def _unstage(self, request: Optional[TRequest]) -> None:
+        """
+        Drop the staged lookups of the entry of a request, all of them if
+        None, once it was stored or deleted
+
+        The lookups in flight are made again by the requests waiting for them.
+        """
+        if request is None:
+            others = list(self.staged.keys()) + list(self.prefetching.keys())
+            self.staged_keys.clear()
+        else:
+            key = self.storage.fingerprinter.fingerprint(request)
+            others = list(self.staged_keys.pop(key, ()))
+        for other in others:
+            self.staged.pop(other, None)
+            waiting = self.prefetching.pop(other, None)
+            if waiting is not None:
+                waiting.callback(_LOOKUP)
+
+    def _index(self, request: TRequest) -> None:
+        key = self.storage.fingerprinter.fingerprint(request)
+        self.staged_keys.setdefault(key, WeakSet()).add(request)
+        if len(self.staged_keys) > 2 * self.prefetch_max_staged:
+            # the fingerprints of the requests dropped before reaching the
+            # middleware, rarely pruned
+            self.staged_keys = {
+                key: requests for key, requests in self.staged_keys.items() if requests
+            }
+
+    def _unindex(self, request: TRequest) -> None:
+        key = self.storage.fingerprinter.fingerprint(request)
+        requests = self.staged_keys.get(key)
+        if requests is not None:
+            requests.discard(request)
+            if not requests:
+                del self.staged_keys[key]
 
     def process_request(
         self, request: TRequest, spider: TSpider
-    ) -> Optional[TResponse]:
+    ) -> Union[Optional[TResponse], defer.Deferred]:
         if request.meta.get("dont_cache", False):
             return
 
         # Skip uncacheable requests
-        if not self.policy.should_cache_request(request):
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter()
+            cacheable = self.policy.should_cache_request(request)
+            metrics.record("policy", perf_counter() - start)
+        else:
+            cacheable = self.policy.should_cache_request(request)
+        if not cacheable:
             request.meta["_dont_cache"] = True  # flag as uncacheable
             return
 
+        # The start of a crawl, or the scheduler was drained faster than the
+        # batches filled
+        if self.prefetch_queue:
+            self._prefetch(spider)
+        if request in self.prefetching:
+            # its batch is in flight, the lookup is awaited rather than repeated
+            self.stats.inc_value("httpcache/prefetch/awaited", spider=spider)
+            waiting = self.prefetching[request] = defer.Deferred()
+            return waiting.addCallback(self._process_prefetched, request, spider)
+        if request in self.staged:
+            cachedresponse, staged = self.staged.pop(request)
+            self._unindex(request)
+            if self.prefetch_max_age <= 0 or time() - staged <= self.prefetch_max_age:
+                self.stats.inc_value("httpcache/prefetch/staged", spider=spider)
+                return self._process_cachedresponse(cachedresponse, request, spider)
+            # may have expired since
+            self.stats.inc_value("httpcache/prefetch/outdated", spider=spider)
+        return self._retrieve(request, spider)
+
+    def _process_prefetched(
+        self, cachedresponse, request: TRequest, spider: TSpider
+    ) -> Union[Optional[TResponse], defer.Deferred]:
+        if cachedresponse is _LOOKUP:
+            return self._retrieve(request, spider)
+        return self._process_cachedresponse(cachedresponse, request, spider)
+
+    def _retrieve(
+        self, request: TRequest, spider: TSpider
+    ) -> Union[Optional[TResponse], defer.Deferred]:
+        metrics = self.metrics
         # Look for cached response and check if expired
-        cachedresponse: TResponse = self.storage.retrieve_response(spider, request)
+        if metrics is not None:
+            # computed once per request, the storage reuses it
+            start = perf_counter()
+            self.storage.fingerprinter.fingerprint(request)
+            metrics.record("fingerprint", perf_counter() - start)
+            start = perf_counter()
+        cachedresponse = self.storage.retrieve_response(spider, request)
+        if isinstance(cachedresponse, defer.Deferred):
+            if metrics is not None:
+                cachedresponse.addCallback(self._record, "retrieve", start)
+            return cachedresponse.addCallback(
+                self._process_cachedresponse, request, spider
+            )
+        if metrics is not None:
+            metrics.record("retrieve", perf_counter() - start)
+        return self._process_cachedresponse(cachedresponse, request, spider)
+
+    def _record(self, result, phase: str, start: float):
+        self.metrics.record(phase, perf_counter() - start)
+        return result
+
+    def _process_cachedresponse(
+        self, cachedresponse: Optional[TResponse], request: TRequest, spider: TSpider
+    ) -> Optional[TResponse]:
         if cachedresponse is None:
             self.stats.inc_value("httpcache/miss", spider=spider)
             if self.ignore_missing:
@@ -95,9 +352,18 @@ class HttpCacheMiddleware(object):
                 raise IgnoreRequest("Ignored request not in cache: %s" % request)
             return  # first time request
 
+        if self.collector is not None:
+            self.collector.touch(self.storage.fingerprinter.fingerprint(request))
+
         # Return cached response only if not expired
         cachedresponse.flags.append("cached")
-        if self.policy.is_cached_response_fresh(cachedresponse, request):
+        if self.metrics is not None:
+            start = perf_counter()
+            fresh = self.policy.is_cached_response_fresh(cachedresponse, request)
+            self.metrics.record("policy", perf_counter() - start)
+        else:
+            fresh = self.policy.is_cached_response_fresh(cachedresponse, request)
+        if fresh:
             self.stats.inc_value("httpcache/hit", spider=spider)
             return cachedresponse
 
@@ -107,7 +373,7 @@ class HttpCacheMiddleware(object):
 
     def process_response(
         self, request: TRequest, response: TResponse, spider: TSpider
-    ) -> TResponse:
+    ) -> Union[TResponse, defer.Deferred]:
         if request.meta.get("dont_cache", False):
             return response
 
@@ -125,16 +391,24 @@ class HttpCacheMiddleware(object):
         cachedresponse: Optional[TResponse] = request.meta.pop("cached_response", None)
         if cachedresponse is None:
             self.stats.inc_value("httpcache/firsthand", spider=spider)
-            self._cache_response(spider, response, request, cachedresponse)
-            return response
+            return self._cache_response(spider, response, request, cachedresponse)
 
-        if self.policy.is_cached_response_valid(cachedresponse, response, request):
+        if self.metrics is not None:
+            start = perf_counter()
+            valid = self.policy.is_cached_response_valid(
+                cachedresponse, response, request
+            )
+            self.metrics.record("policy", perf_counter() - start)
+        else:
+            valid = self.policy.is_cached_response_valid(
+                cachedresponse, response, request
+            )
+        if valid:
             self.stats.inc_value("httpcache/revalidate", spider=spider)
             return cachedresponse
 
         self.stats.inc_value("httpcache/invalidate", spider=spider)
-        self._cache_response(spider, response, request, cachedresponse)
-        return response
+        return self._cache_response(spider, response, request, cachedresponse)
 
     def process_exception(
         self, request: TRequest, exception: TException, spider: TSpider
@@ -152,9 +426,35 @@ class HttpCacheMiddleware(object):
         response: TResponse,
         request: TRequest,
         cachedresponse: Optional[TResponse],
-    ) -> None:
-        if self.policy.should_cache_response(response, request):
+    ) -> Union[TResponse, defer.Deferred]:
+        if 0 < self.max_body_size < len(response.body):
+            self.stats.inc_value("httpcache/too_large", spider=spider)
+            return response
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter()
+            cacheable = self.policy.should_cache_response(response, request)
+            metrics.record("policy", perf_counter() - start)
+            start = perf_counter()
+        else:
+            cacheable = self.policy.should_cache_response(response, request)
+        if cacheable:
             self.stats.inc_value("httpcache/store", spider=spider)
-            self.storage.store_response(spider, request, response)
+            stored = self.storage.store_response(spider, request, response)
+            if isinstance(stored, defer.Deferred):
+                if metrics is not None:
+                    stored.addCallback(self._record, "store", start)
+                return stored.addCallback(self._stored, request, response)
+            if metrics is not None:
+                metrics.record("store", perf_counter() - start)
+            self._stored(None, request, response)
         else:
             self.stats.inc_value("httpcache/uncacheable", spider=spider)
+        return response
+
+    def _stored(self, _, request: TRequest, response: TResponse) -> TResponse:
+        # the lookups staged before are outdated, e.g. of a request not
+        # filtered as a duplicate
+        if self.staged or self.prefetching:
+            self._unstage(request)
+        return response
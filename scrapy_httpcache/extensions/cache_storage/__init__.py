@@ -1,13 +1,45 @@
 """
 The metaclass of cache storage
 """
+import zlib
 from abc import ABCMeta, abstractmethod
-from typing import Optional
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Type
 
+from scrapy.exceptions import NotConfigured
 from scrapy.settings import Settings
-from scrapy.utils.request import request_fingerprint
+from scrapy.utils.misc import load_object
+from twisted.internet.defer import Deferred, gatherResults
 
 from scrapy_httpcache import TRequest, TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage.compression import Codec, get_codec
+from scrapy_httpcache.extensions.cache_storage.lazy import (
+    MissingBodyError,
+    lazy_response_class,
+)
+from scrapy_httpcache.extensions.fingerprint import RequestFingerprinter
+from scrapy_httpcache.extensions.metrics import CacheMetrics
+
+
+def key_range(shard: int, shards: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    The range of the keys of a shard, for the storages sorted by key to read
+    only that shard. The bounds split the hexadecimal keys evenly, and keys of
+    any other form still fall in exactly one shard.
+
+    >>> key_range(0, 2), key_range(1, 2)
+    ((None, '8000'), ('8000', None))
+
+    :param shard: the shard, from 0 to ``shards`` - 1
+    :type shard: int
+    :param shards: the number of shards
+    :type shards: int
+    :return: the keys of the shard are above the first bound and up to the
+        second, unbounded if None
+    :rtype: Tuple[Optional[str], Optional[str]]
+    """
+    bounds = [None] + ["%04x" % (i * 0x10000 // shards) for i in range(1, shards)]
+    return bounds[shard], (bounds + [None])[shard + 1]
 
 
 class CacheStorage(metaclass=ABCMeta):
@@ -15,6 +47,14 @@ class CacheStorage(metaclass=ABCMeta):
     The metaclass of cache storage
     """
 
+    #: Whether the storage methods can be called concurrently from several
+    #: threads, see :class:`ThreadedCacheStorage`
+    thread_safe: bool = False
+
+    #: Whether several processes can use the storage of a spider at once, e.g.
+    #: the workers of the ``httpcache`` command
+    multiprocess: bool = False
+
     def __init__(self, settings: Settings):
         """
 
@@ -23,6 +63,34 @@ class CacheStorage(metaclass=ABCMeta):
         """
         self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
 
+        self.settings = settings
+        compression = settings.get("HTTPCACHE_COMPRESSION")
+        self.codec: Optional[Codec] = (
+            get_codec(compression, settings) if compression else None
+        )
+        self.compression_min_size: int = settings.getint(
+            "HTTPCACHE_COMPRESSION_MIN_SIZE", 1024
+        )
+        # None for the recorded codecs that cannot be decoded
+        self._codecs: Dict[str, Optional[Codec]] = {}
+        if self.codec is not None:
+            self._codecs[self.codec.name] = self.codec
+
+        self.mmap_min_size: int = settings.getint("HTTPCACHE_MMAP_MIN_SIZE", 0)
+        self.lazy_body: bool = settings.getbool("HTTPCACHE_LAZY_BODY")
+
+        self.fingerprinter: RequestFingerprinter = load_object(
+            settings.get(
+                "HTTPCACHE_FINGERPRINTER",
+                "scrapy_httpcache.extensions.fingerprint.RequestFingerprinter",
+            )
+        )(settings)
+        self.metrics: Optional[CacheMetrics] = (
+            CacheMetrics(settings)
+            if settings.getbool("HTTPCACHE_METRICS_ENABLED")
+            else None
+        )
+
     @abstractmethod
     def open_spider(self, spider: TSpider) -> None:
         """
@@ -53,7 +121,11 @@ class CacheStorage(metaclass=ABCMeta):
 
     @abstractmethod
     def store_response(
-        self, spider: TSpider, request: TRequest, response: TResponse
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
     ) -> None:
         """
 
@@ -63,8 +135,27 @@ class CacheStorage(metaclass=ABCMeta):
         :type request: TRequest
         :param response:
         :type response: TResponse
+        :param timestamp: when the response was stored, now if None, e.g.
+            the original time of an imported entry
+        :type timestamp: Optional[float]
         """
 
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> List[Optional[TResponse]]:
+        """
+        Look up several responses at once, storages with a multi-get override
+        it to save the round trips
+
+        :param spider:
+        :type spider: TSpider
+        :param requests:
+        :type requests: List[TRequest]
+        :return: the cached response or None of every request, in order
+        :rtype: List[Optional[TResponse]]
+        """
+        return [self.retrieve_response(spider, request) for request in requests]
+
     def _request_key(self, request: TRequest) -> str:
         """
 
@@ -73,19 +164,265 @@ class CacheStorage(metaclass=ABCMeta):
         :return:
         :rtype: str
         """
-        return request_fingerprint(request)
+        return self.fingerprinter.fingerprint(request)
+
+    def _encode_body(self, body: bytes) -> Tuple[Optional[str], bytes]:
+        """
+        Compress the body with the configured codec, unless it is too small
+
+        :param body:
+        :type body: bytes
+        :return: the name of the codec to record with the entry, or None if
+            the body is stored raw, and the encoded body
+        :rtype: Tuple[Optional[str], bytes]
+        """
+        if self.codec is None or len(body) < self.compression_min_size:
+            if self.metrics is not None:
+                self.metrics.count_bytes("written", len(body), len(body))
+            return None, body
+        if self.metrics is None:
+            return self.codec.name, self.codec.compress(body)
+        start = perf_counter()
+        encoded = self.codec.compress(body)
+        self.metrics.record("encode", perf_counter() - start)
+        self.metrics.count_bytes("written", len(encoded), len(body))
+        return self.codec.name, encoded
+
+    def _decode_body(self, codec: Optional[str], body: bytes) -> bytes:
+        """
+        Decompress a body with the codec recorded with its entry, whatever the
+        current ``HTTPCACHE_COMPRESSION`` is
+
+        :param codec:
+        :type codec: Optional[str]
+        :param body:
+        :type body: bytes
+        :return:
+        :rtype: bytes
+        """
+        if codec is None:
+            if self.metrics is not None:
+                self.metrics.count_bytes("read", len(body), len(body))
+            return body
+        if not self._can_decode(codec):
+            raise MissingBodyError("Unknown cache compression codec: %s" % codec)
+        if self.metrics is None:
+            return self._codecs[codec].decompress(body)
+        start = perf_counter()
+        decoded = self._codecs[codec].decompress(body)
+        self.metrics.record("decode", perf_counter() - start)
+        self.metrics.count_bytes("read", len(body), len(decoded))
+        return decoded
+
+    def _can_decode(self, codec: Optional[str]) -> bool:
+        """
+        Whether a body can be decompressed with the codec recorded with its
+        entry, not if e.g. it was compressed with another zstd dictionary than
+        the configured one, the entry is missed then
+
+        :param codec: the codec recorded with the body
+        :type codec: Optional[str]
+        :return:
+        :rtype: bool
+        """
+        if codec is None:
+            return True
+        if codec not in self._codecs:
+            try:
+                decoder = get_codec(codec, self.settings)
+            except NotConfigured:
+                # unknown, or its package or dictionary is missing
+                decoder = None
+            self._codecs[codec] = (
+                decoder if decoder is not None and decoder.name == codec else None
+            )
+        return self._codecs[codec] is not None
+
+    def _use_mmap(self, codec: Optional[str], length: int) -> bool:
+        """
+        Whether a stored body is better memory-mapped than read
+
+        :param codec: the codec recorded with the body
+        :type codec: Optional[str]
+        :param length: the length of the stored body
+        :type length: int
+        :return:
+        :rtype: bool
+        """
+        return codec is None and 0 < self.mmap_min_size <= length
+
+    def _lazy_response(
+        self,
+        respcls: Type[TResponse],
+        codec: Optional[str],
+        body_loader: Callable[[], bytes],
+        **kwargs
+    ) -> TResponse:
+        """
+        A response whose body is read and decompressed on first access
+
+        :param respcls:
+        :type respcls: Type[TResponse]
+        :param codec: the codec recorded with the body
+        :type codec: Optional[str]
+        :param body_loader: reads the stored body
+        :type body_loader: Callable[[], bytes]
+        :return:
+        :rtype: TResponse
+        """
+        return lazy_response_class(respcls)(
+            body_loader=lambda: self._decode_body(codec, body_loader()), **kwargs
+        )
 
     def delete_response(
         self, request: TRequest, response: TResponse, spider: TSpider, *args, **kwargs
-    ) -> None:
+    ) -> Optional[Deferred]:
         """
+        Delete the response stored for a request, see
+        :data:`scrapy_httpcache.signals.response_delete`
 
         :param request:
         :type request: TRequest
-        :param response:
+        :param response: the response found invalid, if any
         :type response: TResponse
         :param spider:
         :type spider: TSpider
         :return:
-        :rtype: None
+        :rtype: Optional[Deferred]
+        :raises NotImplementedError: if the storage cannot delete responses
+        """
+        return self.delete_responses(spider, [self._request_key(request)])
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        """
+        The keys of the stored responses, expired or not
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[str]
+        :raises NotImplementedError: if the storage cannot list its keys
+        """
+        raise NotImplementedError("%s cannot list its keys" % type(self).__name__)
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        """
+        The keys, storage times and sizes of the stored responses, expired or
+        not, for the garbage collection, see :class:`CacheCollector`
+
+        :param spider:
+        :type spider: TSpider
+        :return: the key, the timestamp and the size in bytes of every entry
+        :rtype: Iterator[Tuple[str, float, int]]
+        :raises NotImplementedError: if the storage cannot list its entries
+        """
+        raise NotImplementedError("%s cannot list its entries" % type(self).__name__)
+
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        """
+        The entries of a shard of the keys, for several processes to list the
+        entries in parallel
+
+        The storages that can read only the entries of the shard override it,
+        e.g. by :func:`key_range`, by default every entry is listed and those
+        whose key hashes to the shard are kept.
+
+        :param spider:
+        :type spider: TSpider
+        :param shard: the shard, from 0 to ``shards`` - 1
+        :type shard: int
+        :param shards: the number of shards
+        :type shards: int
+        :return: the key, the timestamp and the size in bytes of every entry
+            of the shard
+        :rtype: Iterator[Tuple[str, float, int]]
+        :raises NotImplementedError: if the storage cannot list its entries
+        """
+        for entry in self.iter_entries(spider):
+            if shards == 1 or zlib.crc32(entry[0].encode()) % shards == shard:
+                yield entry
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        """
+        Delete the responses stored under the given keys, the missing ones are
+        ignored
+
+        :param spider:
+        :type spider: TSpider
+        :param fingerprints: the keys of the responses
+        :type fingerprints: List[str]
+        :raises NotImplementedError: if the storage cannot delete responses
+        """
+        raise NotImplementedError("%s cannot delete responses" % type(self).__name__)
+
+    def compact(self, spider: TSpider) -> None:
+        """
+        Reclaim the space of the deleted and superseded responses
+
+        :param spider:
+        :type spider: TSpider
+        :raises NotImplementedError: if the storage cannot be compacted
+        """
+        raise NotImplementedError("%s cannot be compacted" % type(self).__name__)
+
+
+class AsyncCacheStorage(CacheStorage, metaclass=ABCMeta):
+    """
+    The metaclass of cache storage whose I/O does not block the reactor
+
+    ``open_spider`` and ``close_spider`` may return a Deferred, while
+    ``retrieve_response`` and ``store_response`` always return one.
+    """
+
+    @abstractmethod
+    def retrieve_response(self, spider: TSpider, request: TRequest) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param request:
+        :type request: TRequest
+        :return: a Deferred firing with the cached response or None
+        :rtype: Deferred
+        """
+
+    @abstractmethod
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param request:
+        :type request: TRequest
+        :param response:
+        :type response: TResponse
+        :param timestamp: when the response was stored, now if None, e.g.
+            the original time of an imported entry
+        :type timestamp: Optional[float]
+        :return: a Deferred firing with None once the response is stored
+        :rtype: Deferred
+        """
+
+    def retrieve_responses(self, spider: TSpider, requests: List[TRequest]) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param requests:
+        :type requests: List[TRequest]
+        :return: a Deferred firing with the cached response or None of every
+            request, in order
+        :rtype: Deferred
         """
+        return gatherResults(
+            [self.retrieve_response(spider, request) for request in requests],
+            consumeErrors=True,
+        )
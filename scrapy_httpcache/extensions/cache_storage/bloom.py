@@ -0,0 +1,299 @@
+"""
+The Bloom filter cache storage
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+from threading import Lock
+from typing import Iterator, List, Optional, Union
+
+from scrapy.settings import Settings
+from scrapy.utils.project import data_path
+from twisted.internet.defer import Deferred
+
+from scrapy_httpcache import TRequest, TResponse, TSpider, TStatsCollector
+from scrapy_httpcache.extensions.cache_storage.wrapper import WrapperCacheStorage
+
+logger = logging.getLogger(__name__)
+
+BLOOM_SUFFIX = ".bloom"
+BLOOM_MAGIC = b"SHCB"
+BLOOM_VERSION = 1
+# magic, version, number of bits, number of hashes and number of adds
+BLOOM_HEADER = struct.Struct(">4sBQBQ")
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of cache keys
+
+    The positions are derived from a single 128 bits hash of the key by
+    double hashing.
+    """
+
+    def __init__(self, bits: int, hashes: int):
+        """
+
+        :param bits: the size of the filter
+        :type bits: int
+        :param hashes: the number of positions set per key
+        :type hashes: int
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        """
+        The smallest filter with the given false positive rate once it holds
+        ``capacity`` keys
+
+        :param capacity:
+        :type capacity: int
+        :param error_rate:
+        :type error_rate: float
+        :return:
+        :rtype: BloomFilter
+        """
+        bits = max(
+            8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        )
+        hashes = max(1, int(round(bits / capacity * math.log(2))))
+        return cls(bits, hashes)
+
+    def _positions(self, key: str) -> Iterator[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        array = self.array
+        return all(
+            array[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Write the filter atomically
+
+        :param path:
+        :type path: str
+        """
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    BLOOM_HEADER.pack(
+                        BLOOM_MAGIC, BLOOM_VERSION, self.bits, self.hashes, self.count
+                    )
+                )
+                f.write(self.array)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        """
+
+        :param path:
+        :type path: str
+        :return:
+        :rtype: BloomFilter
+        :raises ValueError: if the file is not a filter
+        """
+        with open(path, "rb") as f:
+            header = f.read(BLOOM_HEADER.size)
+            if len(header) < BLOOM_HEADER.size:
+                raise ValueError("Not a Bloom filter: %r" % path)
+            magic, version, bits, hashes, count = BLOOM_HEADER.unpack(header)
+            if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+                raise ValueError("Not a Bloom filter: %r" % path)
+            bloom = cls(bits, hashes)
+            if f.readinto(bloom.array) != len(bloom.array):
+                raise ValueError("Truncated Bloom filter: %r" % path)
+        bloom.count = count
+        return bloom
+
+
+class BloomFilterCacheStorage(WrapperCacheStorage):
+    """
+    Skip the lookups of the responses that are certainly not in the storage
+
+    A Bloom filter of the stored keys, sized by ``HTTPCACHE_BLOOM_CAPACITY``
+    and ``HTTPCACHE_BLOOM_ERROR_RATE``, sits in front of
+    ``HTTPCACHE_BLOOM_STORAGE``. It is saved next to the cache when the spider
+    is closed and removed while it is open, so that a crawl that did not
+    finish cleanly rebuilds it from :meth:`CacheStorage.iter_keys`. Without a
+    saved filter nor ``iter_keys``, every lookup goes to the storage.
+
+    The filter only tracks the stores of this process, do not use it for a
+    cache written by several crawls at once. The keys of deleted responses
+    cannot be removed, they remain false positives until the filter is
+    rebuilt.
+    """
+
+    storage_setting = "HTTPCACHE_BLOOM_STORAGE"
+
+    def __init__(self, settings: Settings):
+        super(BloomFilterCacheStorage, self).__init__(settings)
+        # every process would save its own filter
+        self.multiprocess = False
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.capacity: int = settings.getint("HTTPCACHE_BLOOM_CAPACITY", 1000000)
+        self.error_rate: float = settings.getfloat("HTTPCACHE_BLOOM_ERROR_RATE", 0.01)
+        self.bloom: Optional[BloomFilter] = None
+        self.lock: Lock = Lock()
+        self.stats: Optional[TStatsCollector] = None
+        self.skipped: int = 0
+        self.false_positives: int = 0
+
+    def open_spider(self, spider: TSpider) -> Optional[Deferred]:
+        self.stats = spider.crawler.stats
+        opened = super(BloomFilterCacheStorage, self).open_spider(spider)
+        if isinstance(opened, Deferred):
+            return opened.addCallback(lambda _: self._open_bloom(spider))
+        self._open_bloom(spider)
+
+    def close_spider(self, spider: TSpider) -> Optional[Deferred]:
+        if self.bloom is not None:
+            self.bloom.save(self._bloom_path(spider))
+        return super(BloomFilterCacheStorage, self).close_spider(spider)
+
+    def retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Union[Optional[TResponse], Deferred]:
+        if self.bloom is None:
+            return super(BloomFilterCacheStorage, self).retrieve_response(
+                spider, request
+            )
+        if self._request_key(request) not in self.bloom:
+            self.skipped += 1
+            self.stats.inc_value("httpcache/bloom/skipped", spider=spider)
+            self._set_false_positive_rate(spider)
+            return  # not cached
+        response = super(BloomFilterCacheStorage, self).retrieve_response(
+            spider, request
+        )
+        if isinstance(response, Deferred):
+            return response.addCallback(self._check_false_positive, spider)
+        return self._check_false_positive(response, spider)
+
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> Union[List[Optional[TResponse]], Deferred]:
+        if self.bloom is None:
+            return super(BloomFilterCacheStorage, self).retrieve_responses(
+                spider, requests
+            )
+        maybe = [r for r in requests if self._request_key(r) in self.bloom]
+        skipped = len(requests) - len(maybe)
+        if skipped:
+            self.skipped += skipped
+            self.stats.inc_value("httpcache/bloom/skipped", skipped, spider=spider)
+            self._set_false_positive_rate(spider)
+        responses = super(BloomFilterCacheStorage, self).retrieve_responses(
+            spider, maybe
+        )
+        if isinstance(responses, Deferred):
+            return responses.addCallback(self._merge, requests, maybe, spider)
+        return self._merge(responses, requests, maybe, spider)
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Optional[Deferred]:
+        if self.bloom is not None:
+            with self.lock:
+                self.bloom.add(self._request_key(request))
+            if self.bloom.count == self.capacity + 1:
+                logger.warning(
+                    "The Bloom filter holds more than %(capacity)d keys, its "
+                    "false positive rate grows, raise HTTPCACHE_BLOOM_CAPACITY"
+                    % {"capacity": self.capacity},
+                    extra={"spider": spider},
+                )
+        return super(BloomFilterCacheStorage, self).store_response(
+            spider, request, response, timestamp
+        )
+
+    def _bloom_path(self, spider: TSpider) -> str:
+        return os.path.join(self.cachedir, spider.name + BLOOM_SUFFIX)
+
+    def _open_bloom(self, spider: TSpider) -> None:
+        path = self._bloom_path(spider)
+        expected = BloomFilter.for_capacity(self.capacity, self.error_rate)
+        try:
+            bloom = BloomFilter.load(path)
+        except FileNotFoundError:
+            bloom = None
+        except ValueError as e:
+            logger.warning("%(error)s, rebuilding it" % {"error": e})
+            bloom = None
+        if bloom is not None:
+            # stale once stores happen, until it is saved again
+            os.remove(path)
+            if (bloom.bits, bloom.hashes) != (expected.bits, expected.hashes):
+                bloom = None  # sized for other settings
+        if bloom is None:
+            bloom = expected
+            try:
+                for key in self.storage.iter_keys(spider):
+                    bloom.add(key)
+            except NotImplementedError as e:
+                logger.warning(
+                    "Not using a Bloom filter: %(error)s" % {"error": e},
+                    extra={"spider": spider},
+                )
+                return
+        self.bloom = bloom
+        logger.debug(
+            "Using a Bloom filter of %(bits)d bits holding %(count)d keys"
+            % {"bits": bloom.bits, "count": bloom.count},
+            extra={"spider": spider},
+        )
+
+    def _merge(
+        self,
+        responses: List[Optional[TResponse]],
+        requests: List[TRequest],
+        maybe: List[TRequest],
+        spider: TSpider,
+    ) -> List[Optional[TResponse]]:
+        found = {}
+        for request, response in zip(maybe, responses):
+            found[id(request)] = self._check_false_positive(response, spider)
+        return [found.get(id(request)) for request in requests]
+
+    def _check_false_positive(
+        self, response: Optional[TResponse], spider: TSpider
+    ) -> Optional[TResponse]:
+        # expired responses count as false positives too
+        if response is None:
+            self.false_positives += 1
+            self.stats.inc_value("httpcache/bloom/false_positive", spider=spider)
+            self._set_false_positive_rate(spider)
+        return response
+
+    def _set_false_positive_rate(self, spider: TSpider) -> None:
+        self.stats.set_value(
+            "httpcache/bloom/false_positive_rate",
+            self.false_positives / (self.false_positives + self.skipped),
+            spider=spider,
+        )
@@ -0,0 +1,222 @@
+"""
+The codecs compressing the cached bodies
+"""
+import gzip
+import lzma
+import zlib
+from threading import local
+from typing import Dict, Iterable, Optional, Type
+
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import Settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Codec(object):
+    """
+    The base class of codecs, the name is recorded with every compressed entry,
+    followed by ``:`` and a variant, if any, that only the codec configured
+    alike can decode
+    """
+
+    name: str = ""
+
+    def __init__(self, settings: Settings):
+        """
+
+        :param settings:
+        :type settings: Settings
+        """
+        level = settings.get("HTTPCACHE_COMPRESSION_LEVEL")
+        self.level: Optional[int] = None if level is None else int(level)
+
+    def compress(self, data: bytes) -> bytes:
+        """
+
+        :param data:
+        :type data: bytes
+        :return:
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+
+        :param data:
+        :type data: bytes
+        :return:
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, -1 if self.level is None else self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, 9 if self.level is None else self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class LzmaCodec(Codec):
+    name = "lzma"
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+class ZstdCodec(Codec):
+    """
+    zstd, its compressors and decompressors are not thread-safe, each thread
+    of the thread-safe storages gets its own
+    """
+
+    name = "zstd"
+
+    def __init__(self, settings: Settings):
+        super(ZstdCodec, self).__init__(settings)
+        if zstandard is None:
+            raise NotConfigured("The zstd codec requires the zstandard package")
+        self.dict_kwargs: Dict = self._dict_kwargs(settings)
+        self.local: local = local()
+
+    def _dict_kwargs(self, settings: Settings) -> Dict:
+        return {}
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = getattr(self.local, "compressor", None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level, **self.dict_kwargs
+            )
+        return compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressor = getattr(self.local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self.local.decompressor = zstandard.ZstdDecompressor(
+                **self.dict_kwargs
+            )
+        return decompressor.decompress(data)
+
+
+class ZstdDictCodec(ZstdCodec):
+    """
+    zstd with a dictionary trained on bodies of the crawled sites, see
+    :func:`train_zstd_dictionary`, read from ``HTTPCACHE_COMPRESSION_ZSTD_DICT``
+
+    The id of the dictionary is recorded in the name, ``zstd-dict:<id>``, the
+    entries compressed with another dictionary are missed.
+    """
+
+    name = "zstd-dict"
+
+    def __init__(self, settings: Settings):
+        path = settings.get("HTTPCACHE_COMPRESSION_ZSTD_DICT")
+        if not path:
+            raise NotConfigured(
+                "The zstd-dict codec requires HTTPCACHE_COMPRESSION_ZSTD_DICT"
+            )
+        with open(path, "rb") as f:
+            self.dict_data = f.read()
+        super(ZstdDictCodec, self).__init__(settings)
+        # 0 for the raw content dictionaries, not trained
+        dict_id = zstandard.ZstdCompressionDict(self.dict_data).dict_id()
+        self.name = "%s:%d" % (
+            ZstdDictCodec.name,
+            dict_id or zlib.crc32(self.dict_data),
+        )
+
+    def _dict_kwargs(self, settings: Settings) -> Dict:
+        return {"dict_data": zstandard.ZstdCompressionDict(self.dict_data)}
+
+
+class BrotliCodec(Codec):
+    name = "br"
+
+    def __init__(self, settings: Settings):
+        super(BrotliCodec, self).__init__(settings)
+        if brotli is None:
+            raise NotConfigured("The br codec requires the brotli package")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.level is None:
+            return brotli.compress(data)
+        return brotli.compress(data, quality=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return brotli.decompress(data)
+
+
+CODECS: Dict[str, Type[Codec]] = {
+    codec.name: codec
+    for codec in (
+        ZlibCodec,
+        GzipCodec,
+        LzmaCodec,
+        ZstdCodec,
+        ZstdDictCodec,
+        BrotliCodec,
+    )
+}
+
+
+def get_codec(name: str, settings: Settings) -> Codec:
+    """
+
+    :param name: one of the keys of ``CODECS``, or a name recorded with an
+        entry
+    :type name: str
+    :param settings:
+    :type settings: Settings
+    :return: the codec configured by the settings, whose name differs from the
+        given one if the entry was compressed with another variant
+    :rtype: Codec
+    """
+    try:
+        codec = CODECS[name.partition(":")[0]]
+    except KeyError:
+        raise NotConfigured("Unknown cache compression codec: %s" % name)
+    return codec(settings)
+
+
+def train_zstd_dictionary(samples: Iterable[bytes], dict_size: int = 112640) -> bytes:
+    """
+    Train a zstd dictionary, to be saved to ``HTTPCACHE_COMPRESSION_ZSTD_DICT``,
+    on sample bodies, e.g. a few thousands pages of the crawled sites
+
+    :param samples:
+    :type samples: Iterable[bytes]
+    :param dict_size: the maximum size of the dictionary
+    :type dict_size: int
+    :return:
+    :rtype: bytes
+    """
+    if zstandard is None:
+        raise NotConfigured("Training a zstd dictionary requires zstandard")
+    return zstandard.train_dictionary(dict_size, list(samples)).as_bytes()
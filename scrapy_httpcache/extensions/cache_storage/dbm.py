@@ -1,19 +1,27 @@
 import dbm
 import logging
 import os
-import pickle
 from dbm.dumb import _Database
 from importlib import import_module
 from time import time
-from typing import Dict, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-from scrapy.http.headers import Headers
-from scrapy.responsetypes import responsetypes
 from scrapy.settings import Settings
 from scrapy.utils.project import data_path
+from scrapy.utils.python import to_unicode
+from w3lib.http import headers_dict_to_raw
 
 from scrapy_httpcache import TRequest, TResponse, TSpider
 from scrapy_httpcache.extensions.cache_storage import CacheStorage
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    attach_timestamp,
+    parse_headers,
+    response_class,
+    response_class_name,
+    response_dates,
+)
+from scrapy_httpcache.extensions.cache_storage.serialization import dumps, loads
 
 logger = logging.getLogger(__name__)
 
@@ -40,41 +48,99 @@ class DbmCacheStorage(CacheStorage):
     def retrieve_response(
         self, spider: TSpider, request: TRequest
     ) -> Optional[TResponse]:
-        data = self._read_data(spider, request)
-        if data is None:
+        entry = self._read_entry(spider, request)
+        if entry is None:
             return  # not cached
+        timestamp, data = entry
+        if not self._can_decode(data.get("codec")):
+            return  # compressed with another dictionary
         url = data["url"]
         status = data["status"]
-        headers = Headers(data["headers"])
-        body = data["body"]
-        respcls = responsetypes.from_args(headers=headers, url=url)
-        response = respcls(url=url, headers=headers, status=status, body=body)
-        return response
+        respcls, headers = response_class(data.get("class"), data["headers"], url)
+        if self.lazy_body:
+            # the body is read with the entry, only its decompression waits
+            body = data["body"]
+            response = self._lazy_response(
+                respcls,
+                data.get("codec"),
+                lambda: body,
+                url=url,
+                headers=headers,
+                status=status,
+            )
+        else:
+            body = self._decode_body(data.get("codec"), data["body"])
+            response = respcls(url=url, headers=headers, status=status, body=body)
+        return attach_timestamp(attach_dates(response, data.get("dates")), timestamp)
 
     def store_response(
-        self, spider: TSpider, request: TRequest, response: TResponse
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
     ) -> None:
         key = self._request_key(request)
+        codec, body = self._encode_body(response.body)
         data = {
             "status": response.status,
             "url": response.url,
-            "headers": dict(response.headers),
-            "body": response.body,
+            "headers": headers_dict_to_raw(response.headers),
+            "body": body,
+            "codec": codec,
+            "class": response_class_name(response),
+            "dates": response_dates(response),
         }
-        self.db["%s_data" % key] = pickle.dumps(data, protocol=2)
-        self.db["%s_time" % key] = str(time())
+        self.db["%s_data" % key] = dumps(data)
+        self.db["%s_time" % key] = str(time() if timestamp is None else timestamp)
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        for key in self.db.keys():
+            key = to_unicode(key)
+            if key.endswith("_time"):
+                yield key[: -len("_time")]
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        for key in self.iter_keys(spider):
+            data = self.db.get("%s_data" % key)
+            if data is not None:
+                yield key, float(self.db["%s_time" % key]), len(data)
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        db = self.db
+        for key in fingerprints:
+            for dbkey in ("%s_time" % key, "%s_data" % key):
+                if dbkey in db:
+                    del db[dbkey]
+
+    def compact(self, spider: TSpider) -> None:
+        if not hasattr(self.db, "reorganize"):
+            raise NotImplementedError(
+                "%s databases cannot be compacted" % self.dbmodule.__name__
+            )
+        self.db.reorganize()
 
     def _read_data(
         self, spider: TSpider, request: TRequest
     ) -> Optional[Dict[str, Union[int, str, bytes, Dict]]]:
+        entry = self._read_entry(spider, request)
+        return None if entry is None else entry[1]
+
+    def _read_entry(
+        self, spider: TSpider, request: TRequest
+    ) -> Optional[Tuple[float, Dict[str, Union[int, str, bytes, Dict]]]]:
+        # the data with the time the entry was stored at
         key = self._request_key(request)
         db = self.db
         tkey = "%s_time" % key
         if tkey not in db:
             return  # not found
 
-        ts = db[tkey]
-        if 0 < self.expiration_secs < time() - float(ts):
+        ts = float(db[tkey])
+        if 0 < self.expiration_secs < time() - ts:
             return  # expired
 
-        return pickle.loads(db["%s_data" % key])
+        data = loads(db["%s_data" % key])
+        if isinstance(data["headers"], bytes):
+            data["headers"] = parse_headers(data["headers"])
+        return ts, data  # pickled by the earlier versions otherwise
@@ -0,0 +1,83 @@
+"""
+The streaming export format of the cached responses, a sequence of
+length-prefixed entries encoded by :func:`serialization.dumps`
+
+Entries are written and read one at a time, so that a cache of any size is
+exported or imported in constant memory, and concatenated exports are a
+valid export.
+"""
+import struct
+from typing import BinaryIO, Iterator, Tuple
+
+from w3lib.http import headers_dict_to_raw
+
+from scrapy_httpcache import TResponse
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    parse_headers,
+    response_class,
+    response_class_name,
+)
+from scrapy_httpcache.extensions.cache_storage.serialization import dumps, loads
+
+ENTRY_LENGTH = struct.Struct(">Q")
+
+TExportEntry = Tuple[str, float, TResponse]
+
+
+def dump_entry(key: str, timestamp: float, response: TResponse) -> bytes:
+    """
+
+    :param key: the fingerprint the response is stored under
+    :type key: str
+    :param timestamp: when the response was stored
+    :type timestamp: float
+    :param response:
+    :type response: TResponse
+    :return: the length-prefixed entry
+    :rtype: bytes
+    """
+    data = dumps(
+        {
+            "key": key,
+            "time": timestamp,
+            "url": response.url,
+            "status": response.status,
+            "headers": headers_dict_to_raw(response.headers),
+            "body": response.body,
+            "class": response_class_name(response),
+        }
+    )
+    return ENTRY_LENGTH.pack(len(data)) + data
+
+
+def iter_entries(f: BinaryIO) -> Iterator[TExportEntry]:
+    """
+    Read the entries written by :func:`dump_entry`
+
+    :param f:
+    :type f: BinaryIO
+    :return: the key, the timestamp and the response of every entry
+    :rtype: Iterator[TExportEntry]
+    :raises ValueError: if the export is truncated
+    """
+    while True:
+        prefix = f.read(ENTRY_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) < ENTRY_LENGTH.size:
+            raise ValueError("Truncated cache export")
+        (length,) = ENTRY_LENGTH.unpack(prefix)
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError("Truncated cache export")
+        fields = loads(data)
+        respcls, headers = response_class(
+            fields.get("class"), parse_headers(fields["headers"]), fields["url"]
+        )
+        response = respcls(
+            url=fields["url"],
+            headers=headers,
+            status=fields["status"],
+            body=fields["body"],
+        )
+        yield fields["key"], fields["time"], response
@@ -1,29 +1,259 @@
 import gzip
+import json
 import logging
 import os
-import pickle
+import shutil
+import struct
+import tempfile
+import zlib
+from functools import partial
 from time import time
-from typing import Dict, Optional, Union
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-from scrapy.http.headers import Headers
-from scrapy.responsetypes import responsetypes
+from scrapy.exceptions import NotConfigured
 from scrapy.settings import Settings
 from scrapy.utils.project import data_path
 from scrapy.utils.python import to_bytes
-from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from w3lib.http import headers_dict_to_raw
 
 from scrapy_httpcache import TRequest, TResponse, TSpider
 from scrapy_httpcache.extensions.cache_storage import CacheStorage
+from scrapy_httpcache.extensions.cache_storage.lazy import (
+    MissingBodyError,
+    lazy_response_class,
+    map_file,
+)
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    attach_timestamp,
+    parse_headers,
+    response_class,
+    response_class_name,
+    response_dates,
+)
+from scrapy_httpcache.extensions.cache_storage.serialization import dumps, loads
 
 logger = logging.getLogger(__name__)
 
+# the metadata, raw headers, body and time of an entry
+TEntry = Tuple[
+    Dict[str, Union[str, int, float]],
+    bytes,
+    Union[bytes, memoryview, Callable[[], bytes]],
+    float,
+]
+
+RECORD_SUFFIX = ".rec"
+RECORD_MAGIC = b"SHCR"
+RECORD_VERSION = 1
+RECORD_SECTIONS = (
+    "meta",
+    "response_headers",
+    "request_headers",
+    "request_body",
+    "response_body",
+)
+# magic, version and the length of every section
+RECORD_HEADER = struct.Struct(">4sB%dQ" % len(RECORD_SECTIONS))
+# the size of the uncompressed data modulo 2**32, ending a gzip file
+GZIP_ISIZE = struct.Struct("<I")
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# the sharding of the directory of a spider, written when it is created
+LAYOUT_FILE = ".layout"
+# the depth and width of the directories written before the layout was
+# configurable
+LEGACY_LAYOUT = (1, 2)
+
+
+def write_chunks(
+    f: BinaryIO, data: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> None:
+    """
+    Write data in chunks, so that a compressing file never holds more than a
+    chunk of compressed data
+
+    :param f:
+    :type f: BinaryIO
+    :param data:
+    :type data: bytes
+    :param chunk_size:
+    :type chunk_size: int
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        f.write(view[start : start + chunk_size])
+
+
+def read_gzip(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bytes:
+    """
+    Decompress a gzip file into a buffer allocated once, from the size in its
+    trailer, instead of joining the decompressed chunks
+
+    :param path:
+    :type path: str
+    :param chunk_size: the size of the reads past a size larger than 4 GiB
+    :type chunk_size: int
+    :return:
+    :rtype: bytes
+    """
+    with open(path, "rb") as raw:
+        raw.seek(-GZIP_ISIZE.size, os.SEEK_END)
+        (size,) = GZIP_ISIZE.unpack(raw.read(GZIP_ISIZE.size))
+        raw.seek(0)
+        with gzip.GzipFile(fileobj=raw, mode="rb") as f:
+            data = f.read(size)
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return data
+            chunks = [data]
+            while chunk:
+                chunks.append(chunk)
+                chunk = f.read(chunk_size)
+            return b"".join(chunks)
+
+
+def write_record(
+    f: BinaryIO, sections: Dict[str, bytes], chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> None:
+    """
+    Write the sections of an entry as a single framed record, the body last
+
+    :param f:
+    :type f: BinaryIO
+    :param sections: the content of each of ``RECORD_SECTIONS``
+    :type sections: Dict[str, bytes]
+    :param chunk_size:
+    :type chunk_size: int
+    """
+    f.write(
+        RECORD_HEADER.pack(
+            RECORD_MAGIC,
+            RECORD_VERSION,
+            *(len(sections[name]) for name in RECORD_SECTIONS),
+        )
+    )
+    for name in RECORD_SECTIONS:
+        write_chunks(f, sections[name], chunk_size)
+
+
+def read_record_layout(f: BinaryIO) -> Dict[str, Tuple[int, int]]:
+    """
+    Read the header of a record
+
+    :param f:
+    :type f: BinaryIO
+    :return: the offset and length of every section in the record
+    :rtype: Dict[str, Tuple[int, int]]
+    """
+    magic, version, *lengths = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+    if magic != RECORD_MAGIC or version != RECORD_VERSION:
+        raise ValueError("Not a cache record: %r" % getattr(f, "name", f))
+    layout = {}
+    offset = RECORD_HEADER.size
+    for name, length in zip(RECORD_SECTIONS, lengths):
+        layout[name] = (offset, length)
+        offset += length
+    return layout
+
+
+def shard_names(key: str, depth: int, width: int) -> List[str]:
+    """
+
+    :param key:
+    :type key: str
+    :param depth: the number of levels of shard directories
+    :type depth: int
+    :param width: the number of characters of the key per level
+    :type width: int
+    :return: the shard directories of a key, from the spider directory
+    :rtype: List[str]
+    """
+    return [key[i * width : (i + 1) * width] for i in range(depth)]
+
+
+def read_record(f: BinaryIO, *names: str) -> Dict[str, bytes]:
+    """
+    Read the given sections of a record, skipping the others
+
+    :param f:
+    :type f: BinaryIO
+    :param names: some of ``RECORD_SECTIONS``
+    :type names: str
+    :return:
+    :rtype: Dict[str, bytes]
+    """
+    layout = read_record_layout(f)
+    sections = {}
+    for name in RECORD_SECTIONS:
+        if len(sections) == len(names):
+            break
+        offset, length = layout[name]
+        if name in names:
+            sections[name] = f.read(length)
+        else:
+            f.seek(length, os.SEEK_CUR)
+    return sections
+
 
 class FilesystemCacheStorage(CacheStorage):
+    """
+    The filesystem cache storage
+
+    With ``HTTPCACHE_FILESYSTEM_FORMAT = "record"`` every entry is written
+    atomically as a single record file instead of a directory of five files.
+    Entries are read from either format. With ``HTTPCACHE_LAZY_BODY`` the body
+    is read when the response body is first accessed.
+
+    The bodies are written in chunks of ``HTTPCACHE_FILESYSTEM_CHUNK_SIZE`` and
+    read into a single buffer, also with ``HTTPCACHE_GZIP``.
+
+    The metadata is not pickled anymore, the ``pickled_meta`` of the earlier
+    entries is still read. ``HTTPCACHE_FILESYSTEM_DEBUG_META`` adds a readable
+    ``meta`` file to the directories.
+
+    The entries are sharded in ``HTTPCACHE_FILESYSTEM_SHARD_DEPTH`` levels of
+    directories named after ``HTTPCACHE_FILESYSTEM_SHARD_WIDTH`` characters of
+    their key, recorded in the ``.layout`` file of the spider directory. The
+    entries stored with another layout are moved by :meth:`reshard`. The
+    directories known to exist are not created again.
+    """
+
+    thread_safe = True
+    multiprocess = True
+
     def __init__(self, settings: Settings):
         super(FilesystemCacheStorage, self).__init__(settings)
         self.cachedir = data_path(settings["HTTPCACHE_DIR"])
         self.use_gzip = settings.getbool("HTTPCACHE_GZIP")
         self._open = gzip.open if self.use_gzip else open
+        self.use_record = (
+            settings.get("HTTPCACHE_FILESYSTEM_FORMAT", "directory") == "record"
+        )
+        self.debug_meta = settings.getbool("HTTPCACHE_FILESYSTEM_DEBUG_META")
+        self.chunk_size: int = settings.getint(
+            "HTTPCACHE_FILESYSTEM_CHUNK_SIZE", DEFAULT_CHUNK_SIZE
+        )
+        self.layout: Tuple[int, int] = (
+            settings.getint("HTTPCACHE_FILESYSTEM_SHARD_DEPTH", LEGACY_LAYOUT[0]),
+            settings.getint("HTTPCACHE_FILESYSTEM_SHARD_WIDTH", LEGACY_LAYOUT[1]),
+        )
+        if self.layout[0] < 0 or self.layout[1] < 1:
+            raise NotConfigured(
+                "Invalid HTTPCACHE_FILESYSTEM_SHARD_DEPTH and _WIDTH: %d, %d"
+                % self.layout
+            )
+        self._known_dirs: Set[str] = set()
 
     def open_spider(self, spider: TSpider) -> None:
         logger.debug(
@@ -31,6 +261,24 @@ class FilesystemCacheStorage(CacheStorage):
             % {"cachedir": self.cachedir},
             extra={"spider": spider},
         )
+        spiderdir = self._spider_dir(spider)
+        self._makedirs(spiderdir)
+        layout = self._read_layout(spiderdir)
+        if layout is None:
+            self._write_layout(spiderdir, self.layout)
+        elif layout != self.layout:
+            logger.warning(
+                "The entries of %(spiderdir)s are sharded %(layout)r, not "
+                "%(configured)r, move them with: scrapy httpcache reshard "
+                "%(spider)s"
+                % {
+                    "spiderdir": spiderdir,
+                    "layout": layout,
+                    "configured": self.layout,
+                    "spider": spider.name,
+                },
+                extra={"spider": spider},
+            )
 
     def close_spider(self, spider: TSpider) -> None:
         pass
@@ -39,61 +287,411 @@ class FilesystemCacheStorage(CacheStorage):
         self, spider: TSpider, request: TRequest
     ) -> Optional[TResponse]:
         """Return response if present in cache, or None otherwise."""
-        metadata = self._read_meta(spider, request)
-        if metadata is None:
-            return  # not cached
         rpath = self._get_request_path(spider, request)
-        with self._open(os.path.join(rpath, "response_body"), "rb") as f:
-            body = f.read()
-        with self._open(os.path.join(rpath, "response_headers"), "rb") as f:
-            rawheaders = f.read()
+        entry = self._read_record(rpath)
+        if entry is None:
+            entry = self._read_directory(spider, request, rpath)
+        if entry is None:
+            return  # not cached
+        metadata, rawheaders, body, timestamp = entry
+        if not self._can_decode(metadata.get("codec")):
+            return  # compressed with another dictionary
         url = metadata.get("response_url")
         status = metadata["status"]
-        headers = Headers(headers_raw_to_dict(rawheaders))
-        respcls = responsetypes.from_args(headers=headers, url=url)
-        response = respcls(url=url, headers=headers, status=status, body=body)
-        return response
+        respcls, headers = response_class(
+            metadata.get("class"), parse_headers(rawheaders), url
+        )
+        if isinstance(body, memoryview):
+            response = lazy_response_class(respcls)(
+                url=url, headers=headers, status=status, body_buffer=body
+            )
+        elif callable(body):
+            response = self._lazy_response(
+                respcls,
+                metadata.get("codec"),
+                body,
+                url=url,
+                headers=headers,
+                status=status,
+            )
+        else:
+            body = self._decode_body(metadata.get("codec"), body)
+            response = respcls(url=url, headers=headers, status=status, body=body)
+        return attach_timestamp(
+            attach_dates(response, metadata.get("dates")), timestamp
+        )
 
     def store_response(
-        self, spider: TSpider, request: TRequest, response: TResponse
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
     ) -> None:
         """Store the given response in the cache."""
         rpath = self._get_request_path(spider, request)
-        if not os.path.exists(rpath):
-            os.makedirs(rpath)
+        codec, body = self._encode_body(response.body)
         metadata = {
             "url": request.url,
             "method": request.method,
             "status": response.status,
             "response_url": response.url,
-            "timestamp": time(),
+            "timestamp": time() if timestamp is None else timestamp,
+            "codec": codec,
+            "class": response_class_name(response),
+            "dates": response_dates(response),
         }
-        with self._open(os.path.join(rpath, "meta"), "wb") as f:
-            f.write(to_bytes(repr(metadata)))
-        with self._open(os.path.join(rpath, "pickled_meta"), "wb") as f:
-            pickle.dump(metadata, f, protocol=2)
-        with self._open(os.path.join(rpath, "response_headers"), "wb") as f:
-            f.write(headers_dict_to_raw(response.headers))
-        with self._open(os.path.join(rpath, "response_body"), "wb") as f:
-            f.write(response.body)
-        with self._open(os.path.join(rpath, "request_headers"), "wb") as f:
-            f.write(headers_dict_to_raw(request.headers))
-        with self._open(os.path.join(rpath, "request_body"), "wb") as f:
-            f.write(request.body)
+        if self.use_record:
+            self._write_record(
+                rpath,
+                {
+                    "meta": dumps(metadata),
+                    "response_headers": headers_dict_to_raw(response.headers),
+                    "request_headers": headers_dict_to_raw(request.headers),
+                    "request_body": request.body,
+                    "response_body": body,
+                },
+                timestamp,
+            )
+            # written in the directory format before
+            shutil.rmtree(rpath, ignore_errors=True)
+            return
+
+        self._makedirs(os.path.dirname(rpath))
+        try:
+            os.mkdir(rpath)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            # removed meanwhile, e.g. by a compaction in another process
+            self._known_dirs.discard(os.path.dirname(rpath))
+            os.makedirs(rpath, exist_ok=True)
+        # every file is replaced, not rewritten, as the body of a response
+        # read before may still be mapped from it, and the metadata last, as
+        # the entry is read once it exists
+        if self.debug_meta:
+            self._write_file(os.path.join(rpath, "meta"), to_bytes(repr(metadata)))
+        self._write_file(
+            os.path.join(rpath, "response_headers"),
+            headers_dict_to_raw(response.headers),
+        )
+        self._write_file(os.path.join(rpath, "response_body"), body)
+        self._write_file(
+            os.path.join(rpath, "request_headers"), headers_dict_to_raw(request.headers)
+        )
+        self._write_file(os.path.join(rpath, "request_body"), request.body)
+        self._write_file(os.path.join(rpath, "metadata"), dumps(metadata), timestamp)
+        # written in the record format before, it would be read first
+        try:
+            os.remove(rpath + RECORD_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        for key, _ in self._scan_entries(spider):
+            yield key
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        return self._stat_entries(self._scan_entries(spider))
+
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        if self.layout[0] == 0:
+            # a single directory, not split by the key prefixes
+            return super().iter_shard_entries(spider, shard, shards)
+        return self._stat_entries(self._scan_entries(spider, shard, shards))
+
+    def _stat_entries(
+        self, entries: Iterator[Tuple[str, os.DirEntry]]
+    ) -> Iterator[Tuple[str, float, int]]:
+        for key, entry in entries:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    yield key, stat.st_mtime, stat.st_size
+                    continue
+                stats = {f.name: f.stat() for f in os.scandir(entry.path)}
+            except FileNotFoundError:
+                continue  # deleted meanwhile
+            meta = stats.get("metadata") or stats.get("pickled_meta")
+            if meta is not None:
+                yield key, meta.st_mtime, sum(s.st_size for s in stats.values())
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        for key in fingerprints:
+            rpath = self._get_key_path(spider, key)
+            try:
+                os.remove(rpath + RECORD_SUFFIX)
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(rpath, ignore_errors=True)
+
+    def compact(self, spider: TSpider) -> None:
+        # the shard directories emptied by the deletions
+        spiderdir = self._spider_dir(spider)
+        if not os.path.isdir(spiderdir):
+            return
+        self._remove_empty_shards(spiderdir, self.layout[0])
+        self._known_dirs.clear()
+
+    def reshard(self, spider: TSpider) -> int:
+        """
+        Move the entries of a spider stored with another layout to the
+        configured one, renaming them, while the spider does not run
+
+        :param spider:
+        :type spider: TSpider
+        :return: the number of entries moved
+        :rtype: int
+        """
+        spiderdir = self._spider_dir(spider)
+        self._makedirs(spiderdir)
+        layout = self._read_layout(spiderdir)
+        if layout is None or layout == self.layout:
+            self._write_layout(spiderdir, self.layout)
+            return 0
+        moved = 0
+        # listed beforehand, as the directories of the new layout are created
+        for shard in list(self._iter_shards(spiderdir, layout[0])):
+            for key, entry in list(self._iter_shard(shard)):
+                path = self._get_key_path(spider, key)
+                if entry.is_file():
+                    path += RECORD_SUFFIX
+                if path == entry.path:
+                    continue
+                if os.path.lexists(path):
+                    # stored since the layout changed
+                    if entry.is_file():
+                        os.remove(entry.path)
+                    else:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                self._makedirs(os.path.dirname(path))
+                os.rename(entry.path, path)
+                moved += 1
+        self._remove_empty_shards(spiderdir, layout[0])
+        self._known_dirs.clear()
+        self._write_layout(spiderdir, self.layout)
+        return moved
+
+    def _scan_entries(
+        self, spider: TSpider, part: int = 0, parts: int = 1
+    ) -> Iterator[Tuple[str, os.DirEntry]]:
+        # split in parts by the top level shard directories, i.e. by the
+        # prefixes of the keys, for each part to be scanned alone
+        spiderdir = self._spider_dir(spider)
+        if not os.path.isdir(spiderdir):
+            return
+        for shard in self._iter_shards(spiderdir, self.layout[0], part, parts):
+            # once per key, the record if the entry was also left in the
+            # directory format by another process
+            entries: Dict[str, os.DirEntry] = {}
+            for key, entry in self._iter_shard(shard):
+                if key not in entries or entry.is_file():
+                    entries[key] = entry
+            yield from entries.items()
+
+    def _iter_shards(
+        self, path: str, depth: int, part: int = 0, parts: int = 1
+    ) -> Iterator[str]:
+        if depth == 0:
+            yield path
+            return
+        for shard in os.scandir(path):
+            if shard.is_dir() and not shard.name.startswith("."):
+                if parts > 1 and zlib.crc32(shard.name.encode()) % parts != part:
+                    continue
+                yield from self._iter_shards(shard.path, depth - 1)
+
+    def _iter_shard(self, path: str) -> Iterator[Tuple[str, os.DirEntry]]:
+        for entry in os.scandir(path):
+            if entry.name.startswith("."):
+                continue  # the layout, or a record being written
+            if entry.name.endswith(RECORD_SUFFIX):
+                yield entry.name[: -len(RECORD_SUFFIX)], entry
+            elif entry.is_dir():
+                yield entry.name, entry
+
+    def _remove_empty_shards(self, path: str, depth: int) -> None:
+        if depth == 0:
+            return
+        for shard in os.scandir(path):
+            if shard.is_dir() and not shard.name.startswith("."):
+                self._remove_empty_shards(shard.path, depth - 1)
+                try:
+                    os.rmdir(shard.path)
+                except OSError:
+                    pass  # not empty
+
+    def _spider_dir(self, spider: TSpider) -> str:
+        return os.path.join(self.cachedir, spider.name)
+
+    def _read_layout(self, spiderdir: str) -> Optional[Tuple[int, int]]:
+        try:
+            with open(os.path.join(spiderdir, LAYOUT_FILE)) as f:
+                layout = json.load(f)
+            return layout["depth"], layout["width"]
+        except FileNotFoundError:
+            pass
+        with os.scandir(spiderdir) as entries:
+            if next(entries, None) is None:
+                return  # a new cache
+        return LEGACY_LAYOUT
+
+    def _write_layout(self, spiderdir: str, layout: Tuple[int, int]) -> None:
+        fd, tmppath = tempfile.mkstemp(dir=spiderdir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"depth": layout[0], "width": layout[1]}, f)
+            os.replace(tmppath, os.path.join(spiderdir, LAYOUT_FILE))
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    def _makedirs(self, path: str) -> None:
+        if path not in self._known_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._known_dirs.add(path)
 
     def _get_request_path(self, spider: TSpider, request: TRequest) -> str:
-        key = self._request_key(request)
-        return os.path.join(self.cachedir, spider.name, key[0:2], key)
+        return self._get_key_path(spider, self._request_key(request))
+
+    def _get_key_path(self, spider: TSpider, key: str) -> str:
+        return os.path.join(
+            self.cachedir, spider.name, *shard_names(key, *self.layout), key
+        )
+
+    def _write_record(
+        self,
+        rpath: str,
+        sections: Dict[str, bytes],
+        timestamp: Optional[float] = None,
+    ) -> None:
+        dirname = os.path.dirname(rpath)
+        self._makedirs(dirname)
+        # write aside and rename, so that readers never see a partial record
+        try:
+            fd, tmppath = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+        except FileNotFoundError:
+            # removed meanwhile, e.g. by a compaction in another process
+            self._known_dirs.discard(dirname)
+            self._makedirs(dirname)
+            fd, tmppath = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if self.use_gzip:
+                    with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                        write_record(gz, sections, self.chunk_size)
+                else:
+                    write_record(f, sections, self.chunk_size)
+            if timestamp is not None:
+                os.utime(tmppath, (timestamp, timestamp))
+            os.replace(tmppath, rpath + RECORD_SUFFIX)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    def _write_file(
+        self, path: str, data: bytes, timestamp: Optional[float] = None
+    ) -> None:
+        # write aside and rename, so that a file mapped by a reader is never
+        # truncated
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if self.use_gzip:
+                    with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                        write_chunks(gz, data, self.chunk_size)
+                else:
+                    write_chunks(f, data, self.chunk_size)
+            if timestamp is not None:
+                # the time of the entry is the modification time of the file
+                os.utime(tmppath, (timestamp, timestamp))
+            os.replace(tmppath, path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    def _read_record(self, rpath: str) -> Optional[TEntry]:
+        recordpath = rpath + RECORD_SUFFIX
+        try:
+            stat = os.stat(recordpath)
+        except FileNotFoundError:
+            return  # not found
+        if 0 < self.expiration_secs < time() - stat.st_mtime:
+            return  # expired
+        with self._open(recordpath, "rb") as f:
+            layout = read_record_layout(f)
+            metadata = loads(f.read(layout["meta"][1]))
+            rawheaders = f.read(layout["response_headers"][1])
+            offset, length = layout["response_body"]
+            if not self.use_gzip and self._use_mmap(metadata.get("codec"), length):
+                body = map_file(recordpath, offset, length)
+            elif self.lazy_body:
+                body = partial(
+                    self._read_record_body, recordpath, stat.st_ino, offset, length
+                )
+            else:
+                f.seek(offset)
+                body = f.read(length)
+        return metadata, rawheaders, body, stat.st_mtime
+
+    def _read_record_body(
+        self, recordpath: str, ino: int, offset: int, length: int
+    ) -> bytes:
+        try:
+            with self._open(recordpath, "rb") as f:
+                # records are replaced, not rewritten
+                if os.fstat(f.fileno()).st_ino != ino:
+                    raise MissingBodyError("Replaced cache record: %s" % recordpath)
+                f.seek(offset)
+                return f.read(length)
+        except FileNotFoundError:
+            raise MissingBodyError("Removed cache record: %s" % recordpath)
+
+    def _read_directory(
+        self, spider: TSpider, request: TRequest, rpath: str
+    ) -> Optional[TEntry]:
+        meta = self._read_meta(spider, request)
+        if meta is None:
+            return  # not cached
+        metadata, timestamp = meta
+        bodypath = os.path.join(rpath, "response_body")
+        if not self.use_gzip and self._use_mmap(
+            metadata.get("codec"), os.stat(bodypath).st_size
+        ):
+            body = map_file(bodypath)
+        elif self.lazy_body:
+            body = partial(self._read_body_file, bodypath)
+        else:
+            body = self._read_body_file(bodypath)
+        with self._open(os.path.join(rpath, "response_headers"), "rb") as f:
+            rawheaders = f.read()
+        return metadata, rawheaders, body, timestamp
+
+    def _read_body_file(self, bodypath: str) -> bytes:
+        try:
+            if self.use_gzip:
+                return read_gzip(bodypath, self.chunk_size)
+            with open(bodypath, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise MissingBodyError("Removed cache entry: %s" % bodypath)
 
     def _read_meta(
         self, spider: TSpider, request: TRequest
-    ) -> Optional[Dict[str, Union[str, int, float]]]:
+    ) -> Optional[Tuple[Dict[str, Union[str, int, float]], float]]:
+        # with the time the entry was stored at
         rpath = self._get_request_path(spider, request)
-        metapath = os.path.join(rpath, "pickled_meta")
-        if not os.path.exists(metapath):
+        for name in ("metadata", "pickled_meta"):
+            metapath = os.path.join(rpath, name)
+            if os.path.exists(metapath):
+                break
+        else:
             return  # not found
         mtime = os.stat(metapath).st_mtime
         if 0 < self.expiration_secs < time() - mtime:
             return  # expired
         with self._open(metapath, "rb") as f:
-            return pickle.load(f)
+            return loads(f.read()), mtime
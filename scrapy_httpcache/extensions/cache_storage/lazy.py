@@ -0,0 +1,130 @@
+"""
+The cached responses whose body is loaded on first access
+"""
+import mmap
+import os
+from functools import lru_cache
+from typing import Callable, Optional, Type
+
+from scrapy_httpcache import TResponse
+
+
+class MissingBodyError(IOError):
+    """
+    The cached entry was removed before the body of its response was loaded
+    """
+
+
+class LazyBodyMixin(object):
+    """
+    Defer building the body of a response until it is accessed
+
+    ``body_buffer`` is a zero-copy view of the body when it is memory-mapped
+    from the cache, e.g. to write it to a file without materializing it.
+    """
+
+    def __init__(
+        self,
+        *args,
+        body_loader: Optional[Callable[[], bytes]] = None,
+        body_buffer: Optional[memoryview] = None,
+        **kwargs
+    ):
+        """
+
+        :param body_loader: returns the body on first access
+        :type body_loader: Optional[Callable[[], bytes]]
+        :param body_buffer: the body as a memoryview, materialized to bytes on
+            first access if no loader is given
+        :type body_buffer: Optional[memoryview]
+        """
+        if body_loader is None and body_buffer is not None:
+            body_loader = body_buffer.tobytes
+        self._body_loader = body_loader
+        self._body_buffer = body_buffer
+        super(LazyBodyMixin, self).__init__(*args, **kwargs)
+
+    def _set_url(self, url: str) -> None:
+        # TextResponse resolves the encoding, i.e. loads the body, even though
+        # a str url is kept as is
+        if isinstance(url, str):
+            self._url = url
+        else:
+            super(LazyBodyMixin, self)._set_url(url)
+
+    @property
+    def body(self) -> bytes:
+        if self._body_loader is not None:
+            self._body = self._body_loader()
+            self._body_loader = None
+            self._body_buffer = None
+        return self._body
+
+    @property
+    def body_buffer(self) -> memoryview:
+        if self._body_buffer is not None:
+            return self._body_buffer
+        return memoryview(self.body)
+
+    @property
+    def body_loaded(self) -> bool:
+        return self._body_loader is None
+
+    def replace(self, *args, **kwargs) -> TResponse:
+        # a lazy copy shares the loader rather than loading the body, nor its
+        # encoding from it; Response.replace reads every attribute, even those
+        # given, so the copy is built here
+        cls = kwargs.pop("cls", type(self))
+        if (
+            "body" not in kwargs
+            and not self.body_loaded
+            and issubclass(cls, LazyBodyMixin)
+        ):
+            kwargs.update(
+                body=b"", body_loader=self._body_loader, body_buffer=self._body_buffer
+            )
+            if "encoding" in self.attributes:
+                kwargs.setdefault("encoding", self._encoding)
+        for name in self.attributes:
+            if name not in kwargs:
+                kwargs[name] = getattr(self, name)
+        return cls(*args, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def lazy_response_class(respcls: Type[TResponse]) -> Type[TResponse]:
+    """
+    The subclass of a response class with a lazily loaded body
+
+    :param respcls:
+    :type respcls: Type[TResponse]
+    :return:
+    :rtype: Type[TResponse]
+    """
+    return type("Lazy%s" % respcls.__name__, (LazyBodyMixin, respcls), {})
+
+
+def map_file(path: str, offset: int = 0, length: Optional[int] = None) -> memoryview:
+    """
+    Memory-map a read-only slice of a file
+
+    :param path:
+    :type path: str
+    :param offset:
+    :type offset: int
+    :param length: up to the end of the file if None
+    :type length: Optional[int]
+    :return:
+    :rtype: memoryview
+    """
+    # the offset of a mapping must be a multiple of the allocation granularity
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with open(path, "rb") as f:
+        if length is None:
+            length = os.fstat(f.fileno()).st_size - offset
+        if not length:
+            return memoryview(b"")
+        m = mmap.mmap(
+            f.fileno(), offset - start + length, access=mmap.ACCESS_READ, offset=start
+        )
+    return memoryview(m)[offset - start :]
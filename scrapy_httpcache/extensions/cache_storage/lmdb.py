@@ -0,0 +1,319 @@
+"""
+The LMDB cache storage
+"""
+import logging
+import os
+import struct
+from threading import Lock
+from time import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import Settings
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw
+
+from scrapy_httpcache import TRequest, TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage import CacheStorage, key_range
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    attach_timestamp,
+    parse_headers,
+    response_class,
+    response_class_name,
+    response_dates,
+)
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+logger = logging.getLogger(__name__)
+
+ENV_NAME = "lmdb"
+# the version of the format of the values, their first byte, the values of
+# another version are missed
+VALUE_VERSION = 1
+# version, timestamp, status and the lengths of the url, the headers, the
+# codec, the name of the response class and the dates of the response,
+# followed by them and the body
+VALUE_HEADER = struct.Struct(">BdHIIBBH")
+
+# the url, status, raw headers, codec, name of the response class, dates,
+# body and time of an entry
+TEntry = Tuple[
+    str, int, bytes, Optional[str], Optional[str], Optional[str], bytes, float
+]
+
+# an environment must be opened only once per process, it is shared by the
+# storages using the same directory
+_environments: Dict[str, "lmdb.Environment"] = {}
+_references: Dict[str, int] = {}
+_environments_lock = Lock()
+
+
+def open_environment(path: str, settings: Settings) -> "lmdb.Environment":
+    """
+    Open the environment in a directory, or share the one already open
+
+    :param path:
+    :type path: str
+    :param settings:
+    :type settings: Settings
+    :return:
+    :rtype: lmdb.Environment
+    """
+    with _environments_lock:
+        env = _environments.get(path)
+        if env is None:
+            env = lmdb.open(
+                path,
+                map_size=settings.getint("HTTPCACHE_LMDB_MAP_SIZE", 2**30),
+                max_dbs=settings.getint("HTTPCACHE_LMDB_MAX_DBS", 128),
+                max_readers=settings.getint("HTTPCACHE_LMDB_MAX_READERS", 126),
+            )
+            _environments[path] = env
+            _references[path] = 0
+        _references[path] += 1
+        return env
+
+
+def close_environment(path: str) -> None:
+    """
+    Close the environment in a directory once no storage uses it
+
+    :param path:
+    :type path: str
+    """
+    with _environments_lock:
+        _references[path] -= 1
+        if not _references[path]:
+            del _references[path]
+            _environments.pop(path).close()
+
+
+class LmdbCacheStorage(CacheStorage):
+    """
+    The LMDB cache storage
+
+    One environment in ``HTTPCACHE_DIR`` with a named database per spider.
+    Many crawler processes can use the same cache at once: readers never
+    block, and writers are serialized by LMDB. Values are read within the
+    read transaction without copying them out of the memory map first.
+    """
+
+    thread_safe = True
+    multiprocess = True
+
+    def __init__(self, settings: Settings):
+        if lmdb is None:
+            raise NotConfigured("The LMDB cache storage requires the lmdb package")
+        super(LmdbCacheStorage, self).__init__(settings)
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.envpath = os.path.join(self.cachedir, ENV_NAME)
+        self.env: Optional["lmdb.Environment"] = None
+        self.db = None
+
+    def open_spider(self, spider: TSpider) -> None:
+        self.env = open_environment(self.envpath, self.settings)
+        self.db = self.env.open_db(spider.name.encode())
+
+        logger.debug(
+            "Using LMDB cache storage in %(cachepath)s" % {"cachepath": self.envpath},
+            extra={"spider": spider},
+        )
+
+    def close_spider(self, spider: TSpider) -> None:
+        self.env = self.db = None
+        close_environment(self.envpath)
+
+    def retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Optional[TResponse]:
+        key = self._request_key(request).encode()
+        with self.env.begin(db=self.db, buffers=True) as txn:
+            entry = self._read_value(txn.get(key))
+        return self._build_response(entry)
+
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> List[Optional[TResponse]]:
+        keys = [self._request_key(request).encode() for request in requests]
+        # a single read transaction
+        with self.env.begin(db=self.db, buffers=True) as txn:
+            entries = [self._read_value(txn.get(key)) for key in keys]
+        return [self._build_response(entry) for entry in entries]
+
+    def _read_value(self, value: Optional[memoryview]) -> Optional[TEntry]:
+        """
+        Copy an entry out of its value, within the read transaction where the
+        value is valid
+
+        :param value:
+        :type value: Optional[memoryview]
+        :return: the entry, its body decoded unless ``HTTPCACHE_LAZY_BODY`` is
+            set
+        :rtype: Optional[TEntry]
+        """
+        if value is None:
+            return  # not cached
+        if value[0] != VALUE_VERSION:
+            return  # another format
+        (
+            _,
+            timestamp,
+            status,
+            urllen,
+            headerslen,
+            codeclen,
+            classlen,
+            dateslen,
+        ) = VALUE_HEADER.unpack_from(value)
+        if 0 < self.expiration_secs < time() - timestamp:
+            return  # expired
+        offset = VALUE_HEADER.size
+        fields = []
+        for length in (urllen, headerslen, codeclen, classlen, dateslen):
+            fields.append(bytes(value[offset : offset + length]))
+            offset += length
+        url, rawheaders, codec, class_name, dates = fields
+        url = url.decode()
+        codec = codec.decode() or None
+        class_name = class_name.decode() or None
+        dates = dates.decode() or None
+        # the body follows the other fields
+        if not self._can_decode(codec):
+            return  # compressed with another dictionary
+        if self.lazy_body:
+            body = value[offset:].tobytes()
+            return url, status, rawheaders, codec, class_name, dates, body, timestamp
+        body = self._decode_body(codec, value[offset:])
+        if isinstance(body, memoryview):
+            body = body.tobytes()
+        return url, status, rawheaders, None, class_name, dates, body, timestamp
+
+    def _build_response(self, entry: Optional[TEntry]) -> Optional[TResponse]:
+        if entry is None:
+            return  # not cached
+        url, status, rawheaders, codec, class_name, dates, body, timestamp = entry
+        respcls, headers = response_class(class_name, parse_headers(rawheaders), url)
+        if self.lazy_body:
+            # the body is copied out of the transaction, only its decompression
+            # waits
+            response = self._lazy_response(
+                respcls,
+                codec,
+                lambda: body,
+                url=url,
+                headers=headers,
+                status=status,
+            )
+        else:
+            response = respcls(url=url, headers=headers, status=status, body=body)
+        return attach_timestamp(attach_dates(response, dates), timestamp)
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        # paged as the entries
+        last = b""
+        while True:
+            page = []
+            with self.env.begin(db=self.db) as txn:
+                cursor = txn.cursor()
+                if cursor.set_range(last) if last else cursor.first():
+                    for key in cursor.iternext(keys=True, values=False):
+                        if key == last:
+                            continue
+                        page.append(key)
+                        if len(page) >= 1000:
+                            break
+            if not page:
+                return
+            for key in page:
+                yield key.decode()
+            last = page[-1]
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        return self._iter_entries(None, None)
+
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        return self._iter_entries(*key_range(shard, shards))
+
+    def _iter_entries(
+        self, after: Optional[str], until: Optional[str]
+    ) -> Iterator[Tuple[str, float, int]]:
+        # paged, so that no read transaction is held between the pages
+        last = after.encode() if after else b""
+        end = until.encode() if until else None
+        while True:
+            page = []
+            with self.env.begin(db=self.db, buffers=True) as txn:
+                cursor = txn.cursor()
+                if cursor.set_range(last) if last else cursor.first():
+                    for key, value in cursor:
+                        key = bytes(key)
+                        if key == last:
+                            continue
+                        if end is not None and key > end:
+                            break
+                        if value[0] == VALUE_VERSION:
+                            timestamp = VALUE_HEADER.unpack_from(value)[1]
+                        else:
+                            timestamp = 0  # unreadable, collected first
+                        page.append((key.decode(), timestamp, len(value)))
+                        if len(page) >= 1000:
+                            break
+            if not page:
+                return
+            yield from page
+            last = page[-1][0].encode()
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        with self.env.begin(write=True, db=self.db) as txn:
+            for key in fingerprints:
+                txn.delete(key.encode())
+
+    def compact(self, spider: TSpider) -> None:
+        raise NotImplementedError(
+            "LMDB reuses the pages of the deleted responses, copy the "
+            "environment with mdb_copy -c to shrink it"
+        )
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        key = self._request_key(request).encode()
+        codec, body = self._encode_body(response.body)
+        url = response.url.encode()
+        rawheaders = headers_dict_to_raw(response.headers)
+        codec = (codec or "").encode()
+        class_name = response_class_name(response).encode()
+        dates = response_dates(response).encode()
+        value = b"".join(
+            (
+                VALUE_HEADER.pack(
+                    VALUE_VERSION,
+                    time() if timestamp is None else timestamp,
+                    response.status,
+                    len(url),
+                    len(rawheaders),
+                    len(codec),
+                    len(class_name),
+                    len(dates),
+                ),
+                url,
+                rawheaders,
+                codec,
+                class_name,
+                dates,
+                body,
+            )
+        )
+        with self.env.begin(write=True, db=self.db) as txn:
+            txn.put(key, value)
@@ -4,53 +4,266 @@ The mongo cache storage
 import logging
 import re
 from datetime import datetime
+from threading import Lock
 from time import time
-from typing import Dict, Optional, Union
-
-from motor.core import AgnosticClient as AsyncIOMotorClient
-from motor.core import AgnosticCollection as AsyncIOMotorCollection
-from motor.core import AgnosticDatabase as AsyncIOMotorDatabase
-from pymongo import ASCENDING
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+)
+from pymongo import ASCENDING, UpdateOne
 from pymongo.collection import Collection
 from pymongo.database import Database
 from pymongo.mongo_client import MongoClient
-from scrapy.http.headers import Headers
-from scrapy.responsetypes import responsetypes
+from scrapy.http.response.text import TextResponse
 from scrapy.settings import Settings
+from scrapy.utils.defer import deferred_from_coro
 from scrapy.utils.python import to_unicode
+from scrapy.utils.reactor import is_asyncio_reactor_installed
+from twisted.internet.base import DelayedCall
+from twisted.internet.defer import Deferred
+from twisted.internet.threads import deferToThread
+from twisted.python.failure import Failure
 
 from scrapy_httpcache import TRequest, TResponse, TSpider
-from scrapy_httpcache.extensions.cache_storage import CacheStorage
+from scrapy_httpcache.extensions.cache_storage import (
+    AsyncCacheStorage,
+    CacheStorage,
+    key_range,
+)
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    attach_timestamp,
+    response_class,
+    response_class_name,
+    response_dates,
+)
 
 logger = logging.getLogger(__name__)
 pattern = re.compile("^HTTPCACHE_MONGO_MONGOCLIENT_(?P<kwargs>(?!KWARGS).*)$")
+TTL_INDEX = "time_ttl"
 
 
 def get_arguments(var):
     return {str: {"name": var}, dict: var}[type(var)]
 
 
-class MongoCacheStorage(CacheStorage):
+def get_name(var) -> str:
+    return var["name"] if isinstance(var, dict) else var
+
+
+def get_mongo_settings(settings: Settings) -> Dict[str, Any]:
     """
-    The sync mongo cache storage with pymongo
+    Collect the keyword arguments of the mongo client from the
+    ``HTTPCACHE_MONGO_MONGOCLIENT_*`` settings
+
+    :param settings:
+    :type settings: Settings
+    :return:
+    :rtype: Dict[str, Any]
+    """
+    mongo_settings = {
+        pattern.sub(lambda x: x.group(1).lower(), k): v
+        for k, v in filter(
+            lambda pair: pattern.match(pair[0]), settings.copy_to_dict().items()
+        )
+    }
+    mongo_settings.update(settings.getdict("HTTPCACHE_MONGO_MONGOCLIENT_KWARGS"))
+    return mongo_settings
+
+
+class MongoStorageMixin(object):
+    """
+    The settings parsing and document conversions shared by the mongo cache
+    storages
     """
 
     def __init__(self, settings: Settings):
-        super(MongoCacheStorage, self).__init__(settings)
+        super(MongoStorageMixin, self).__init__(settings)
 
         self.settings = settings
-        self.mongo_settings = {
-            pattern.sub(lambda x: x.group(1).lower(), k): v
-            for k, v in filter(
-                lambda pair: pattern.match(pair[0]), settings.copy_to_dict().items()
-            )
+        self.mongo_settings = get_mongo_settings(settings)
+        self.data_for_human: bool = settings.getbool(
+            "HTTPCACHE_MONGO_DATA_FOR_HUMAN", True
+        )
+        self.ttl_index: bool = settings.getbool("HTTPCACHE_MONGO_TTL_INDEX", True)
+
+    def _log_opened(self, spider: TSpider) -> None:
+        logger.debug(
+            "Using MongoDB cache storage mongodb://%s:%s/%s/%s",
+            self.settings["HTTPCACHE_MONGO_MONGOCLIENT_HOST"],
+            self.settings["HTTPCACHE_MONGO_MONGOCLIENT_PORT"],
+            get_name(self.settings["HTTPCACHE_MONGO_DATABASE"]),
+            get_name(self.settings["HTTPCACHE_MONGO_COLLECTION"]),
+            extra={"spider": spider},
+        )
+
+    def _ttl_index_change(self, indexes: Dict[str, Dict[str, Any]]) -> Optional[str]:
+        """
+        How the TTL index on ``time`` must change for the expiration: with
+        ``HTTPCACHE_MONGO_TTL_INDEX`` MongoDB deletes the expired documents by
+        itself
+
+        :param indexes: the index information of the collection
+        :type indexes: Dict[str, Dict[str, Any]]
+        :return: ``"create"``, ``"modify"``, ``"drop"`` or None
+        :rtype: Optional[str]
+        """
+        if not self.ttl_index:
+            return
+        if TTL_INDEX not in indexes:
+            return "create" if self.expiration_secs > 0 else None
+        if self.expiration_secs <= 0:
+            return "drop"  # the responses never expire anymore
+        if indexes[TTL_INDEX].get("expireAfterSeconds") != self.expiration_secs:
+            return "modify"
+
+    def _build_update(
+        self,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        codec, body = self._encode_body(response.body)
+        data = {
+            "status": response.status,
+            "url": response.url,
+            "headers": response.headers.to_unicode_dict(),
+            "body": body,
+            "codec": codec,
+            "class": response_class_name(response),
+            "dates": response_dates(response),
+        }
+        update = {
+            "$set": {
+                "data": data,
+                "key": self._request_key(request),
+                "time": (
+                    datetime.utcnow()
+                    if timestamp is None
+                    else datetime.utcfromtimestamp(timestamp)
+                ),
+            }
+        }
+        if self.data_for_human:
+            update["$set"]["data_for_human"] = self._build_data_for_human(response)
+        else:
+            # do not leave a projection of a previous response behind
+            update["$unset"] = {"data_for_human": ""}
+        return update
+
+    def _build_data_for_human(self, response: TResponse) -> Dict[str, Any]:
+        return {
+            "status": response.status,
+            "url": response.url,
+            "headers": self._convert_headers(response),
+            "body": response.text if isinstance(response, TextResponse) else None,
         }
-        self.mongo_settings.update(self.settings["HTTPCACHE_MONGO_MONGOCLIENT_KWARGS"])
+
+    def _build_response(self, v: Optional[Dict[str, Any]]) -> Optional[TResponse]:
+        data = self._check_document(v)
+        if data is None:
+            return  # not cached
+        return attach_timestamp(self._response_from_data(data), v["time"].timestamp())
+
+    def _response_from_data(
+        self, data: Dict[str, Union[int, str, bytes, Dict]]
+    ) -> TResponse:
+        url = data["url"]
+        status = data["status"]
+        respcls, headers = response_class(data.get("class"), data["headers"], url)
+        if self.lazy_body:
+            # the body is read with the document, only its decompression waits
+            body = data["body"]
+            response = self._lazy_response(
+                respcls,
+                data.get("codec"),
+                lambda: body,
+                url=url,
+                headers=headers,
+                status=status,
+            )
+        else:
+            body = self._decode_body(data.get("codec"), data["body"])
+            response = respcls(url=url, headers=headers, status=status, body=body)
+        return attach_dates(response, data.get("dates"))
+
+    def _check_document(
+        self, v: Optional[Dict[str, Any]]
+    ) -> Optional[Dict[str, Union[int, str, bytes, Dict]]]:
+        if not v:
+            return  # not found
+
+        if 0 < self.expiration_secs < time() - v["time"].timestamp():
+            return  # expired
+        if not self._can_decode(v["data"].get("codec")):
+            return  # compressed with another dictionary
+
+        return v["data"]
+
+    def _convert_headers(self, response: TResponse):
+        encoding = response.headers.encoding
+        headers = response.headers.to_unicode_dict()
+
+        set_cookie = []
+        for cookie in [
+            to_unicode(i, encoding) for i in response.headers.getlist("set-cookie")
+        ]:
+            cookie_ = {}
+            for j in cookie.split(";"):
+                key, _, value = j.partition("=")
+                cookie_[key.strip()] = value.strip()
+            if "expires" in cookie_:
+                cookie_["expires"] = datetime.strptime(
+                    cookie_["expires"], "%a, %d %b %Y %H:%M:%S %Z"
+                )
+            set_cookie.append(cookie_)
+        headers["set-cookie"] = set_cookie
+
+        if "date" in headers:
+            headers["date"] = datetime.strptime(
+                headers["date"], "%a, %d %b %Y %H:%M:%S %Z"
+            )
+
+        return headers
+
+
+class MongoCacheStorage(MongoStorageMixin, CacheStorage):
+    """
+    The sync mongo cache storage with pymongo
+
+    With ``HTTPCACHE_MONGO_WRITE_BATCH_SIZE`` greater than 1 the upserts are
+    buffered and written with a single ``bulk_write`` once the batch is full,
+    once ``HTTPCACHE_MONGO_WRITE_BATCH_INTERVAL`` seconds passed since the
+    last write, also checked by a timer while no response is stored, or when
+    the spider is closed. Buffered responses are served from the buffer.
+
+    The expired documents are deleted by MongoDB, see
+    ``HTTPCACHE_MONGO_TTL_INDEX``, the collection is not scanned for them.
+    """
+
+    thread_safe = True
+    multiprocess = True
+
+    def __init__(self, settings: Settings):
+        super(MongoCacheStorage, self).__init__(settings)
 
         self.client: Optional[MongoClient] = None
         self.db: Optional[Database] = None
         self.collection: Optional[Collection] = None
 
+        self.batch_size: int = settings.getint("HTTPCACHE_MONGO_WRITE_BATCH_SIZE", 1)
+        self.batch_interval: float = settings.getfloat(
+            "HTTPCACHE_MONGO_WRITE_BATCH_INTERVAL", 0
+        )
+        self.pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.pending_lock: Lock = Lock()
+        self.last_flush: float = time()
+        self.call: Optional[DelayedCall] = None
+        self.stopped: bool = True
+
     def open_spider(self, spider: TSpider) -> None:
         """
 
@@ -67,27 +280,24 @@ class MongoCacheStorage(CacheStorage):
             **get_arguments(self.settings["HTTPCACHE_MONGO_COLLECTION"])
         )
         self.collection.create_index([("key", ASCENDING)], unique=True)
-
-        database: str = ""
-        if isinstance(self.settings["HTTPCACHE_MONGO_DATABASE"], str):
-            database = self.settings["HTTPCACHE_MONGO_DATABASE"]
-        elif isinstance(self.settings["HTTPCACHE_MONGO_DATABASE"], dict):
-            database = self.settings["HTTPCACHE_MONGO_DATABASE"]["name"]
-
-        collection: str = ""
-        if isinstance(self.settings["HTTPCACHE_MONGO_COLLECTION"], str):
-            collection = self.settings["HTTPCACHE_MONGO_COLLECTION"]
-        elif isinstance(self.settings["HTTPCACHE_MONGO_COLLECTION"], dict):
-            collection = self.settings["HTTPCACHE_MONGO_COLLECTION"]["name"]
-
-        logger.debug(
-            "Using MongoDB cache storage mongodb://%s:%s/%s/%s",
-            self.settings["HTTPCACHE_MONGO_MONGOCLIENT_HOST"],
-            self.settings["HTTPCACHE_MONGO_MONGOCLIENT_PORT"],
-            database,
-            collection,
-            extra={"spider": spider}
-        )
+        change = self._ttl_index_change(self.collection.index_information())
+        if change == "create":
+            self.collection.create_index(
+                [("time", ASCENDING)],
+                name=TTL_INDEX,
+                expireAfterSeconds=self.expiration_secs,
+            )
+        elif change == "modify":
+            self.db.command(
+                "collMod",
+                self.collection.name,
+                index={"name": TTL_INDEX, "expireAfterSeconds": self.expiration_secs},
+            )
+        elif change == "drop":
+            self.collection.drop_index(TTL_INDEX)
+        self._log_opened(spider)
+        self.stopped = False
+        self._schedule(self.batch_interval, spider)
 
     def close_spider(self, spider: TSpider) -> None:
         """
@@ -95,6 +305,12 @@ class MongoCacheStorage(CacheStorage):
         :param spider:
         :type spider: TSpider
         """
+        self.stopped = True
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        with self.pending_lock:
+            self._flush()
         self.client.close()
 
     def retrieve_response(
@@ -107,19 +323,20 @@ class MongoCacheStorage(CacheStorage):
         :param request:
         :type request: TRequest
         """
-        data = self._read_data(spider, request)
-        if data is None:
-            return  # not cached
-        url = data["url"]
-        status = data["status"]
-        headers = Headers(data["headers"])
-        body = data["body"]
-        respcls = responsetypes.from_args(headers=headers, url=url)
-        response = respcls(url=url, headers=headers, status=status, body=body)
-        return response
+        key = self._request_key(request)
+        update = self.pending.get(key)
+        if update is not None:
+            return self._build_response(update["$set"])  # not flushed yet
+        return self._build_response(
+            self.collection.find_one({"key": key}, {"data": True, "time": True})
+        )
 
     def store_response(
-        self, spider: TSpider, request: TRequest, response: TResponse
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
     ) -> None:
         """
 
@@ -129,93 +346,265 @@ class MongoCacheStorage(CacheStorage):
         :type request: TRequest
         :param response:
         :type response: TResponse
+        :param timestamp: when the response was stored, now if None, e.g.
+            the original time of an imported entry
+        :type timestamp: Optional[float]
         """
-        data = {
-            "status": response.status,
-            "url": response.url,
-            "headers": response.headers.to_unicode_dict(),
-            "body": response.body,
-        }
-        data_for_human = {
-            "status": response.status,
-            "url": response.url,
-            "headers": self._convert_headers(response),
-            "body": response.text,
-        }
         key = self._request_key(request)
-        self.collection.update_one(
-            {"key": key},
-            {
-                "$set": {
-                    "data": data,
-                    "data_for_human": data_for_human,
-                    "key": key,
-                    "time": datetime.utcnow(),
-                }
-            },
-            upsert=True,
-        )
+        update = self._build_update(request, response, timestamp)
+        if self.batch_size <= 1:
+            self.collection.update_one({"key": key}, update, upsert=True)
+            return
+
+        with self.pending_lock:
+            self.pending[key] = update
+            if len(self.pending) >= self.batch_size or (
+                0 < self.batch_interval <= time() - self.last_flush
+            ):
+                self._flush()
+
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> List[Optional[TResponse]]:
+        """
 
-    def _read_data(
-        self, spider: TSpider, request: TRequest
-    ) -> Optional[Dict[str, Union[int, str, bytes, Dict]]]:
-        key = self._request_key(request)
+        :param spider:
+        :type spider: TSpider
+        :param requests:
+        :type requests: List[TRequest]
+        :return:
+        :rtype: List[Optional[TResponse]]
+        """
+        keys = [self._request_key(request) for request in requests]
+        pending = self.pending
+        documents = {
+            v["key"]: v
+            for v in self.collection.find(
+                {"key": {"$in": keys}}, {"key": True, "data": True, "time": True}
+            )
+        }
+        return [
+            self._build_response(
+                pending[key]["$set"] if key in pending else documents.get(key)
+            )
+            for key in keys
+        ]
 
-        v = self.collection.find_one({"key": key}, {"data": True, "time": True})
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        """
 
-        if not v:
-            return  # not found
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[str]
+        """
+        with self.pending_lock:
+            self._flush()
+        for v in self.collection.find({}, {"key": True, "_id": False}):
+            yield v["key"]
 
-        if 0 < self.expiration_secs < time() - v["time"].timestamp():
-            return  # expired
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        """
 
-        return v["data"]
+        :param spider:
+        :type spider: TSpider
+        :return: the key, the timestamp and the size of the stored body of
+            every document
+        :rtype: Iterator[Tuple[str, float, int]]
+        """
+        return self._iter_entries({})
 
-    def _convert_headers(self, response: TResponse):
-        encoding = response.headers.encoding
-        headers = response.headers.to_unicode_dict()
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        """
+        The documents of the key range of the shard, read with the key index
 
-        set_cookie = []
-        for cookie in [
-            to_unicode(i, encoding) for i in response.headers.getlist("set-cookie")
-        ]:
-            cookie_ = {}
-            for j in cookie.split(";"):
-                key, value = j.split("=", 1)
-                cookie_[key.strip()] = value.strip()
-            if "expires" in cookie_:
-                cookie_["expires"] = datetime.strptime(
-                    cookie_["expires"], "%a, %d %b %Y %H:%M:%S %Z"
-                )
-            set_cookie.append(cookie_)
-        headers["set-cookie"] = set_cookie
+        :param spider:
+        :type spider: TSpider
+        :param shard:
+        :type shard: int
+        :param shards:
+        :type shards: int
+        :return:
+        :rtype: Iterator[Tuple[str, float, int]]
+        """
+        after, until = key_range(shard, shards)
+        query = {}
+        if after is not None:
+            query["$gt"] = after
+        if until is not None:
+            query["$lte"] = until
+        return self._iter_entries({"key": query} if query else {})
+
+    def _iter_entries(self, query: Dict[str, Any]) -> Iterator[Tuple[str, float, int]]:
+        with self.pending_lock:
+            self._flush()
+        projection = {"key": True, "time": True, "data.body": True, "_id": False}
+        for v in self.collection.find(query, projection):
+            yield v["key"], v["time"].timestamp(), len(v["data"]["body"])
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        """
 
-        if "date" in headers:
-            headers["date"] = datetime.strptime(
-                headers["date"], "%a, %d %b %Y %H:%M:%S %Z"
-            )
+        :param spider:
+        :type spider: TSpider
+        :param fingerprints:
+        :type fingerprints: List[str]
+        """
+        with self.pending_lock:
+            for key in fingerprints:
+                self.pending.pop(key, None)
+        self.collection.delete_many({"key": {"$in": list(fingerprints)}})
 
-        return headers
+    def compact(self, spider: TSpider) -> None:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        """
+        with self.pending_lock:
+            self._flush()
+        self.db.command("compact", self.collection.name)
+
+    def _schedule(self, delay: float, spider: TSpider) -> None:
+        from twisted.internet import reactor
+
+        if self.batch_size > 1 and self.batch_interval > 0 and not self.stopped:
+            self.call = reactor.callLater(max(delay, 0), self._run_flush, spider)
+
+    def _run_flush(self, spider: TSpider) -> None:
+        # the buffer left by the last writes before an idle period, written
+        # off the reactor thread
+        self.call = None
+        flushed = deferToThread(self._flush_due)
+        flushed.addErrback(self._flush_failed, spider)
+        flushed.addCallback(lambda _: self._schedule(self._flush_delay(), spider))
+
+    def _flush_due(self) -> None:
+        with self.pending_lock:
+            if self._flush_delay() <= 0:
+                self._flush()
+
+    def _flush_delay(self) -> float:
+        return self.last_flush + self.batch_interval - time()
+
+    def _flush_failed(self, failure: Failure, spider: TSpider) -> None:
+        logger.error(
+            "Writing the buffered responses failed: %(error)s"
+            % {"error": failure.getErrorMessage()},
+            extra={"spider": spider},
+        )
+
+    def _flush(self) -> None:
+        """
+        Write the buffered upserts, the caller must hold ``pending_lock``
+        """
+        self.last_flush = time()
+        if not self.pending:
+            return
+        self.collection.bulk_write(
+            [
+                UpdateOne({"key": key}, update, upsert=True)
+                for key, update in self.pending.items()
+            ],
+            ordered=False,
+        )
+        # keep serving the buffer until the write went through
+        self.pending = {}
+
+    def fill_data_for_human(self, batch_size: int = 100) -> int:
+        """
+        Add the human readable projection to the documents stored without it,
+        i.e. with ``HTTPCACHE_MONGO_DATA_FOR_HUMAN = False``, so that it can be
+        built by a separate job instead of on the crawl's write path
+
+        :param batch_size: the number of documents updated per bulk_write
+        :type batch_size: int
+        :return: the number of updated documents
+        :rtype: int
+        """
+        count = 0
+        operations = []
+        for v in self.collection.find(
+            {"data_for_human": {"$exists": False}}, {"key": True, "data": True}
+        ):
+            if not self._can_decode(v["data"].get("codec")):
+                continue
+            response = self._response_from_data(v["data"])
+            operations.append(
+                UpdateOne(
+                    {"key": v["key"]},
+                    {"$set": {"data_for_human": self._build_data_for_human(response)}},
+                )
+            )
+            if len(operations) >= batch_size:
+                count += self.collection.bulk_write(operations).modified_count
+                operations = []
+        if operations:
+            count += self.collection.bulk_write(operations).modified_count
+        return count
 
 
-class MongoAsyncCacheStorage(CacheStorage):
+class MongoAsyncCacheStorage(MongoStorageMixin, AsyncCacheStorage):
     """
     The async mongo cache storage with motor
+
+    It requires the asyncio reactor, i.e. ``TWISTED_REACTOR =
+    "twisted.internet.asyncioreactor.AsyncioSelectorReactor"``.
     """
 
     def __init__(self, settings: Settings):
+        # checked on creation, so that a crawler without the asyncio reactor
+        # fails on start rather than on opening the spider, and not with
+        # NotConfigured, which would only disable the middleware
+        if not is_asyncio_reactor_installed():
+            raise ValueError(
+                "MongoAsyncCacheStorage requires the asyncio reactor, set "
+                "TWISTED_REACTOR to "
+                "'twisted.internet.asyncioreactor.AsyncioSelectorReactor'"
+            )
         super(MongoAsyncCacheStorage, self).__init__(settings)
 
         self.client: Optional[AsyncIOMotorClient] = None
         self.db: Optional[AsyncIOMotorDatabase] = None
         self.collection: Optional[AsyncIOMotorCollection] = None
 
-    def open_spider(self, spider: TSpider) -> None:
+    def open_spider(self, spider: TSpider) -> Deferred:
         """
 
         :param spider:
         :type spider: TSpider
+        :return:
+        :rtype: Deferred
         """
+        self.client = AsyncIOMotorClient(**self.mongo_settings)
+        self.db = self.client.get_database(
+            **get_arguments(self.settings["HTTPCACHE_MONGO_DATABASE"])
+        )
+        self.collection = self.db.get_collection(
+            **get_arguments(self.settings["HTTPCACHE_MONGO_COLLECTION"])
+        )
+        return deferred_from_coro(self._open_spider(spider))
+
+    async def _open_spider(self, spider: TSpider) -> None:
+        await self.collection.create_index([("key", ASCENDING)], unique=True)
+        change = self._ttl_index_change(await self.collection.index_information())
+        if change == "create":
+            await self.collection.create_index(
+                [("time", ASCENDING)],
+                name=TTL_INDEX,
+                expireAfterSeconds=self.expiration_secs,
+            )
+        elif change == "modify":
+            await self.db.command(
+                "collMod",
+                self.collection.name,
+                index={"name": TTL_INDEX, "expireAfterSeconds": self.expiration_secs},
+            )
+        elif change == "drop":
+            await self.collection.drop_index(TTL_INDEX)
+        self._log_opened(spider)
 
     def close_spider(self, spider: TSpider) -> None:
         """
@@ -223,22 +612,59 @@ class MongoAsyncCacheStorage(CacheStorage):
         :param spider:
         :type spider: TSpider
         """
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
-    def retrieve_response(
-        self, spider: TSpider, request: TRequest
-    ) -> Optional[TResponse]:
+    def retrieve_response(self, spider: TSpider, request: TRequest) -> Deferred:
         """
 
         :param spider:
         :type spider: TSpider
         :param request:
         :type request: TRequest
+        :return:
+        :rtype: Deferred
         """
+        return deferred_from_coro(self._retrieve_response(spider, request))
+
+    async def _retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Optional[TResponse]:
+        key = self._request_key(request)
+        return self._build_response(
+            await self.collection.find_one({"key": key}, {"data": True, "time": True})
+        )
+
+    def retrieve_responses(self, spider: TSpider, requests: List[TRequest]) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param requests:
+        :type requests: List[TRequest]
+        :return:
+        :rtype: Deferred
+        """
+        return deferred_from_coro(self._retrieve_responses(spider, requests))
+
+    async def _retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> List[Optional[TResponse]]:
+        keys = [self._request_key(request) for request in requests]
+        cursor = self.collection.find(
+            {"key": {"$in": keys}}, {"key": True, "data": True, "time": True}
+        )
+        documents = {v["key"]: v for v in await cursor.to_list(None)}
+        return [self._build_response(documents.get(key)) for key in keys]
 
     def store_response(
-        self, spider: TSpider, request: TRequest, response: TResponse
-    ) -> None:
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Deferred:
         """
 
         :param spider:
@@ -247,4 +673,39 @@ class MongoAsyncCacheStorage(CacheStorage):
         :type request: TRequest
         :param response:
         :type response: TResponse
+        :param timestamp: when the response was stored, now if None, e.g.
+            the original time of an imported entry
+        :type timestamp: Optional[float]
+        :return:
+        :rtype: Deferred
+        """
+        return deferred_from_coro(
+            self._store_response(spider, request, response, timestamp)
+        )
+
+    async def _store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        key = self._request_key(request)
+        await self.collection.update_one(
+            {"key": key}, self._build_update(request, response, timestamp), upsert=True
+        )
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> Deferred:
         """
+
+        :param spider:
+        :type spider: TSpider
+        :param fingerprints:
+        :type fingerprints: List[str]
+        :return:
+        :rtype: Deferred
+        """
+        return deferred_from_coro(self._delete_responses(spider, fingerprints))
+
+    async def _delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        await self.collection.delete_many({"key": {"$in": list(fingerprints)}})
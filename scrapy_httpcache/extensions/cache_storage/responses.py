@@ -0,0 +1,146 @@
+"""
+The reconstruction of the cached responses without sniffing their class
+
+The class ``responsetypes`` picks from the headers and the url is recorded
+when a response is stored, and its headers are parsed straight into the
+bytes names and lists of bytes values ``Headers`` is built from, so that a
+hit normalizes them once, when the response copies them.
+
+The dates the freshness of a response is computed from are parsed when it is
+stored too, and attached to it when it is read back, for ``RFC2616Policy`` to
+check it with arithmetic on them.
+
+The time a response was stored at is attached to it as well, for a storage
+in front of another to keep it as long as the other.
+"""
+from typing import Dict, List, Mapping, Optional, Tuple, Type
+from weakref import WeakKeyDictionary
+
+from scrapy.http import Response
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+
+from scrapy_httpcache import TResponse
+from scrapy_httpcache.extensions.policy.rfc2616 import parse_dates, record_dates
+
+#: The classes a recorded name may refer to, those of ``responsetypes``
+RESPONSE_CLASSES: Dict[str, Type[TResponse]] = {
+    cls.__name__: cls for cls in (Response, *responsetypes.classes.values())
+}
+
+# the time the entries the cached responses were read from were stored at,
+# attached by the storages when they rebuild them
+_stored_timestamps: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def response_class_name(response: TResponse) -> str:
+    """
+
+    :param response:
+    :type response: TResponse
+    :return: the name of the class to record with the response, the one it is
+        read back as
+    :rtype: str
+    """
+    return responsetypes.from_args(headers=response.headers, url=response.url).__name__
+
+
+def response_class(
+    name: Optional[str], headers: Mapping, url: str
+) -> Tuple[Type[TResponse], Mapping]:
+    """
+    The class of a cached response, the recorded one, or sniffed from its
+    headers and url if it was stored without
+
+    :param name: the recorded name of the class
+    :type name: Optional[str]
+    :param headers:
+    :type headers: Mapping
+    :param url:
+    :type url: str
+    :return: the class, and the headers to build the response with, as
+        ``Headers`` if they were needed to sniff the class
+    :rtype: Tuple[Type[TResponse], Mapping]
+    """
+    respcls = RESPONSE_CLASSES.get(name) if name else None
+    if respcls is not None:
+        return respcls, headers
+    headers = Headers(headers)
+    return responsetypes.from_args(headers=headers, url=url), headers
+
+
+def parse_headers(raw: bytes) -> Dict[bytes, List[bytes]]:
+    """
+    Parse headers written by ``headers_dict_to_raw``, one line per value
+
+    :param raw:
+    :type raw: bytes
+    :return:
+    :rtype: Dict[bytes, List[bytes]]
+    """
+    headers: Dict[bytes, List[bytes]] = {}
+    for line in raw.split(b"\r\n"):
+        name, sep, value = line.partition(b":")
+        if sep:
+            headers.setdefault(name.strip(), []).append(value.strip())
+    return headers
+
+
+def response_dates(response: TResponse) -> str:
+    """
+
+    :param response:
+    :type response: TResponse
+    :return: the epochs of the Date, Expires and Last-Modified headers of the
+        response, to record with it, comma separated and empty if missing
+    :rtype: str
+    """
+    return ",".join(
+        "" if epoch is None else str(epoch) for epoch in parse_dates(response.headers)
+    )
+
+
+def attach_dates(response: TResponse, dates: Optional[str]) -> TResponse:
+    """
+    Attach the dates recorded with a cached response to it, if it was stored
+    with them
+
+    :param response:
+    :type response: TResponse
+    :param dates: as returned by ``response_dates``
+    :type dates: Optional[str]
+    :return: the response
+    :rtype: TResponse
+    """
+    if dates:
+        record_dates(
+            response, tuple(int(epoch) if epoch else None for epoch in dates.split(","))
+        )
+    return response
+
+
+def attach_timestamp(response: TResponse, timestamp: float) -> TResponse:
+    """
+    Attach to a cached response the time it was stored at
+
+    :param response:
+    :type response: TResponse
+    :param timestamp:
+    :type timestamp: float
+    :return: the response
+    :rtype: TResponse
+    """
+    _stored_timestamps[response] = timestamp
+    return response
+
+
+def stored_timestamp(response: TResponse) -> Optional[float]:
+    """
+
+    :param response:
+    :type response: TResponse
+    :return: the time the response was stored at, if it was read from a
+        storage attaching it
+    :rtype: Optional[float]
+    """
+    return _stored_timestamps.get(response)
@@ -0,0 +1,572 @@
+"""
+The segment log cache storage
+"""
+import logging
+import os
+import struct
+import tempfile
+from functools import partial
+from threading import Lock
+from time import time
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from scrapy.settings import Settings
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw
+
+from scrapy_httpcache import TRequest, TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage import CacheStorage
+from scrapy_httpcache.extensions.cache_storage.lazy import (
+    MissingBodyError,
+    lazy_response_class,
+    map_file,
+)
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    attach_timestamp,
+    parse_headers,
+    response_class,
+    response_class_name,
+    response_dates,
+)
+from scrapy_httpcache.extensions.cache_storage.serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_NAME = "index"
+
+# magic, key length, timestamp, then the length of meta, headers and body
+RECORD_MAGIC = b"SHCL"
+RECORD_HEADER = struct.Struct(">4sHdIIQ")
+# magic, version, then the segment and offset the index is complete up to
+INDEX_MAGIC = b"SHCI"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct(">4sBIQ")
+# key length, segment, offset, record length, timestamp, followed by the key
+INDEX_ENTRY = struct.Struct(">HIQQd")
+
+
+class IndexEntry(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+    timestamp: float
+
+
+class Record(NamedTuple):
+    key: bytes
+    timestamp: float
+    meta: bytes
+    headers: bytes
+    body: bytes
+
+
+def parse_record(data: bytes) -> Record:
+    """
+    Parse a whole record as read from a segment
+
+    :param data:
+    :type data: bytes
+    :return:
+    :rtype: Record
+    """
+    magic, keylen, timestamp, metalen, headerslen, bodylen = RECORD_HEADER.unpack_from(
+        data
+    )
+    if magic != RECORD_MAGIC:
+        raise ValueError("Not a segment log record")
+    offset = RECORD_HEADER.size
+    key = data[offset : offset + keylen]
+    offset += keylen
+    meta = data[offset : offset + metalen]
+    offset += metalen
+    headers = data[offset : offset + headerslen]
+    offset += headerslen
+    return Record(key, timestamp, meta, headers, data[offset : offset + bodylen])
+
+
+class SegmentLog(object):
+    """
+    Append-only segment files with an in-memory index of the latest record of
+    every key
+
+    The index is saved on close. On open it is loaded and completed by
+    scanning the records appended after it was saved, so an unclean shutdown
+    only costs a partial scan. A deleted key is recorded by a tombstone, a
+    record without meta.
+
+    The readers look an entry up and take the descriptor of its segment under
+    the lock, and release it after their ``pread``, so that a compaction
+    running meanwhile only closes the descriptors of the old segments once
+    their last reader is done.
+    """
+
+    def __init__(self, path: str, segment_size: int):
+        """
+
+        :param path: the directory of the segments and index
+        :type path: str
+        :param segment_size: the size after which a new segment is started
+        :type segment_size: int
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.index: Dict[bytes, IndexEntry] = {}
+        self.lock = Lock()
+        self.fds: Dict[int, int] = {}
+        # segment -> number of reads in progress, the removed segments whose
+        # descriptor is closed by their last reader
+        self.readers: Dict[int, int] = {}
+        self.retired: Set[int] = set()
+        self.active: Optional[BinaryIO] = None
+        self.active_segment = 0
+        self.active_size = 0
+
+    def open(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        segment, offset = self._load_index()
+        for s in self.segments():
+            if s >= segment:
+                self._scan(s, offset if s == segment else 0)
+        segments = self.segments()
+        self._activate(segments[-1] if segments else 1)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.active is None:
+                return
+            self.active.close()
+            self.active = None
+            self._save_index()
+            for fd in self.fds.values():
+                os.close(fd)
+            self.fds.clear()
+            self.readers.clear()
+            self.retired.clear()
+
+    def segments(self):
+        return sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def append(
+        self, key: bytes, timestamp: float, meta: bytes, headers: bytes, body: bytes
+    ) -> None:
+        """
+
+        :param key:
+        :type key: bytes
+        :param timestamp:
+        :type timestamp: float
+        :param meta:
+        :type meta: bytes
+        :param headers:
+        :type headers: bytes
+        :param body:
+        :type body: bytes
+        """
+        with self.lock:
+            self._write(key, timestamp, meta, headers, body)
+
+    def delete(self, key: bytes) -> None:
+        """
+        Append the tombstone of a key
+
+        :param key:
+        :type key: bytes
+        """
+        if key in self.index:
+            self.append(key, time(), b"", b"", b"")
+
+    def read(self, key: bytes) -> Optional[Record]:
+        """
+
+        :param key:
+        :type key: bytes
+        :return:
+        :rtype: Optional[Record]
+        """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return  # not found
+            fd = self._acquire(entry.segment)
+        try:
+            return parse_record(os.pread(fd, entry.length, entry.offset))
+        finally:
+            self._release(entry.segment)
+
+    def pread(self, segment: int, offset: int, length: int) -> bytes:
+        """
+
+        :param segment:
+        :type segment: int
+        :param offset:
+        :type offset: int
+        :param length:
+        :type length: int
+        :return:
+        :rtype: bytes
+        """
+        with self.lock:
+            fd = self._acquire(segment)
+        try:
+            return os.pread(fd, length, offset)
+        finally:
+            self._release(segment)
+
+    def read_head(self, key: bytes) -> Optional[Tuple[Record, int, int, int]]:
+        """
+        Read a record but its body, e.g. to memory-map the body
+
+        :param key:
+        :type key: bytes
+        :return: the record without body, the segment, offset and length of
+            the body
+        :rtype: Optional[Tuple[Record, int, int, int]]
+        """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return  # not found
+            fd = self._acquire(entry.segment)
+        try:
+            header = os.pread(fd, RECORD_HEADER.size, entry.offset)
+            _, keylen, _, metalen, headerslen, bodylen = RECORD_HEADER.unpack(header)
+            data = os.pread(
+                fd, keylen + metalen + headerslen, entry.offset + RECORD_HEADER.size
+            )
+        finally:
+            self._release(entry.segment)
+        record = parse_record(header + data)._replace(body=None)
+        return record, entry.segment, entry.offset + entry.length - bodylen, bodylen
+
+    def records(self, segment: int, offset: int = 0) -> Iterator[Tuple[int, Record]]:
+        """
+        Iterate over the records of a segment, stopping at a truncated one
+
+        :param segment:
+        :type segment: int
+        :param offset:
+        :type offset: int
+        :return: the offset and the record
+        :rtype: Iterator[Tuple[int, Record]]
+        """
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                magic, keylen, _, metalen, headerslen, bodylen = RECORD_HEADER.unpack(
+                    header
+                )
+                if magic != RECORD_MAGIC:
+                    return
+                size = keylen + metalen + headerslen + bodylen
+                data = f.read(size)
+                if len(data) < size:
+                    return
+                yield offset, parse_record(header + data)
+                offset += RECORD_HEADER.size + size
+
+    def compact(self, expiration_secs: int = 0) -> None:
+        """
+        Rewrite the live records to new segments, dropping the superseded and
+        expired ones, then remove the old segments
+
+        The records stored or deleted meanwhile are not rewritten, their
+        index entry changed.
+
+        :param expiration_secs:
+        :type expiration_secs: int
+        """
+        now = time()
+        with self.lock:
+            old_segments = self.segments()
+            self.active.close()
+            self._activate(old_segments[-1] + 1)
+            live = sorted(self.index.items(), key=lambda item: item[1][:2])
+        for key, entry in live:
+            if entry.segment not in old_segments:
+                continue  # appended meanwhile
+            if 0 < expiration_secs < now - entry.timestamp:
+                with self.lock:
+                    if self.index.get(key) == entry:
+                        del self.index[key]
+                continue
+            record = parse_record(self.pread(entry.segment, entry.offset, entry.length))
+            with self.lock:
+                if self.index.get(key) != entry:
+                    continue  # stored or deleted meanwhile
+                self._write(
+                    key, record.timestamp, record.meta, record.headers, record.body
+                )
+        with self.lock:
+            self._save_index()
+            for segment in old_segments:
+                os.remove(self.segment_path(segment))
+                if self.readers.get(segment):
+                    self.retired.add(segment)
+                else:
+                    self._close_fd(segment)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, "%08d%s" % (segment, SEGMENT_SUFFIX))
+
+    def _acquire(self, segment: int) -> int:
+        # with the lock held, the descriptor stays open until released
+        fd = self.fds.get(segment)
+        if fd is None:
+            fd = self.fds[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+        self.readers[segment] = self.readers.get(segment, 0) + 1
+        return fd
+
+    def _release(self, segment: int) -> None:
+        with self.lock:
+            count = self.readers.pop(segment) - 1
+            if count:
+                self.readers[segment] = count
+            elif segment in self.retired:
+                self.retired.discard(segment)
+                self._close_fd(segment)
+
+    def _close_fd(self, segment: int) -> None:
+        fd = self.fds.pop(segment, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _write(
+        self, key: bytes, timestamp: float, meta: bytes, headers: bytes, body: bytes
+    ) -> None:
+        # with the lock held
+        header = RECORD_HEADER.pack(
+            RECORD_MAGIC, len(key), timestamp, len(meta), len(headers), len(body)
+        )
+        length = len(header) + len(key) + len(meta) + len(headers) + len(body)
+        if self.active_size and self.active_size + length > self.segment_size:
+            self.active.close()
+            self._activate(self.active_segment + 1)
+        offset = self.active_size
+        for data in (header, key, meta, headers, body):
+            self.active.write(data)
+        # make the record visible to the pread of the readers
+        self.active.flush()
+        self.active_size += length
+        if meta:
+            self.index[key] = IndexEntry(self.active_segment, offset, length, timestamp)
+        else:
+            self.index.pop(key, None)
+
+    def _activate(self, segment: int) -> None:
+        path = self.segment_path(segment)
+        self.active = open(path, "ab")
+        self.active_segment = segment
+        self.active_size = self.active.tell()
+
+    def _scan(self, segment: int, offset: int) -> None:
+        end = offset
+        for offset, record in self.records(segment, offset):
+            length = (
+                RECORD_HEADER.size
+                + len(record.key)
+                + len(record.meta)
+                + len(record.headers)
+                + len(record.body)
+            )
+            if record.meta:
+                self.index[record.key] = IndexEntry(
+                    segment, offset, length, record.timestamp
+                )
+            else:
+                self.index.pop(record.key, None)
+            end = offset + length
+        if end < os.path.getsize(self.segment_path(segment)):
+            logger.warning(
+                "Truncating the partial record at %(segment)s:%(offset)d",
+                {"segment": self.segment_path(segment), "offset": end},
+            )
+            os.truncate(self.segment_path(segment), end)
+
+    def _load_index(self) -> Tuple[int, int]:
+        path = os.path.join(self.path, INDEX_NAME)
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, segment, offset = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            logger.warning("Ignoring the invalid segment log index %s", path)
+            return 0, 0
+        pos = INDEX_HEADER.size
+        while pos < len(data):
+            keylen, *entry = INDEX_ENTRY.unpack_from(data, pos)
+            pos += INDEX_ENTRY.size
+            self.index[data[pos : pos + keylen]] = IndexEntry(*entry)
+            pos += keylen
+        return segment, offset
+
+    def _save_index(self) -> None:
+        fd, tmppath = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(
+                INDEX_HEADER.pack(
+                    INDEX_MAGIC, INDEX_VERSION, self.active_segment, self.active_size
+                )
+            )
+            for key, entry in self.index.items():
+                f.write(INDEX_ENTRY.pack(len(key), *entry))
+                f.write(key)
+        os.replace(tmppath, os.path.join(self.path, INDEX_NAME))
+
+
+class SegmentLogCacheStorage(CacheStorage):
+    """
+    The segment log cache storage
+
+    Every response is appended to large segment files under
+    ``HTTPCACHE_DIR/<spider>.log/``, the fingerprints are indexed in memory and
+    a hit is a single ``pread``. Use :meth:`SegmentLog.compact` to reclaim the
+    space of superseded, deleted and expired records.
+    """
+
+    thread_safe = True
+
+    def __init__(self, settings: Settings):
+        super(SegmentLogCacheStorage, self).__init__(settings)
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.segment_size = settings.getint(
+            "HTTPCACHE_SEGMENT_LOG_SEGMENT_SIZE", 256 * 1024 * 1024
+        )
+        self.log: Optional[SegmentLog] = None
+
+    def open_spider(self, spider: TSpider) -> None:
+        path = os.path.join(self.cachedir, "%s.log" % spider.name)
+        self.log = SegmentLog(path, self.segment_size)
+        self.log.open()
+
+        logger.debug(
+            "Using segment log cache storage in %(cachepath)s" % {"cachepath": path},
+            extra={"spider": spider},
+        )
+
+    def close_spider(self, spider: TSpider) -> None:
+        self.log.close()
+
+    def retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Optional[TResponse]:
+        key = self._request_key(request).encode()
+        entry = self.log.index.get(key)
+        if entry is None:
+            return  # not cached
+        if 0 < self.expiration_secs < time() - entry.timestamp:
+            return  # expired
+        response = self._read_response(key, entry)
+        if response is None:
+            return  # deleted meanwhile, or compressed with another dictionary
+        return attach_timestamp(response, entry.timestamp)
+
+    def _read_response(self, key: bytes, entry: IndexEntry) -> Optional[TResponse]:
+        if self.lazy_body or self._use_mmap(None, entry.length):
+            head = self.log.read_head(key)
+            if head is None:
+                return  # deleted meanwhile
+            record, segment, offset, length = head
+        else:
+            record = self.log.read(key)
+            if record is None:
+                return  # deleted meanwhile
+        meta = loads(record.meta)
+        if not self._can_decode(meta.get("codec")):
+            return  # compressed with another dictionary
+        url = meta["url"]
+        status = meta["status"]
+        respcls, headers = response_class(
+            meta.get("class"), parse_headers(record.headers), url
+        )
+        if record.body is None:
+            if self._use_mmap(meta.get("codec"), length):
+                try:
+                    body_buffer = map_file(
+                        self.log.segment_path(segment), offset, length
+                    )
+                except FileNotFoundError:
+                    return  # compacted meanwhile
+                return attach_dates(
+                    lazy_response_class(respcls)(
+                        url=url,
+                        headers=headers,
+                        status=status,
+                        body_buffer=body_buffer,
+                    ),
+                    meta.get("dates"),
+                )
+            if self.lazy_body:
+                return attach_dates(
+                    self._lazy_response(
+                        respcls,
+                        meta.get("codec"),
+                        partial(self._read_body, segment, offset, length),
+                        url=url,
+                        headers=headers,
+                        status=status,
+                    ),
+                    meta.get("dates"),
+                )
+            try:
+                body = self.log.pread(segment, offset, length)
+            except FileNotFoundError:
+                return  # compacted meanwhile
+            record = record._replace(body=body)
+        body = self._decode_body(meta.get("codec"), record.body)
+        response = respcls(url=url, headers=headers, status=status, body=body)
+        return attach_dates(response, meta.get("dates"))
+
+    def _read_body(self, segment: int, offset: int, length: int) -> bytes:
+        try:
+            return self.log.pread(segment, offset, length)
+        except FileNotFoundError:
+            raise MissingBodyError("Compacted cache segment: %d" % segment)
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        for key in list(self.log.index):
+            yield key.decode()
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        for key, entry in list(self.log.index.items()):
+            yield key.decode(), entry.timestamp, entry.length
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        for key in fingerprints:
+            self.log.delete(key.encode())
+
+    def compact(self, spider: TSpider) -> None:
+        self.log.compact(self.expiration_secs)
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        key = self._request_key(request).encode()
+        codec, body = self._encode_body(response.body)
+        meta = {
+            "url": response.url,
+            "status": response.status,
+            "codec": codec,
+            "class": response_class_name(response),
+            "dates": response_dates(response),
+        }
+        self.log.append(
+            key,
+            time() if timestamp is None else timestamp,
+            dumps(meta),
+            headers_dict_to_raw(response.headers),
+            body,
+        )
@@ -0,0 +1,133 @@
+"""
+The binary encoding of the metadata of the cached responses
+"""
+import io
+import pickle
+import struct
+from typing import Any, Dict, Union
+
+ENTRY_MAGIC = b"SHCE"
+ENTRY_VERSION = 1
+# magic, version and number of fields
+ENTRY_HEADER = struct.Struct(">4sBH")
+# length of the name, type and length of the value
+FIELD_HEADER = struct.Struct(">BBI")
+
+TYPE_NONE = 0
+TYPE_BYTES = 1
+TYPE_STR = 2
+TYPE_INT = 3
+TYPE_FLOAT = 4
+INT = struct.Struct(">q")
+FLOAT = struct.Struct(">d")
+
+TValue = Union[None, bytes, str, int, float]
+
+
+def dumps(fields: Dict[str, TValue]) -> bytes:
+    """
+    Encode flat fields as length-prefixed values
+
+    :param fields:
+    :type fields: Dict[str, TValue]
+    :return:
+    :rtype: bytes
+    """
+    parts = [ENTRY_HEADER.pack(ENTRY_MAGIC, ENTRY_VERSION, len(fields))]
+    for name, value in fields.items():
+        if value is None:
+            kind, data = TYPE_NONE, b""
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            kind, data = TYPE_BYTES, value
+        elif isinstance(value, str):
+            kind, data = TYPE_STR, value.encode()
+        elif isinstance(value, bool):
+            raise TypeError("Cannot encode %r: %r" % (name, value))
+        elif isinstance(value, int):
+            kind, data = TYPE_INT, INT.pack(value)
+        elif isinstance(value, float):
+            kind, data = TYPE_FLOAT, FLOAT.pack(value)
+        else:
+            raise TypeError("Cannot encode %r: %r" % (name, value))
+        name = name.encode()
+        parts.append(FIELD_HEADER.pack(len(name), kind, len(data)))
+        parts.append(name)
+        parts.append(data)
+    return b"".join(parts)
+
+
+def loads(data: bytes) -> Dict[str, Any]:
+    """
+    Decode fields encoded by :func:`dumps`, or pickled by the earlier versions
+    of the storages, see :class:`RestrictedUnpickler`
+
+    :param data:
+    :type data: bytes
+    :return:
+    :rtype: Dict[str, Any]
+    :raises ValueError: if the data is neither
+    """
+    if data[:4] != ENTRY_MAGIC:
+        return load_pickle(data)
+    magic, version, count = ENTRY_HEADER.unpack_from(data)
+    if version != ENTRY_VERSION:
+        raise ValueError("Unsupported cache entry version: %d" % version)
+    unpack_field = FIELD_HEADER.unpack_from
+    offset = ENTRY_HEADER.size
+    fields = {}
+    for _ in range(count):
+        namelen, kind, length = unpack_field(data, offset)
+        offset += FIELD_HEADER.size
+        name = data[offset : offset + namelen].decode()
+        offset += namelen
+        end = offset + length
+        if kind == TYPE_BYTES:
+            fields[name] = bytes(data[offset:end])
+        elif kind == TYPE_STR:
+            fields[name] = data[offset:end].decode()
+        elif kind == TYPE_INT:
+            fields[name] = INT.unpack_from(data, offset)[0]
+        elif kind == TYPE_FLOAT:
+            fields[name] = FLOAT.unpack_from(data, offset)[0]
+        elif kind == TYPE_NONE:
+            fields[name] = None
+        else:
+            raise ValueError("Unknown field type %d of %r" % (kind, name))
+        offset = end
+    return fields
+
+
+class RestrictedUnpickler(pickle.Unpickler):
+    """
+    Unpickle the plain data of the earlier cache entries only
+
+    They hold dicts, lists, strings, bytes and numbers, which need no global
+    but the one pickle protocol 2 encodes bytes with, so that a tampered cache
+    file cannot run code.
+    """
+
+    ALLOWED = {("_codecs", "encode")}
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(
+                "Forbidden global in a cache entry: %s.%s" % (module, name)
+            )
+        return super(RestrictedUnpickler, self).find_class(module, name)
+
+
+def load_pickle(data: bytes) -> Any:
+    """
+    Load a pickle with the :class:`RestrictedUnpickler`
+
+    :param data:
+    :type data: bytes
+    :return:
+    :rtype: Any
+    :raises ValueError: if the data is not an allowed pickle
+    """
+    try:
+        return RestrictedUnpickler(io.BytesIO(data)).load()
+    except Exception as e:
+        # whatever the garbage, the same error as a corrupted entry
+        raise ValueError("Not a cache entry: %s" % e)
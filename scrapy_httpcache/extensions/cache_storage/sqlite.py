@@ -0,0 +1,321 @@
+"""
+The sqlite cache storage
+"""
+import logging
+import os
+import sqlite3
+from functools import partial
+from threading import Lock
+from time import time
+from typing import Iterator, List, Optional, Tuple
+
+from scrapy.settings import Settings
+from scrapy.utils.project import data_path
+from twisted.internet.base import DelayedCall
+from w3lib.http import headers_dict_to_raw
+
+from scrapy_httpcache import TRequest, TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage import CacheStorage, key_range
+from scrapy_httpcache.extensions.cache_storage.lazy import MissingBodyError
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    attach_timestamp,
+    parse_headers,
+    response_class,
+    response_class_name,
+    response_dates,
+)
+
+logger = logging.getLogger(__name__)
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    status INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    headers BLOB NOT NULL,
+    body BLOB NOT NULL,
+    codec TEXT,
+    class_name TEXT,
+    dates TEXT
+)
+"""
+# the columns added to the databases created before they were recorded
+ADDED_COLUMNS = {"class_name": "TEXT", "dates": "TEXT"}
+ADD_COLUMN = "ALTER TABLE responses ADD COLUMN %s %s"
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS responses_timestamp ON responses (timestamp)"
+SELECT = (
+    "SELECT timestamp, status, url, headers, body, codec, class_name, dates "
+    "FROM responses WHERE fingerprint = ?"
+)
+SELECT_MANY = (
+    "SELECT fingerprint, timestamp, status, url, headers, body, codec, class_name, dates "
+    "FROM responses WHERE fingerprint IN (%s)"
+)
+# the same rows without body, read by SELECT_BODY when it is accessed
+SELECT_HEAD = (
+    "SELECT timestamp, status, url, headers, NULL, codec, class_name, dates "
+    "FROM responses WHERE fingerprint = ?"
+)
+SELECT_MANY_HEAD = (
+    "SELECT fingerprint, timestamp, status, url, headers, NULL, codec, class_name, dates "
+    "FROM responses WHERE fingerprint IN (%s)"
+)
+SELECT_BODY = "SELECT body FROM responses WHERE fingerprint = ? AND timestamp = ?"
+# below the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite versions
+SELECT_MANY_SIZE = 500
+UPSERT = (
+    "INSERT OR REPLACE INTO responses "
+    "(fingerprint, timestamp, status, url, headers, body, codec, class_name, dates) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SELECT_KEYS = (
+    "SELECT fingerprint FROM responses WHERE fingerprint > ? "
+    "ORDER BY fingerprint LIMIT ?"
+)
+SELECT_ENTRIES = (
+    "SELECT fingerprint, timestamp, length(url) + length(headers) + length(body) "
+    "FROM responses WHERE fingerprint > ? ORDER BY fingerprint LIMIT ?"
+)
+# those of a range of keys, a shard
+SELECT_ENTRIES_UNTIL = (
+    "SELECT fingerprint, timestamp, length(url) + length(headers) + length(body) "
+    "FROM responses WHERE fingerprint > ? AND fingerprint <= ? "
+    "ORDER BY fingerprint LIMIT ?"
+)
+DELETE = "DELETE FROM responses WHERE fingerprint = ?"
+DELETE_EXPIRED = "DELETE FROM responses WHERE timestamp < ?"
+
+
+class SqliteCacheStorage(CacheStorage):
+    """
+    The sqlite cache storage
+
+    One database per spider in ``HTTPCACHE_DIR``, in WAL mode so that other
+    processes can read it while the crawl writes. Writes are grouped in
+    transactions of ``HTTPCACHE_SQLITE_COMMIT_SIZE`` responses or
+    ``HTTPCACHE_SQLITE_COMMIT_INTERVAL`` seconds, the latter also checked by a
+    timer so that the last writes before an idle period are committed. The
+    statements are prepared once by the statement cache of the connection.
+    """
+
+    thread_safe = True
+    multiprocess = True
+
+    def __init__(self, settings: Settings):
+        super(SqliteCacheStorage, self).__init__(settings)
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.commit_size: int = settings.getint("HTTPCACHE_SQLITE_COMMIT_SIZE", 100)
+        self.commit_interval: float = settings.getfloat(
+            "HTTPCACHE_SQLITE_COMMIT_INTERVAL", 1
+        )
+        self.db: Optional[sqlite3.Connection] = None
+        self.lock: Lock = Lock()
+        self.uncommitted: int = 0
+        self.last_commit: float = time()
+        self.call: Optional[DelayedCall] = None
+
+    def open_spider(self, spider: TSpider) -> None:
+        dbpath = os.path.join(self.cachedir, "%s.sqlite" % spider.name)
+        # transactions are handled explicitly to group the writes
+        self.db = sqlite3.connect(dbpath, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(CREATE_TABLE)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(responses)")]
+        for column, kind in ADDED_COLUMNS.items():
+            if column not in columns:
+                self.db.execute(ADD_COLUMN % (column, kind))
+        self.db.execute(CREATE_INDEX)
+        self._schedule(self.commit_interval)
+
+        logger.debug(
+            "Using sqlite cache storage in %(cachepath)s" % {"cachepath": dbpath},
+            extra={"spider": spider},
+        )
+
+    def close_spider(self, spider: TSpider) -> None:
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        with self.lock:
+            self._commit()
+            self.db.close()
+
+    def retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Optional[TResponse]:
+        key = self._request_key(request)
+        with self.lock:
+            row = self.db.execute(
+                SELECT_HEAD if self.lazy_body else SELECT, (key,)
+            ).fetchone()
+        return self._build_response(row, key)
+
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> List[Optional[TResponse]]:
+        keys = [self._request_key(request) for request in requests]
+        rows = {}
+        for i in range(0, len(keys), SELECT_MANY_SIZE):
+            chunk = keys[i : i + SELECT_MANY_SIZE]
+            query = (SELECT_MANY_HEAD if self.lazy_body else SELECT_MANY) % ", ".join(
+                "?" * len(chunk)
+            )
+            with self.lock:
+                for key, *row in self.db.execute(query, chunk):
+                    rows[key] = row
+        return [self._build_response(rows.get(key), key) for key in keys]
+
+    def _build_response(self, row: Optional[Tuple], key: str) -> Optional[TResponse]:
+        if row is None:
+            return  # not cached
+        timestamp, status, url, rawheaders, body, codec, class_name, dates = row
+        if 0 < self.expiration_secs < time() - timestamp:
+            return  # expired
+        if not self._can_decode(codec):
+            return  # compressed with another dictionary
+        respcls, headers = response_class(class_name, parse_headers(rawheaders), url)
+        if body is None:
+            response = self._lazy_response(
+                respcls,
+                codec,
+                partial(self._read_body, key, timestamp),
+                url=url,
+                headers=headers,
+                status=status,
+            )
+        else:
+            body = self._decode_body(codec, body)
+            response = respcls(url=url, headers=headers, status=status, body=body)
+        return attach_timestamp(attach_dates(response, dates), timestamp)
+
+    def _read_body(self, key: str, timestamp: float) -> bytes:
+        with self.lock:
+            row = self.db.execute(SELECT_BODY, (key, timestamp)).fetchone()
+        if row is None:
+            # the row was deleted or replaced by a newer response
+            raise MissingBodyError("Removed cache entry: %s" % key)
+        return row[0]
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        key = self._request_key(request)
+        codec, body = self._encode_body(response.body)
+        row = (
+            key,
+            time() if timestamp is None else timestamp,
+            response.status,
+            response.url,
+            headers_dict_to_raw(response.headers),
+            body,
+            codec,
+            response_class_name(response),
+            response_dates(response),
+        )
+        with self.lock:
+            if not self.db.in_transaction:
+                self.db.execute("BEGIN")
+            self.db.execute(UPSERT, row)
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_size or (
+                time() - self.last_commit >= self.commit_interval
+            ):
+                self._commit()
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        # paged on the primary key, so that stores can go on in between
+        last = ""
+        while True:
+            with self.lock:
+                self._commit()
+                rows = self.db.execute(SELECT_KEYS, (last, 1000)).fetchall()
+            if not rows:
+                return
+            for (last,) in rows:
+                yield last
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        return self._iter_entries(None, None)
+
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        return self._iter_entries(*key_range(shard, shards))
+
+    def _iter_entries(
+        self, after: Optional[str], until: Optional[str]
+    ) -> Iterator[Tuple[str, float, int]]:
+        last = after or ""
+        while True:
+            with self.lock:
+                self._commit()
+                if until is None:
+                    rows = self.db.execute(SELECT_ENTRIES, (last, 1000)).fetchall()
+                else:
+                    rows = self.db.execute(
+                        SELECT_ENTRIES_UNTIL, (last, until, 1000)
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row
+            last = rows[-1][0]
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        with self.lock:
+            if not self.db.in_transaction:
+                self.db.execute("BEGIN")
+            self.db.executemany(DELETE, ((key,) for key in fingerprints))
+            self._commit()
+
+    def compact(self, spider: TSpider) -> None:
+        with self.lock:
+            self._commit()
+            self.db.execute("VACUUM")
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def purge_expired(self) -> int:
+        """
+        Delete the expired responses with a single indexed ``DELETE``
+
+        :return: the number of deleted responses
+        :rtype: int
+        """
+        if self.expiration_secs <= 0:
+            return 0
+        with self.lock:
+            self._commit()
+            return self.db.execute(
+                DELETE_EXPIRED, (time() - self.expiration_secs,)
+            ).rowcount
+
+    def _schedule(self, delay: float) -> None:
+        from twisted.internet import reactor
+
+        if self.commit_interval > 0:
+            self.call = reactor.callLater(max(delay, 0), self._commit_due)
+
+    def _commit_due(self) -> None:
+        # the writes not followed by another one within the interval
+        self.call = None
+        with self.lock:
+            if time() - self.last_commit >= self.commit_interval:
+                self._commit()
+            delay = self.last_commit + self.commit_interval - time()
+        self._schedule(delay)
+
+    def _commit(self) -> None:
+        """
+        Commit the pending writes, the caller must hold ``lock``
+        """
+        if self.db.in_transaction:
+            self.db.execute("COMMIT")
+        self.uncommitted = 0
+        self.last_commit = time()
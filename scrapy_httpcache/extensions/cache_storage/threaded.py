@@ -0,0 +1,234 @@
+"""
+The threaded cache storage
+"""
+import logging
+from threading import Lock
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from scrapy.settings import Settings
+from twisted.internet.defer import Deferred
+from twisted.internet.threads import deferToThread, deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from scrapy_httpcache import TRequest, TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage import AsyncCacheStorage, CacheStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadedCacheStorage(AsyncCacheStorage):
+    """
+    Run the I/O of a blocking cache storage in a bounded thread pool
+
+    Calls to storages that are not ``thread_safe`` are serialized with a lock,
+    so they still leave the reactor thread but never run concurrently. The
+    garbage collection methods are synchronous, but hold the same lock, so
+    they can be called from any thread.
+
+    On close the pending reads and writes are waited for in a thread, while
+    the reactor runs, before the storage is closed.
+    """
+
+    thread_safe = True
+
+    def __init__(self, settings: Settings, storage: CacheStorage):
+        """
+
+        :param settings:
+        :type settings: Settings
+        :param storage: the blocking storage to wrap
+        :type storage: CacheStorage
+        """
+        super(ThreadedCacheStorage, self).__init__(settings)
+        self.storage: CacheStorage = storage
+        self.threadpool: ThreadPool = ThreadPool(
+            minthreads=settings.getint("HTTPCACHE_THREADPOOL_MINSIZE", 0),
+            maxthreads=settings.getint("HTTPCACHE_THREADPOOL_MAXSIZE", 10),
+            name="httpcache",
+        )
+        self.lock: Optional[Lock] = None if storage.thread_safe else Lock()
+        self.multiprocess = storage.multiprocess
+        self.fingerprinter = storage.fingerprinter
+        self.metrics = storage.metrics
+
+    def open_spider(self, spider: TSpider) -> None:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        """
+        self.storage.open_spider(spider)
+        self.threadpool.start()
+        logger.debug(
+            "Running %(storage)s in a pool of up to %(size)d threads"
+            % {
+                "storage": type(self.storage).__name__,
+                "size": self.threadpool.max,
+            },
+            extra={"spider": spider},
+        )
+
+    def close_spider(self, spider: TSpider) -> Optional[Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return: a Deferred firing once the storage is closed, if the reactor
+            runs
+        :rtype: Optional[Deferred]
+        """
+        from twisted.internet import reactor
+
+        if not reactor.running:
+            self.threadpool.stop()
+            return self.storage.close_spider(spider)
+        # stopping the pool joins its threads, the reactor is not blocked
+        d = deferToThread(self.threadpool.stop)
+        d.addCallback(lambda _: self.storage.close_spider(spider))
+        return d
+
+    def retrieve_response(self, spider: TSpider, request: TRequest) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param request:
+        :type request: TRequest
+        :return:
+        :rtype: Deferred
+        """
+        return self._defer(self.storage.retrieve_response, spider, request)
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param request:
+        :type request: TRequest
+        :param response:
+        :type response: TResponse
+        :param timestamp: when the response was stored, now if None, e.g.
+            the original time of an imported entry
+        :type timestamp: Optional[float]
+        :return:
+        :rtype: Deferred
+        """
+        return self._defer(
+            self.storage.store_response, spider, request, response, timestamp
+        )
+
+    def retrieve_responses(self, spider: TSpider, requests: List[TRequest]) -> Deferred:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param requests:
+        :type requests: List[TRequest]
+        :return:
+        :rtype: Deferred
+        """
+        return self._defer(self.storage.retrieve_responses, spider, requests)
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[str]
+        """
+        return self.storage.iter_keys(spider)
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[Tuple[str, float, int]]
+        """
+        return self._iter_locked(self.storage.iter_entries(spider))
+
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param shard:
+        :type shard: int
+        :param shards:
+        :type shards: int
+        :return:
+        :rtype: Iterator[Tuple[str, float, int]]
+        """
+        return self._iter_locked(self.storage.iter_shard_entries(spider, shard, shards))
+
+    def delete_responses(self, spider: TSpider, fingerprints: List[str]) -> None:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param fingerprints:
+        :type fingerprints: List[str]
+        """
+        self._call(self.storage.delete_responses, spider, fingerprints)
+
+    def delete_response(
+        self, request: TRequest, response: TResponse, spider: TSpider, *args, **kwargs
+    ) -> Deferred:
+        """
+        Unlike the bulk deletion of the garbage collection, an invalidation
+        during the crawl runs in the thread pool
+
+        :param request:
+        :type request: TRequest
+        :param response:
+        :type response: TResponse
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Deferred
+        """
+        return self._defer(self.storage.delete_response, request, response, spider)
+
+    def compact(self, spider: TSpider) -> None:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        """
+        self._call(self.storage.compact, spider)
+
+    def _defer(self, f: Callable, *args) -> Deferred:
+        from twisted.internet import reactor
+
+        if self.lock is not None:
+            return deferToThreadPool(reactor, self.threadpool, self._locked, f, *args)
+        return deferToThreadPool(reactor, self.threadpool, f, *args)
+
+    def _iter_locked(self, entries: Iterator) -> Iterator:
+        while True:
+            # the lock is not held between the entries
+            try:
+                entry = self._call(next, entries)
+            except StopIteration:
+                return
+            yield entry
+
+    def _locked(self, f: Callable, *args):
+        with self.lock:
+            return f(*args)
+
+    def _call(self, f: Callable, *args):
+        if self.lock is not None:
+            return self._locked(f, *args)
+        return f(*args)
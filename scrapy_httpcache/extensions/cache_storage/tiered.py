@@ -0,0 +1,218 @@
+"""
+The tiered cache storage
+"""
+import logging
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import List, Optional, Tuple, Type, Union
+
+from scrapy.responsetypes import responsetypes
+from scrapy.settings import Settings
+from twisted.internet.defer import Deferred
+
+from scrapy_httpcache import TRequest, TResponse, TSpider, TStatsCollector
+from scrapy_httpcache.extensions.cache_storage.responses import (
+    attach_dates,
+    response_dates,
+    stored_timestamp,
+)
+from scrapy_httpcache.extensions.cache_storage.wrapper import WrapperCacheStorage
+
+logger = logging.getLogger(__name__)
+
+
+class TieredCacheStorage(WrapperCacheStorage):
+    """
+    Keep the recently used responses in memory in front of another storage
+
+    The backend is ``HTTPCACHE_TIERED_STORAGE``, run in a thread pool with
+    ``HTTPCACHE_THREADED``. The memory tier is an LRU bounded by the size of
+    the bodies, ``HTTPCACHE_TIERED_MAX_BYTES``, and stores are written through
+    to the backend.
+
+    The responses read from the backend are kept in memory until they expire
+    there, see :func:`~.responses.stored_timestamp`, their lazy bodies loaded
+    to be counted. Those of a backend not recording their time are only kept
+    without ``HTTPCACHE_EXPIRATION_SECS``. The deleted responses are dropped
+    from both tiers.
+    """
+
+    storage_setting = "HTTPCACHE_TIERED_STORAGE"
+
+    def __init__(self, settings: Settings):
+        super(TieredCacheStorage, self).__init__(settings)
+        self.max_bytes: int = settings.getint(
+            "HTTPCACHE_TIERED_MAX_BYTES", 64 * 2**20
+        )
+        # fingerprint -> (timestamp, size, response, dates), least recently
+        # used first
+        self.entries: "OrderedDict[str, Tuple[float, int, TResponse, str]]" = (
+            OrderedDict()
+        )
+        self.size: int = 0
+        self.lock: Lock = Lock()
+        self.stats: Optional[TStatsCollector] = None
+
+    def open_spider(self, spider: TSpider) -> Optional[Deferred]:
+        self.stats = spider.crawler.stats
+        logger.debug(
+            "Using a memory tier of %(size)d bytes in front of %(storage)s"
+            % {"size": self.max_bytes, "storage": type(self.storage).__name__},
+            extra={"spider": spider},
+        )
+        return super(TieredCacheStorage, self).open_spider(spider)
+
+    def close_spider(self, spider: TSpider) -> Optional[Deferred]:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        return super(TieredCacheStorage, self).close_spider(spider)
+
+    def retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Union[Optional[TResponse], Deferred]:
+        key = self._request_key(request)
+        response = self._get(spider, key)
+        if response is not None:
+            self.stats.inc_value("httpcache/tiered/hit", spider=spider)
+            return response
+        self.stats.inc_value("httpcache/tiered/miss", spider=spider)
+        response = super(TieredCacheStorage, self).retrieve_response(spider, request)
+        if isinstance(response, Deferred):
+            return response.addCallback(self._promote, spider, key)
+        return self._promote(response, spider, key)
+
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> Union[List[Optional[TResponse]], Deferred]:
+        keys = [self._request_key(request) for request in requests]
+        responses = [self._get(spider, key) for key in keys]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        if len(missing) < len(requests):
+            self.stats.inc_value(
+                "httpcache/tiered/hit", len(requests) - len(missing), spider=spider
+            )
+        if not missing:
+            return responses
+        self.stats.inc_value("httpcache/tiered/miss", len(missing), spider=spider)
+        fetched = super(TieredCacheStorage, self).retrieve_responses(
+            spider, [requests[i] for i in missing]
+        )
+        if isinstance(fetched, Deferred):
+            return fetched.addCallback(self._fill, responses, missing, keys, spider)
+        return self._fill(fetched, responses, missing, keys, spider)
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Optional[Deferred]:
+        # as the backend would return it
+        respcls = responsetypes.from_args(headers=response.headers, url=response.url)
+        self._put(spider, self._request_key(request), response, respcls, timestamp)
+        return super(TieredCacheStorage, self).store_response(
+            spider, request, response, timestamp
+        )
+
+    def delete_response(
+        self, request: TRequest, response: TResponse, spider: TSpider, *args, **kwargs
+    ) -> Optional[Deferred]:
+        self._discard([self._request_key(request)])
+        return super(TieredCacheStorage, self).delete_response(
+            request, response, spider
+        )
+
+    def delete_responses(
+        self, spider: TSpider, fingerprints: List[str]
+    ) -> Optional[Deferred]:
+        self._discard(fingerprints)
+        return super(TieredCacheStorage, self).delete_responses(spider, fingerprints)
+
+    def _discard(self, keys: List[str]) -> None:
+        with self.lock:
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.size -= entry[1]
+
+    def _fill(
+        self,
+        fetched: List[Optional[TResponse]],
+        responses: List[Optional[TResponse]],
+        missing: List[int],
+        keys: List[str],
+        spider: TSpider,
+    ) -> List[Optional[TResponse]]:
+        for i, response in zip(missing, fetched):
+            responses[i] = self._promote(response, spider, keys[i])
+        return responses
+
+    def _promote(
+        self, response: Optional[TResponse], spider: TSpider, key: str
+    ) -> Optional[TResponse]:
+        if response is None:
+            return response
+        timestamp = stored_timestamp(response)
+        if timestamp is not None:
+            self._put(spider, key, response, timestamp=timestamp)
+        elif self.expiration_secs <= 0:
+            self._put(spider, key, response)
+        return response
+
+    def _get(self, spider: TSpider, key: str) -> Optional[TResponse]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return  # not cached
+            timestamp, size, response, dates = entry
+            if 0 < self.expiration_secs < time() - timestamp:
+                del self.entries[key]
+                self.size -= size
+                self.stats.inc_value("httpcache/tiered/expired", spider=spider)
+                return  # expired
+            self.entries.move_to_end(key)
+        # a copy, the middleware flags the responses it returns
+        return attach_dates(response.replace(), dates)
+
+    def _put(
+        self,
+        spider: TSpider,
+        key: str,
+        response: TResponse,
+        respcls: Optional[Type[TResponse]] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        size = len(response.body)
+        if size > self.max_bytes:
+            return  # would evict everything else
+        response = response.replace(
+            cls=respcls or type(response), flags=None, request=None
+        )
+        dates = response_dates(response)
+        evicted = evicted_bytes = 0
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (
+                time() if timestamp is None else timestamp,
+                size,
+                response,
+                dates,
+            )
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size, _, _) = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted += 1
+                evicted_bytes += old_size
+            current = self.size
+        if evicted:
+            self.stats.inc_value("httpcache/tiered/eviction", evicted, spider=spider)
+            self.stats.inc_value(
+                "httpcache/tiered/evicted_bytes", evicted_bytes, spider=spider
+            )
+        self.stats.max_value("httpcache/tiered/max_bytes", current, spider=spider)
@@ -0,0 +1,191 @@
+"""
+The wrapper cache storage
+"""
+from typing import Iterator, List, Optional, Tuple, Union
+
+from scrapy.settings import Settings
+from scrapy.utils.misc import load_object
+from twisted.internet.defer import Deferred
+
+from scrapy_httpcache import TRequest, TResponse, TSpider
+from scrapy_httpcache.extensions.cache_storage import AsyncCacheStorage, CacheStorage
+from scrapy_httpcache.extensions.cache_storage.threaded import ThreadedCacheStorage
+
+
+class WrapperCacheStorage(CacheStorage):
+    """
+    The base of the storages adding a layer in front of another storage
+
+    The wrapped storage is the one named by the ``storage_setting`` of the
+    subclass. With ``HTTPCACHE_THREADED`` only the wrapped storage runs in the
+    thread pool, the layer itself answers on the reactor thread, so its
+    methods return either a result or a Deferred.
+    """
+
+    #: The setting naming the wrapped storage
+    storage_setting: str = ""
+
+    def __init__(self, settings: Settings):
+        """
+
+        :param settings:
+        :type settings: Settings
+        """
+        super(WrapperCacheStorage, self).__init__(settings)
+        self.storage: CacheStorage = load_object(settings[self.storage_setting])(
+            settings
+        )
+        if settings.getbool("HTTPCACHE_THREADED") and not isinstance(
+            self.storage, (AsyncCacheStorage, WrapperCacheStorage)
+        ):
+            self.storage = ThreadedCacheStorage(settings, self.storage)
+        self.thread_safe = self.storage.thread_safe
+        self.multiprocess = self.storage.multiprocess
+        # the same keys, computed once per request
+        self.fingerprinter = self.storage.fingerprinter
+        self.metrics = self.storage.metrics
+
+    def open_spider(self, spider: TSpider) -> Optional[Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Optional[Deferred]
+        """
+        return self.storage.open_spider(spider)
+
+    def close_spider(self, spider: TSpider) -> Optional[Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Optional[Deferred]
+        """
+        return self.storage.close_spider(spider)
+
+    def retrieve_response(
+        self, spider: TSpider, request: TRequest
+    ) -> Union[Optional[TResponse], Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param request:
+        :type request: TRequest
+        :return:
+        :rtype: Union[Optional[TResponse], Deferred]
+        """
+        return self.storage.retrieve_response(spider, request)
+
+    def store_response(
+        self,
+        spider: TSpider,
+        request: TRequest,
+        response: TResponse,
+        timestamp: Optional[float] = None,
+    ) -> Optional[Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param request:
+        :type request: TRequest
+        :param response:
+        :type response: TResponse
+        :param timestamp: when the response was stored, now if None, e.g.
+            the original time of an imported entry
+        :type timestamp: Optional[float]
+        :return:
+        :rtype: Optional[Deferred]
+        """
+        return self.storage.store_response(spider, request, response, timestamp)
+
+    def retrieve_responses(
+        self, spider: TSpider, requests: List[TRequest]
+    ) -> Union[List[Optional[TResponse]], Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param requests:
+        :type requests: List[TRequest]
+        :return:
+        :rtype: Union[List[Optional[TResponse]], Deferred]
+        """
+        return self.storage.retrieve_responses(spider, requests)
+
+    def iter_keys(self, spider: TSpider) -> Iterator[str]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[str]
+        """
+        return self.storage.iter_keys(spider)
+
+    def iter_entries(self, spider: TSpider) -> Iterator[Tuple[str, float, int]]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[Tuple[str, float, int]]
+        """
+        return self.storage.iter_entries(spider)
+
+    def iter_shard_entries(
+        self, spider: TSpider, shard: int, shards: int
+    ) -> Iterator[Tuple[str, float, int]]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param shard:
+        :type shard: int
+        :param shards:
+        :type shards: int
+        :return:
+        :rtype: Iterator[Tuple[str, float, int]]
+        """
+        return self.storage.iter_shard_entries(spider, shard, shards)
+
+    def delete_response(
+        self, request: TRequest, response: TResponse, spider: TSpider, *args, **kwargs
+    ) -> Optional[Deferred]:
+        """
+
+        :param request:
+        :type request: TRequest
+        :param response:
+        :type response: TResponse
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Optional[Deferred]
+        """
+        return self.storage.delete_response(request, response, spider)
+
+    def delete_responses(
+        self, spider: TSpider, fingerprints: List[str]
+    ) -> Optional[Deferred]:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :param fingerprints:
+        :type fingerprints: List[str]
+        :return:
+        :rtype: Optional[Deferred]
+        """
+        return self.storage.delete_responses(spider, fingerprints)
+
+    def compact(self, spider: TSpider) -> None:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        """
+        self.storage.compact(spider)
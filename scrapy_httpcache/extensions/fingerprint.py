@@ -0,0 +1,137 @@
+"""
+The fingerprints of the requests, the keys of the cached responses
+"""
+import hashlib
+from functools import partial
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from weakref import WeakKeyDictionary
+
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import Settings
+from scrapy.utils.python import to_bytes
+from scrapy.utils.request import request_fingerprint
+from w3lib.url import canonicalize_url
+
+from scrapy_httpcache import TRequest
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+HASHES: Dict[str, Callable] = {
+    "sha1": hashlib.sha1,
+    # as long as a sha1, so that the filesystem layout does not change
+    "blake2b": partial(hashlib.blake2b, digest_size=20),
+    "xxhash": None if xxhash is None else xxhash.xxh3_128,
+}
+
+
+class RequestFingerprinter(object):
+    """
+    The fingerprints of Scrapy, ``request_fingerprint``, computed once per
+    request
+
+    ``HTTPCACHE_FINGERPRINT_INCLUDE_HEADERS`` are the request headers that
+    are part of the fingerprint.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+
+        :param settings:
+        :type settings: Settings
+        """
+        self.include_headers: List[bytes] = sorted(
+            to_bytes(h.lower())
+            for h in settings.getlist("HTTPCACHE_FINGERPRINT_INCLUDE_HEADERS")
+        )
+        self._fingerprints: WeakKeyDictionary = WeakKeyDictionary()
+
+    def fingerprint(self, request: TRequest) -> str:
+        """
+
+        :param request:
+        :type request: TRequest
+        :return: the fingerprint as an hexadecimal string
+        :rtype: str
+        """
+        try:
+            return self._fingerprints[request]
+        except KeyError:
+            fp = self._fingerprints[request] = self._fingerprint(request)
+            return fp
+
+    def remember(self, request: TRequest, fingerprint: str) -> None:
+        """
+        Use a known fingerprint for a request, e.g. to read or write an entry
+        listed by its key
+
+        :param request:
+        :type request: TRequest
+        :param fingerprint:
+        :type fingerprint: str
+        """
+        self._fingerprints[request] = fingerprint
+
+    def _fingerprint(self, request: TRequest) -> str:
+        return request_fingerprint(request, include_headers=self.include_headers)
+
+
+class HashFingerprinter(RequestFingerprinter):
+    """
+    The fingerprints hashed with ``HTTPCACHE_FINGERPRINT_HASH``, ``"sha1"``,
+    ``"blake2b"`` or ``"xxhash"`` which requires the xxhash package
+
+    The query parameters in ``HTTPCACHE_FINGERPRINT_EXCLUDE_QUERY_PARAMS`` are
+    not part of the fingerprint, nor are those missing from
+    ``HTTPCACHE_FINGERPRINT_INCLUDE_QUERY_PARAMS`` when it is set, e.g. to
+    ignore session ids and tracking parameters.
+
+    The fingerprints differ from Scrapy's, switching to this fingerprinter
+    starts a new cache.
+    """
+
+    def __init__(self, settings: Settings):
+        super(HashFingerprinter, self).__init__(settings)
+        name = settings.get("HTTPCACHE_FINGERPRINT_HASH", "blake2b")
+        if name not in HASHES:
+            raise NotConfigured("Unknown fingerprint hash: %r" % name)
+        if HASHES[name] is None:
+            raise NotConfigured("The %s fingerprint hash requires %s" % (name, name))
+        self.hash: Callable = HASHES[name]
+        self.include_params: Optional[frozenset] = (
+            frozenset(settings.getlist("HTTPCACHE_FINGERPRINT_INCLUDE_QUERY_PARAMS"))
+            or None
+        )
+        self.exclude_params: frozenset = frozenset(
+            settings.getlist("HTTPCACHE_FINGERPRINT_EXCLUDE_QUERY_PARAMS")
+        )
+
+    def _fingerprint(self, request: TRequest) -> str:
+        url = request.url
+        if self.include_params is not None or self.exclude_params:
+            url = self._filter_query(url)
+        fp = self.hash()
+        fp.update(to_bytes(request.method))
+        fp.update(to_bytes(canonicalize_url(url)))
+        fp.update(request.body or b"")
+        for header in self.include_headers:
+            if header in request.headers:
+                fp.update(header)
+                for value in request.headers.getlist(header):
+                    fp.update(value)
+        return fp.hexdigest()
+
+    def _filter_query(self, url: str) -> str:
+        parts = urlsplit(url)
+        if not parts.query:
+            return url
+        params = [
+            (name, value)
+            for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if name not in self.exclude_params
+            and (self.include_params is None or name in self.include_params)
+        ]
+        return urlunsplit(parts._replace(query=urlencode(params)))
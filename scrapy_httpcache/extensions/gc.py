@@ -0,0 +1,371 @@
+"""
+The garbage collection of the cache: the expired responses and, beyond a
+maximum size, the least recently or least frequently used ones
+"""
+import logging
+import os
+import struct
+import tempfile
+from time import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from scrapy.exceptions import NotConfigured
+from scrapy.settings import Settings
+from scrapy.utils.project import data_path
+from twisted.internet import defer, threads
+from twisted.internet.base import DelayedCall
+from twisted.python.failure import Failure
+
+from scrapy_httpcache import TSpider, TStatsCollector
+from scrapy_httpcache.extensions.cache_storage import CacheStorage
+
+logger = logging.getLogger(__name__)
+
+ACCESS_SUFFIX = ".access"
+ACCESS_MAGIC = b"SHCA"
+ACCESS_VERSION = 1
+# magic and version
+ACCESS_HEADER = struct.Struct(">4sB")
+# key length, last access and number of accesses, followed by the key
+ACCESS_ENTRY = struct.Struct(">BdI")
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+
+class AccessLog(object):
+    """
+    The last access time and the number of accesses of the cached responses
+    that were hit
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Tuple[float, int]] = {}
+
+    def touch(self, key: str) -> None:
+        """
+
+        :param key:
+        :type key: str
+        """
+        _, count = self.entries.get(key, (0, 0))
+        self.entries[key] = (time(), count + 1)
+
+    def discard(self, keys: List[str]) -> None:
+        """
+
+        :param keys:
+        :type keys: List[str]
+        """
+        for key in keys:
+            self.entries.pop(key, None)
+
+    def save(self, path: str) -> None:
+        """
+        Write the log atomically
+
+        :param path:
+        :type path: str
+        """
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(ACCESS_HEADER.pack(ACCESS_MAGIC, ACCESS_VERSION))
+                for key, (last, count) in list(self.entries.items()):
+                    key = key.encode()
+                    f.write(ACCESS_ENTRY.pack(len(key), last, count))
+                    f.write(key)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "AccessLog":
+        """
+
+        :param path:
+        :type path: str
+        :return:
+        :rtype: AccessLog
+        :raises ValueError: if the file is not an access log
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[: ACCESS_HEADER.size] != ACCESS_HEADER.pack(
+            ACCESS_MAGIC, ACCESS_VERSION
+        ):
+            raise ValueError("Not an access log: %r" % path)
+        log = cls()
+        offset = ACCESS_HEADER.size
+        while offset < len(data):
+            try:
+                keylen, last, count = ACCESS_ENTRY.unpack_from(data, offset)
+            except struct.error:
+                raise ValueError("Truncated access log: %r" % path)
+            offset += ACCESS_ENTRY.size
+            log.entries[data[offset : offset + keylen].decode()] = (last, count)
+            offset += keylen
+        return log
+
+
+class CacheCollector(object):
+    """
+    Delete the expired responses of a storage and, beyond
+    ``HTTPCACHE_GC_MAX_SIZE`` bytes, evict the least recently (``"lru"``) or
+    least frequently (``"lfu"``) used ones, see ``HTTPCACHE_GC_EVICTION``
+
+    A pass goes over :meth:`CacheStorage.iter_entries` in slices of
+    ``HTTPCACHE_GC_SLICE_SIZE`` entries. During a crawl a pass starts when
+    the spider is opened then every ``HTTPCACHE_GC_INTERVAL`` seconds, its
+    slices run in a worker thread when the storage is thread safe, on the
+    reactor between the downloads otherwise.
+
+    The hits are recorded with :meth:`touch` and saved next to the cache, the
+    responses never hit count as used when they were stored.
+    """
+
+    def __init__(
+        self,
+        storage: CacheStorage,
+        settings: Settings,
+        stats: Optional[TStatsCollector] = None,
+    ):
+        """
+
+        :param storage:
+        :type storage: CacheStorage
+        :param settings:
+        :type settings: Settings
+        :param stats:
+        :type stats: Optional[TStatsCollector]
+        """
+        self.storage = storage
+        self.stats = stats
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs: int = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.max_size: int = settings.getint("HTTPCACHE_GC_MAX_SIZE", 0)
+        self.eviction: str = settings.get("HTTPCACHE_GC_EVICTION", "lru")
+        if self.eviction not in EVICTION_POLICIES:
+            raise NotConfigured("Unknown eviction policy: %r" % self.eviction)
+        self.interval: float = settings.getfloat("HTTPCACHE_GC_INTERVAL", 600)
+        self.slice_size: int = settings.getint("HTTPCACHE_GC_SLICE_SIZE", 1000)
+        self.accesses: AccessLog = AccessLog()
+        self.counts: Dict[str, int] = {}
+        self.slices: Optional[Iterator[None]] = None
+        self.call: Optional[DelayedCall] = None
+        self.running: Optional[defer.Deferred] = None
+        self.stopped: bool = True
+
+    def open(self, spider: TSpider) -> None:
+        """
+        Load the access log of the spider
+
+        :param spider:
+        :type spider: TSpider
+        """
+        try:
+            self.accesses = AccessLog.load(self._access_path(spider))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning("%(error)s, ignoring it" % {"error": e})
+
+    def close(self, spider: TSpider) -> None:
+        """
+        Save the access log of the spider
+
+        :param spider:
+        :type spider: TSpider
+        """
+        self.accesses.save(self._access_path(spider))
+
+    def start(self, spider: TSpider) -> None:
+        """
+        Collect in the background, the first pass starts now
+
+        :param spider:
+        :type spider: TSpider
+        """
+        self.stopped = False
+        self._schedule(0, spider)
+
+    def stop(self) -> Optional[defer.Deferred]:
+        """
+        Stop collecting in the background
+
+        :return: fired once the running slice is done
+        :rtype: Optional[defer.Deferred]
+        """
+        self.stopped = True
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        if self.running is not None:
+            d = defer.Deferred()
+            self.running.addBoth(lambda _: d.callback(None))
+            return d
+
+    def touch(self, key: str) -> None:
+        """
+        Record a hit
+
+        :param key:
+        :type key: str
+        """
+        self.accesses.touch(key)
+
+    def collect(self, spider: TSpider) -> Dict[str, int]:
+        """
+        Run a whole pass at once, e.g. from the ``httpcache`` command
+
+        :param spider:
+        :type spider: TSpider
+        :return: the counts of the pass, see :meth:`iter_pass`
+        :rtype: Dict[str, int]
+        """
+        for _ in self.iter_pass(spider):
+            pass
+        return self.counts
+
+    def iter_pass(self, spider: TSpider) -> Iterator[None]:
+        """
+        A pass over the entries of the storage, yielding after every slice
+
+        ``counts`` holds the number of ``entries``, ``expired`` and
+        ``evicted`` ones, the ``evicted_bytes`` and the ``size`` left.
+
+        :param spider:
+        :type spider: TSpider
+        :return:
+        :rtype: Iterator[None]
+        """
+        now = time()
+        self.counts = dict.fromkeys(
+            ("entries", "expired", "evicted", "evicted_bytes", "size"), 0
+        )
+        expired: List[str] = []
+        live: List[Tuple[str, float, int]] = []
+        for key, timestamp, size in self.storage.iter_entries(spider):
+            self.counts["entries"] += 1
+            if 0 < self.expiration_secs < now - timestamp:
+                expired.append(key)
+            else:
+                self.counts["size"] += size
+                if self.max_size > 0:
+                    live.append((key, timestamp, size))
+            if self.counts["entries"] % self.slice_size == 0:
+                self._delete(spider, expired, "expired")
+                expired = []
+                yield
+        self._delete(spider, expired, "expired")
+        if 0 < self.max_size < self.counts["size"]:
+            yield from self._evict(spider, live)
+        self._set_stat("size", self.counts["size"], spider)
+        self._inc_stat("pass", 1, spider)
+
+    def _evict(
+        self, spider: TSpider, live: List[Tuple[str, float, int]]
+    ) -> Iterator[None]:
+        accesses = dict(self.accesses.entries)
+        if self.eviction == "lfu":
+            live.sort(
+                key=lambda entry: (
+                    accesses.get(entry[0], (0, 0))[1],
+                    max(entry[1], accesses.get(entry[0], (0, 0))[0]),
+                )
+            )
+        else:
+            live.sort(
+                key=lambda entry: max(entry[1], accesses.get(entry[0], (0, 0))[0])
+            )
+        evicted: List[str] = []
+        for key, _, size in live:
+            if self.counts["size"] <= self.max_size:
+                break
+            evicted.append(key)
+            self.counts["size"] -= size
+            self.counts["evicted_bytes"] += size
+            self._inc_stat("evicted_bytes", size, spider)
+            if len(evicted) >= self.slice_size:
+                self._delete(spider, evicted, "evicted")
+                evicted = []
+                yield
+        self._delete(spider, evicted, "evicted")
+
+    def _delete(self, spider: TSpider, keys: List[str], reason: str) -> None:
+        if not keys:
+            return
+        self.storage.delete_responses(spider, keys)
+        self.accesses.discard(keys)
+        self.counts[reason] += len(keys)
+        self._inc_stat(reason, len(keys), spider)
+
+    def _schedule(self, delay: float, spider: TSpider) -> None:
+        from twisted.internet import reactor
+
+        if not self.stopped:
+            self.call = reactor.callLater(delay, self._run_slice, spider)
+
+    def _run_slice(self, spider: TSpider) -> None:
+        self.call = None
+        if self.slices is None:
+            self.slices = self.iter_pass(spider)
+        if self.storage.thread_safe:
+            self.running = threads.deferToThread(self._advance)
+        else:
+            self.running = defer.maybeDeferred(self._advance)
+        self.running.addCallbacks(
+            self._sliced,
+            self._failed,
+            callbackArgs=(spider,),
+            errbackArgs=(spider,),
+        )
+
+    def _advance(self) -> bool:
+        try:
+            next(self.slices)
+        except StopIteration:
+            return False
+        return True
+
+    def _sliced(self, more: bool, spider: TSpider) -> None:
+        self.running = None
+        if more:
+            # let the reactor run between the slices
+            self._schedule(0, spider)
+            return
+        self.slices = None
+        logger.debug(
+            "Collected the cache garbage: %(counts)s" % {"counts": self.counts},
+            extra={"spider": spider},
+        )
+        self._schedule(self.interval, spider)
+
+    def _failed(self, failure: Failure, spider: TSpider) -> None:
+        self.running = None
+        self.slices = None
+        if failure.check(NotImplementedError):
+            logger.warning(
+                "Not collecting the cache garbage: %(error)s"
+                % {"error": failure.getErrorMessage()},
+                extra={"spider": spider},
+            )
+            return
+        logger.error(
+            "Collecting the cache garbage failed: %(error)s"
+            % {"error": failure.getErrorMessage()},
+            exc_info=(failure.type, failure.value, failure.getTracebackObject()),
+            extra={"spider": spider},
+        )
+        self._schedule(self.interval, spider)
+
+    def _access_path(self, spider: TSpider) -> str:
+        return os.path.join(self.cachedir, spider.name + ACCESS_SUFFIX)
+
+    def _inc_stat(self, name: str, count: int, spider: TSpider) -> None:
+        if self.stats is not None:
+            self.stats.inc_value("httpcache/gc/%s" % name, count, spider=spider)
+
+    def _set_stat(self, name: str, value: int, spider: TSpider) -> None:
+        if self.stats is not None:
+            self.stats.set_value("httpcache/gc/%s" % name, value, spider=spider)
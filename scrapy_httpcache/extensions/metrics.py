@@ -0,0 +1,319 @@
+"""
+The latencies of the phases of a cache lookup or store and the volume of the
+cached bodies, see ``HTTPCACHE_METRICS_ENABLED``
+"""
+import logging
+import os
+import tempfile
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from scrapy.settings import Settings
+from twisted.internet.base import DelayedCall
+
+from scrapy_httpcache import TSpider, TStatsCollector
+
+logger = logging.getLogger(__name__)
+
+# 2 ** SUB_BUCKET_BITS buckets per power of two of microseconds
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram(object):
+    """
+    Durations counted in log-linear buckets, as HdrHistogram does: exact up to
+    16us, then 16 buckets per power of two, so that the percentiles are within
+    1/16 of the recorded durations, whatever their magnitude, in a few hundred
+    counters
+    """
+
+    def __init__(self):
+        self.counts: List[int] = []
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        """
+
+        :param seconds:
+        :type seconds: float
+        """
+        us = int(seconds * 1e6)
+        if us < SUB_BUCKETS:
+            index = us
+        else:
+            shift = us.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift + 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def lower_bound(index: int) -> int:
+        """
+
+        :param index:
+        :type index: int
+        :return: the smallest duration of a bucket, in microseconds
+        :rtype: int
+        """
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+    def percentile(self, percent: float) -> float:
+        """
+
+        :param percent:
+        :type percent: float
+        :return: the highest duration of the bucket of that percentile, at
+            most the longest recorded one, in seconds
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.lower_bound(index + 1) / 1e6, self.max)
+        return self.max
+
+    def iter_buckets(self) -> Iterator[Tuple[float, int]]:
+        """
+        The cumulative counts at every power of two of microseconds, the
+        buckets of an exposition that keep the same bounds over time
+
+        :return: the upper bound in seconds and the count of the durations
+            below it
+        :rtype: Iterator[Tuple[float, int]]
+        """
+        seen = 0
+        # up to the end of the power of two of the longest duration
+        end = -(-len(self.counts) // SUB_BUCKETS) * SUB_BUCKETS
+        for index in range(end):
+            if index < len(self.counts):
+                seen += self.counts[index]
+            if (index + 1) % SUB_BUCKETS == 0:
+                yield self.lower_bound(index + 1) / 1e6, seen
+
+
+class CacheMetrics(object):
+    """
+    The histograms of the latencies of the phases timed by the middleware and
+    the storages, and the sizes of the bodies read and written, raw and as
+    stored
+
+    The phases are ``fingerprint``, ``retrieve``, ``decode`` (decompression),
+    ``policy``, ``encode`` (compression) and ``store``. They are summarized in
+    the stats, ``httpcache/latency/<phase>/{count,p50,p90,p99,max}`` in
+    milliseconds, every ``HTTPCACHE_METRICS_INTERVAL`` seconds and when the
+    spider is closed, logged and, with ``HTTPCACHE_METRICS_PROMETHEUS_PATH``,
+    written in the Prometheus text format. The phases are recorded under a lock,
+    the storages time theirs from the threads they run in.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+
+        :param settings:
+        :type settings: Settings
+        """
+        self.interval: float = settings.getfloat("HTTPCACHE_METRICS_INTERVAL", 60)
+        self.prometheus_path: Optional[str] = settings.get(
+            "HTTPCACHE_METRICS_PROMETHEUS_PATH"
+        )
+        self.histograms: Dict[str, Histogram] = {}
+        # read, read_raw, written and written_raw
+        self.body_bytes: Dict[str, int] = dict.fromkeys(
+            ("read", "read_raw", "written", "written_raw"), 0
+        )
+        self.lock: Lock = Lock()
+        self.call: Optional[DelayedCall] = None
+        self.stats: Optional[TStatsCollector] = None
+
+    def record(self, phase: str, seconds: float) -> None:
+        """
+
+        :param phase:
+        :type phase: str
+        :param seconds:
+        :type seconds: float
+        """
+        with self.lock:
+            try:
+                histogram = self.histograms[phase]
+            except KeyError:
+                histogram = self.histograms[phase] = Histogram()
+            histogram.record(seconds)
+
+    def count_bytes(self, direction: str, stored: int, raw: int) -> None:
+        """
+
+        :param direction: "read" or "written"
+        :type direction: str
+        :param stored: the size of the body as stored
+        :type stored: int
+        :param raw: the size of the decompressed body
+        :type raw: int
+        """
+        with self.lock:
+            self.body_bytes[direction] += stored
+            self.body_bytes[direction + "_raw"] += raw
+
+    def start(self, spider: TSpider, stats: TStatsCollector) -> None:
+        """
+        Dump the metrics periodically, if ``HTTPCACHE_METRICS_INTERVAL``
+
+        :param spider:
+        :type spider: TSpider
+        :param stats:
+        :type stats: TStatsCollector
+        """
+        self.stats = stats
+        self._schedule(spider)
+
+    def stop(self, spider: TSpider) -> None:
+        """
+        Stop dumping the metrics periodically, and dump them a last time
+
+        :param spider:
+        :type spider: TSpider
+        """
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        self.dump(spider)
+
+    def _schedule(self, spider: TSpider) -> None:
+        from twisted.internet import reactor
+
+        if self.interval > 0:
+            self.call = reactor.callLater(self.interval, self._dump, spider)
+
+    def _dump(self, spider: TSpider) -> None:
+        self.call = None
+        try:
+            self.dump(spider)
+        finally:
+            self._schedule(spider)
+
+    def dump(self, spider: TSpider) -> None:
+        """
+        Set the stats, log and write the metrics
+
+        :param spider:
+        :type spider: TSpider
+        """
+        with self.lock:
+            summary = {
+                phase: (
+                    histogram.count,
+                    [histogram.percentile(p) for p in PERCENTILES],
+                    histogram.max,
+                )
+                for phase, histogram in self.histograms.items()
+            }
+            body_bytes = dict(self.body_bytes)
+            exposition = self.prometheus_path and self.exposition(spider)
+        if self.stats is not None:
+            for phase, (count, percentiles, longest) in summary.items():
+                prefix = "httpcache/latency/%s/" % phase
+                self.stats.set_value(prefix + "count", count, spider=spider)
+                for p, value in zip(PERCENTILES, percentiles):
+                    self.stats.set_value(
+                        prefix + "p%d" % p, round(value * 1e3, 3), spider=spider
+                    )
+                self.stats.set_value(
+                    prefix + "max", round(longest * 1e3, 3), spider=spider
+                )
+            for name, value in body_bytes.items():
+                self.stats.set_value(
+                    "httpcache/body_bytes/" + name, value, spider=spider
+                )
+            if body_bytes["written"]:
+                self.stats.set_value(
+                    "httpcache/compression_ratio",
+                    round(body_bytes["written_raw"] / body_bytes["written"], 3),
+                    spider=spider,
+                )
+        if summary:
+            logger.info(
+                "Cache latencies (p50/p99 ms): %(latencies)s"
+                % {
+                    "latencies": ", ".join(
+                        "%s %.3f/%.3f" % (phase, p[0] * 1e3, p[-1] * 1e3)
+                        for phase, (_, p, _) in sorted(summary.items())
+                    )
+                },
+                extra={"spider": spider},
+            )
+        if exposition:
+            self._write(self.prometheus_path, exposition)
+
+    def exposition(self, spider: TSpider) -> str:
+        """
+
+        :param spider:
+        :type spider: TSpider
+        :return: the metrics in the Prometheus text format
+        :rtype: str
+        """
+        lines = [
+            "# HELP httpcache_latency_seconds The latency of the cache operations",
+            "# TYPE httpcache_latency_seconds histogram",
+        ]
+        for phase, histogram in sorted(self.histograms.items()):
+            labels = 'spider="%s",phase="%s"' % (spider.name, phase)
+            for bound, count in histogram.iter_buckets():
+                lines.append(
+                    'httpcache_latency_seconds_bucket{%s,le="%g"} %d'
+                    % (labels, bound, count)
+                )
+            lines.append(
+                'httpcache_latency_seconds_bucket{%s,le="+Inf"} %d'
+                % (labels, histogram.count)
+            )
+            lines.append(
+                "httpcache_latency_seconds_sum{%s} %r" % (labels, histogram.total)
+            )
+            lines.append(
+                "httpcache_latency_seconds_count{%s} %d" % (labels, histogram.count)
+            )
+        lines.extend(
+            [
+                "# HELP httpcache_body_bytes_total The size of the cached bodies",
+                "# TYPE httpcache_body_bytes_total counter",
+            ]
+        )
+        for name, value in sorted(self.body_bytes.items()):
+            direction, _, raw = name.partition("_")
+            lines.append(
+                'httpcache_body_bytes_total{spider="%s",direction="%s",encoding="%s"} %d'
+                % (spider.name, direction, raw or "stored", value)
+            )
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write(path: str, text: str) -> None:
+        # atomically, for the collectors reading it meanwhile
+        fd, tmppath = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp-"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(tmppath, path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
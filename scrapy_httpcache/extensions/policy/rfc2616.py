@@ -1,7 +1,9 @@
 import logging
+from calendar import timegm
 from email.utils import mktime_tz, parsedate_tz
+from functools import lru_cache
 from time import time
-from typing import Dict, Optional, Union
+from typing import Dict, Optional, Tuple, Union
 from weakref import WeakKeyDictionary
 
 from scrapy.http.response import Response
@@ -13,6 +15,26 @@ from scrapy_httpcache import TRequest, TResponse
 
 logger = logging.getLogger(__name__)
 
+# the epochs of the Date, Expires and Last-Modified headers of a response,
+# Expires is 0 when it cannot be parsed
+TDates = Tuple[Optional[int], Optional[int], Optional[int]]
+
+# the distinct dates parsed, those of a crawl repeat, Last-Modified and Expires
+# or the seconds of Date
+DATE_CACHE_SIZE = 4096
+MONTHS = {
+    month: index
+    for index, month in enumerate(
+        (b"Jan", b"Feb", b"Mar", b"Apr", b"May", b"Jun")
+        + (b"Jul", b"Aug", b"Sep", b"Oct", b"Nov", b"Dec"),
+        1,
+    )
+}
+
+# the dates recorded with the cached responses, attached by the storages when
+# they rebuild them
+_recorded_dates: WeakKeyDictionary = WeakKeyDictionary()
+
 
 def parse_cachecontrol(header: bytes) -> Dict[bytes, Optional[bytes]]:
     """Parse Cache-Control header
@@ -34,7 +56,42 @@ def parse_cachecontrol(header: bytes) -> Dict[bytes, Optional[bytes]]:
     return directives
 
 
-def rfc1123_to_epoch(date_str):
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def rfc1123_to_epoch(date_str: Union[bytes, str, None]) -> Optional[int]:
+    """
+    Parse an HTTP date, the IMF-fixdate of RFC 7231 by slicing it, the other
+    formats with ``email.utils``
+
+    >>> rfc1123_to_epoch(b'Sun, 06 Nov 1994 08:49:37 GMT')
+    784111777
+    >>> rfc1123_to_epoch(b'Sunday, 06-Nov-94 08:49:37 GMT')
+    784111777
+    >>> rfc1123_to_epoch(b'0') is None
+    True
+
+    """
+    try:
+        if isinstance(date_str, str):
+            date_str = date_str.encode("ascii")
+        # Sun, 06 Nov 1994 08:49:37 GMT
+        if (
+            len(date_str) == 29
+            and date_str[3:5] == b", "
+            and date_str[25:] == b" GMT"
+            and date_str[19:20] == date_str[22:23] == b":"
+        ):
+            return timegm(
+                (
+                    int(date_str[12:16]),
+                    MONTHS[date_str[8:11]],
+                    int(date_str[5:7]),
+                    int(date_str[17:19]),
+                    int(date_str[20:22]),
+                    int(date_str[23:25]),
+                )
+            )
+    except Exception:
+        pass
     try:
         date_str = to_unicode(date_str, encoding="ascii")
         return mktime_tz(parsedate_tz(date_str))
@@ -42,6 +99,39 @@ def rfc1123_to_epoch(date_str):
         return None
 
 
+def parse_dates(headers) -> TDates:
+    """
+
+    :param headers: the headers of a response
+    :type headers: Headers
+    :return: the epochs of its Date, Expires and Last-Modified headers
+    :rtype: TDates
+    """
+    expires = None
+    if b"Expires" in headers:
+        # When parsing Expires header fails RFC 2616 section 14.21 says we
+        # should treat this as an expiration time in the past.
+        expires = rfc1123_to_epoch(headers[b"Expires"]) or 0
+    return (
+        rfc1123_to_epoch(headers.get(b"Date")),
+        expires,
+        rfc1123_to_epoch(headers.get(b"Last-Modified")),
+    )
+
+
+def record_dates(response: TResponse, dates: TDates) -> None:
+    """
+    Attach the dates recorded with a cached response, for the policy not to
+    parse its headers again
+
+    :param response:
+    :type response: TResponse
+    :param dates:
+    :type dates: TDates
+    """
+    _recorded_dates[response] = dates
+
+
 class RFC2616Policy(object):
     MAXAGE = 3600 * 24 * 365  # one year
 
@@ -114,10 +204,11 @@ class RFC2616Policy(object):
             return False
 
         now = time()
+        dates = self._get_dates(cachedresponse)
         freshnesslifetime = self._compute_freshness_lifetime(
-            cachedresponse, request, now
+            cachedresponse, request, now, dates
         )
-        currentage = self._compute_current_age(cachedresponse, request, now)
+        currentage = self._compute_current_age(cachedresponse, request, now, dates)
 
         reqmaxage = self._get_max_age(ccreq)
         if reqmaxage is not None:
@@ -178,8 +269,19 @@ class RFC2616Policy(object):
         except (KeyError, ValueError):
             return None
 
+    def _get_dates(self, response: TResponse) -> TDates:
+        # recorded when the response was cached, or parsed
+        try:
+            return _recorded_dates[response]
+        except KeyError:
+            return parse_dates(response.headers)
+
     def _compute_freshness_lifetime(
-        self, response: TResponse, request: TRequest, now: float
+        self,
+        response: TResponse,
+        request: TRequest,
+        now: float,
+        dates: Optional[TDates] = None,
     ):
         # Reference nsHttpResponseHead::ComputeFreshnessLifetime
         # https://dxr.mozilla.org/mozilla-central/source/netwerk/protocol/http/nsHttpResponseHead.cpp#706
@@ -188,19 +290,18 @@ class RFC2616Policy(object):
         if maxage is not None:
             return maxage
 
-        # Parse date header or synthesize it if none exists
-        date = rfc1123_to_epoch(response.headers.get(b"Date")) or now
+        if dates is None:
+            dates = self._get_dates(response)
+        date, expires, lastmodified = dates
+        # Synthesize date header if none exists
+        date = date or now
 
         # Try HTTP/1.0 Expires header
-        if b"Expires" in response.headers:
-            expires = rfc1123_to_epoch(response.headers[b"Expires"])
-            # When parsing Expires header fails RFC 2616 section 14.21 says we
-            # should treat this as an expiration time in the past.
+        if expires is not None:
             return max(0, expires - date) if expires else 0
 
         # Fallback to heuristic using last-modified header
         # This is not in RFC but on Firefox caching implementation
-        lastmodified = rfc1123_to_epoch(response.headers.get(b"Last-Modified"))
         if lastmodified and lastmodified <= date:
             return (date - lastmodified) / 10
 
@@ -211,13 +312,21 @@ class RFC2616Policy(object):
         # Insufficient information to compute fresshness lifetime
         return 0
 
-    def _compute_current_age(self, response: TResponse, request: TRequest, now):
+    def _compute_current_age(
+        self,
+        response: TResponse,
+        request: TRequest,
+        now: float,
+        dates: Optional[TDates] = None,
+    ):
         # Reference nsHttpResponseHead::ComputeCurrentAge
         # https://dxr.mozilla.org/mozilla-central/source/netwerk/protocol/http/nsHttpResponseHead.cpp#658
         currentage = 0
+        if dates is None:
+            dates = self._get_dates(response)
         # If Date header is not set we assume it is a fast connection, and
         # clock is in sync with the server
-        date = rfc1123_to_epoch(response.headers.get(b"Date")) or now
+        date = dates[0] or now
         if now > date:
             currentage = now - date
 
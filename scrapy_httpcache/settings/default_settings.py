@@ -5,6 +5,107 @@ from typing import List
 
 HTTPCACHE_ENABLED = False
 HTTPCACHE_IGNORE_MISSING = False
+# responses with a larger body are not cached (httpcache/too_large), 0 for no
+# limit
+HTTPCACHE_MAX_BODY_SIZE = 0
+
+# ------------------------------------------------------------------------------
+# THREADED STORAGE
+# Run the blocking storage I/O in a thread pool instead of the reactor thread
+# ------------------------------------------------------------------------------
+HTTPCACHE_THREADED = False
+HTTPCACHE_THREADPOOL_MINSIZE = 0
+HTTPCACHE_THREADPOOL_MAXSIZE = 10
+
+# ------------------------------------------------------------------------------
+# FINGERPRINTS
+# The keys of the cached responses, "...fingerprint.HashFingerprinter" allows
+# faster hashes ("sha1", "blake2b" or "xxhash") and ignoring query parameters,
+# but its keys differ from the default ones
+# ------------------------------------------------------------------------------
+HTTPCACHE_FINGERPRINTER = "scrapy_httpcache.extensions.fingerprint.RequestFingerprinter"
+HTTPCACHE_FINGERPRINT_INCLUDE_HEADERS: List[str] = []
+# HTTPCACHE_FINGERPRINT_HASH = "blake2b"
+# HTTPCACHE_FINGERPRINT_INCLUDE_QUERY_PARAMS = []
+# HTTPCACHE_FINGERPRINT_EXCLUDE_QUERY_PARAMS = []
+
+# ------------------------------------------------------------------------------
+# PREFETCH
+# Look up the scheduled requests in batches of this size, 0 to disable, and
+# keep up to that many results until the requests are downloaded, the results
+# kept longer than HTTPCACHE_PREFETCH_MAX_AGE seconds are looked up again (0 to
+# keep them until then)
+# ------------------------------------------------------------------------------
+HTTPCACHE_PREFETCH_BATCH_SIZE = 0
+HTTPCACHE_PREFETCH_MAX_STAGED = 1000
+HTTPCACHE_PREFETCH_MAX_AGE = 60
+
+# ------------------------------------------------------------------------------
+# BODY COMPRESSION
+# Codec of the cached bodies in every storage: None, "zlib", "gzip", "lzma",
+# "zstd", "zstd-dict" (needs zstandard) or "br" (needs brotli). The codec is
+# recorded per entry, entries remain readable after changing it.
+# ------------------------------------------------------------------------------
+HTTPCACHE_COMPRESSION = None
+HTTPCACHE_COMPRESSION_LEVEL = None
+# bodies smaller than this are stored raw
+HTTPCACHE_COMPRESSION_MIN_SIZE = 1024
+# dictionary of the zstd-dict codec, see compression.train_zstd_dictionary(), the
+# entries compressed with another dictionary are missed
+HTTPCACHE_COMPRESSION_ZSTD_DICT = None
+
+# ------------------------------------------------------------------------------
+# MEMORY-MAPPED BODIES
+# Uncompressed bodies of at least this size are memory-mapped by the filesystem
+# and segment log storages instead of read, 0 disables it
+# ------------------------------------------------------------------------------
+HTTPCACHE_MMAP_MIN_SIZE = 0
+
+# ------------------------------------------------------------------------------
+# LAZY BODIES
+# Read the headers of the cached responses only, the body on first access, so
+# that the stale responses kept for revalidation cost no body I/O. Effective
+# with the filesystem, segment log and sqlite storages, the other ones only
+# defer the decompression.
+# ------------------------------------------------------------------------------
+HTTPCACHE_LAZY_BODY = False
+
+# ------------------------------------------------------------------------------
+# GARBAGE COLLECTION
+# Delete the expired responses during the crawl, a pass every interval in
+# slices of entries, and beyond HTTPCACHE_GC_MAX_SIZE bytes (0 for no limit)
+# evict the "lru" or "lfu" ones. The hits are saved in
+# <HTTPCACHE_DIR>/<spider>.access. MongoDB expires its documents with a TTL
+# index too. Outside of a crawl: scrapy httpcache prune <spider>
+# ------------------------------------------------------------------------------
+HTTPCACHE_GC_ENABLED = False
+HTTPCACHE_GC_INTERVAL = 600
+HTTPCACHE_GC_SLICE_SIZE = 1000
+HTTPCACHE_GC_MAX_SIZE = 0
+HTTPCACHE_GC_EVICTION = "lru"
+
+# ------------------------------------------------------------------------------
+# METRICS
+# Histograms of the latencies of the fingerprinting, the storage reads and
+# writes, the (de)compression and the policy, and the sizes of the bodies read
+# and written: httpcache/latency/<phase>/{count,p50,p90,p99,max} in ms and
+# httpcache/body_bytes/* in the stats, every interval (0 for at the end only),
+# logged and, given a path, written in the Prometheus text format. Nothing is
+# timed when disabled.
+# ------------------------------------------------------------------------------
+HTTPCACHE_METRICS_ENABLED = False
+HTTPCACHE_METRICS_INTERVAL = 60
+HTTPCACHE_METRICS_PROMETHEUS_PATH = None
+
+# ------------------------------------------------------------------------------
+# COMMAND
+# With COMMANDS_MODULE = "scrapy_httpcache.commands" in the project settings:
+#     scrapy httpcache stats|prune|compact|reshard <spider> [<spider> ...]
+#     scrapy httpcache export|import <spider> <path>
+# e.g. to move a cache to another storage without an intermediate file:
+#     scrapy httpcache export <spider> - | scrapy httpcache import <spider> - \
+#         -s HTTPCACHE_STORAGE=scrapy_httpcache.extensions.cache_storage.sqlite.SqliteCacheStorage
+# ------------------------------------------------------------------------------
 
 # ------------------------------------------------------------------------------
 # DUMMY POLICY (ORIGINAL)
@@ -38,6 +139,75 @@ HTTPCACHE_IGNORE_RESPONSE_CACHE_CONTROLS = []
 # HTTPCACHE_DIR = "httpcache"
 # HTTPCACHE_EXPIRATION_SECS = 0
 # HTTPCACHE_GZIP = False
+# "directory" writes five files per entry, "record" a single record file
+# HTTPCACHE_FILESYSTEM_FORMAT = "directory"
+# also write the metadata of the directories as a readable "meta" file
+# HTTPCACHE_FILESYSTEM_DEBUG_META = False
+# the bodies are written in chunks of this size
+# HTTPCACHE_FILESYSTEM_CHUNK_SIZE = 1024 * 1024
+# the entries are in <spider>/<shard>/.../<key>, DEPTH levels of shard
+# directories named after WIDTH characters of the key each, so that no
+# directory holds too many entries: 16 ** (DEPTH * WIDTH) shards of the
+# hexadecimal keys. Move the entries of another layout with:
+#     scrapy httpcache reshard <spider>
+# HTTPCACHE_FILESYSTEM_SHARD_DEPTH = 1
+# HTTPCACHE_FILESYSTEM_SHARD_WIDTH = 2
+
+# ------------------------------------------------------------------------------
+# TIERED STORAGE
+# ------------------------------------------------------------------------------
+# keep the recently used responses in memory in front of another storage
+# HTTPCACHE_STORAGE = "scrapy_httpcache.extensions.cache_storage.tiered.TieredCacheStorage"
+HTTPCACHE_TIERED_STORAGE = (
+    "scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage"
+)
+# the total size of the bodies kept in memory
+HTTPCACHE_TIERED_MAX_BYTES = 64 * 2**20
+
+# ------------------------------------------------------------------------------
+# BLOOM FILTER
+# ------------------------------------------------------------------------------
+# skip the lookups of the keys that are certainly not in another storage
+# HTTPCACHE_STORAGE = "scrapy_httpcache.extensions.cache_storage.bloom.BloomFilterCacheStorage"
+HTTPCACHE_BLOOM_STORAGE = (
+    "scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage"
+)
+# the number of keys for which the false positive rate is HTTPCACHE_BLOOM_ERROR_RATE
+HTTPCACHE_BLOOM_CAPACITY = 1000000
+HTTPCACHE_BLOOM_ERROR_RATE = 0.01
+
+# ------------------------------------------------------------------------------
+# SQLITE
+# ------------------------------------------------------------------------------
+# HTTPCACHE_STORAGE = "scrapy_httpcache.extensions.cache_storage.sqlite.SqliteCacheStorage"
+# HTTPCACHE_DIR = "httpcache"
+# HTTPCACHE_EXPIRATION_SECS = 0
+# commit every that many writes or seconds, also while no response is stored
+# HTTPCACHE_SQLITE_COMMIT_SIZE = 100
+# HTTPCACHE_SQLITE_COMMIT_INTERVAL = 1
+
+# ------------------------------------------------------------------------------
+# LMDB
+# ------------------------------------------------------------------------------
+# requires the lmdb package, one environment in HTTPCACHE_DIR shared by
+# processes, with a named database per spider
+# HTTPCACHE_STORAGE = "scrapy_httpcache.extensions.cache_storage.lmdb.LmdbCacheStorage"
+# HTTPCACHE_DIR = "httpcache"
+# HTTPCACHE_EXPIRATION_SECS = 0
+# the maximum size of the environment, reserved address space not disk
+# HTTPCACHE_LMDB_MAP_SIZE = 2 ** 30
+# HTTPCACHE_LMDB_MAX_DBS = 128
+# HTTPCACHE_LMDB_MAX_READERS = 126
+
+# ------------------------------------------------------------------------------
+# SEGMENT LOG
+# ------------------------------------------------------------------------------
+# HTTPCACHE_STORAGE = (
+#     "scrapy_httpcache.extensions.cache_storage.segment_log.SegmentLogCacheStorage"
+# )
+# HTTPCACHE_DIR = "httpcache"
+# HTTPCACHE_EXPIRATION_SECS = 0
+# HTTPCACHE_SEGMENT_LOG_SEGMENT_SIZE = 256 * 1024 * 1024
 
 # ------------------------------------------------------------------------------
 # MONGODB
@@ -79,3 +249,17 @@ HTTPCACHE_MONGO_COLLECTION = "cache"
 #     'write_concern': None,
 #     'read_concern': None
 # }
+
+# Store a decoded copy of the response in data_for_human, when disabled it can
+# be filled afterwards with MongoCacheStorage.fill_data_for_human()
+HTTPCACHE_MONGO_DATA_FOR_HUMAN = True
+
+# Let MongoDB delete the documents older than HTTPCACHE_EXPIRATION_SECS with a
+# TTL index on their time, kept in sync with the setting when the spider opens
+HTTPCACHE_MONGO_TTL_INDEX = True
+
+# Buffer the upserts and write them with bulk_write, 1 writes every response
+# immediately, an interval of 0 disables the time threshold, also checked by a
+# timer while no response is stored
+HTTPCACHE_MONGO_WRITE_BATCH_SIZE = 1
+HTTPCACHE_MONGO_WRITE_BATCH_INTERVAL = 0
@@ -1,4 +1,8 @@
 """
 Scrapy signals
 """
+# delete the cached response of a request, e.g. a ban page that was cached,
+# sent with request, spider and optionally response
 response_delete = object()
+# delete cached responses in bulk, sent with fingerprints and spider
+responses_delete = object()
@@ -0,0 +1,4 @@
+from scrapy.utils.reactor import install_reactor
+
+# MongoAsyncCacheStorage runs on motor, which needs the asyncio reactor
+install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.misc import load_object
+
+from scrapy_httpcache.extensions.cache_storage.compression import (
+    CODECS,
+    brotli,
+    get_codec,
+    train_zstd_dictionary,
+    zstandard,
+)
+
+
+class CodecTest(unittest.TestCase):
+
+    body = b'<html><body>' + b'<p>Lorem ipsum dolor sit amet</p>' * 100 + b'</body></html>'
+
+    def _roundtrip(self, name, **settings):
+        codec = get_codec(name, Settings(settings))
+        self.assertEqual(codec.name, name)
+        compressed = codec.compress(self.body)
+        self.assertLess(len(compressed), len(self.body))
+        self.assertEqual(codec.decompress(compressed), self.body)
+
+    def test_builtin_codecs(self):
+        for name in ('zlib', 'gzip', 'lzma'):
+            self._roundtrip(name)
+            self._roundtrip(name, HTTPCACHE_COMPRESSION_LEVEL=1)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        self._roundtrip('zstd')
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_threads(self):
+        # the threads of the thread-safe storages do not share a compressor
+        codec = get_codec('zstd', Settings())
+        bodies = [self.body + b'%d' % i for i in range(8)]
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda body: [codec.decompress(codec.compress(body)) for _ in range(50)],
+                                        bodies))
+        self.assertEqual(results, [[body] * 50 for body in bodies])
+        compressors = []
+        thread = Thread(target=lambda: (codec.compress(self.body), compressors.append(codec.local.compressor)))
+        thread.start()
+        thread.join()
+        codec.compress(self.body)
+        self.assertIsNot(compressors[0], codec.local.compressor)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_dict(self):
+        self.assertRaises(NotConfigured, get_codec, 'zstd-dict', Settings())
+        samples = [
+            b'<html><head><title>Page %d</title></head><body><p>%s</p></body></html>'
+            % (i, os.urandom(8).hex().encode() * (i % 7 + 1))
+            for i in range(500)
+        ]
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'dict')
+        with open(path, 'wb') as f:
+            f.write(train_zstd_dictionary(samples, dict_size=4096))
+        settings = Settings({'HTTPCACHE_COMPRESSION_ZSTD_DICT': path})
+        with_dict = get_codec('zstd-dict', settings)
+        without_dict = get_codec('zstd', settings)
+        self.assertRegex(with_dict.name, r'^zstd-dict:[1-9]\d*$')
+        self.assertEqual(get_codec(with_dict.name, settings).name, with_dict.name)
+        sample = samples[10]
+        self.assertEqual(with_dict.decompress(with_dict.compress(sample)), sample)
+        self.assertLess(len(with_dict.compress(sample)), len(without_dict.compress(sample)))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_dict_changed(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        paths = []
+        for i in range(2):
+            samples = [
+                b'<html><body><p>%d %s</p></body></html>' % (i, os.urandom(8).hex().encode() * (j % 7 + 1))
+                for j in range(500)
+            ]
+            paths.append(os.path.join(tmpdir, 'dict%d' % i))
+            with open(paths[-1], 'wb') as f:
+                f.write(train_zstd_dictionary(samples, dict_size=4096))
+        spider = Spider('example.com')
+        request = Request('http://www.example.com')
+        response = Response('http://www.example.com', body=self.body)
+        for storage_class in ('dbm.DbmCacheStorage', 'file_system.FilesystemCacheStorage',
+                              'sqlite.SqliteCacheStorage'):
+
+            def run(path, method, *args):
+                settings = Settings({
+                    'HTTPCACHE_DIR': os.path.join(tmpdir, storage_class),
+                    'HTTPCACHE_EXPIRATION_SECS': 0,
+                    'HTTPCACHE_COMPRESSION': 'zstd-dict' if path else None,
+                    'HTTPCACHE_COMPRESSION_MIN_SIZE': 0,
+                    'HTTPCACHE_COMPRESSION_ZSTD_DICT': path,
+                })
+                storage = load_object('scrapy_httpcache.extensions.cache_storage.'
+                                      + storage_class)(settings)
+                storage.open_spider(spider)
+                try:
+                    return getattr(storage, method)(spider, request, *args)
+                finally:
+                    storage.close_spider(spider)
+
+            run(paths[0], 'store_response', response)
+            # the entries compressed with the previous dictionary are missed
+            self.assertIsNone(run(paths[1], 'retrieve_response'))
+            # and without any dictionary
+            self.assertIsNone(run(None, 'retrieve_response'))
+            self.assertEqual(run(paths[0], 'retrieve_response').body, self.body)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        self._roundtrip('br')
+
+    def test_unknown_codec(self):
+        self.assertNotIn('snappy', CODECS)
+        self.assertRaises(NotConfigured, get_codec, 'snappy', Settings())
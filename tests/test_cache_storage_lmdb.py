@@ -0,0 +1,84 @@
+import multiprocessing
+import shutil
+import tempfile
+import unittest
+
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+PROCESSES = 4
+REQUESTS = 200
+
+
+def _settings(tmpdir):
+    return Settings({
+        'HTTPCACHE_DIR': tmpdir,
+        'HTTPCACHE_EXPIRATION_SECS': 0,
+        # small enough to exercise many writers on a shared map
+        'HTTPCACHE_LMDB_MAP_SIZE': 64 * 2 ** 20,
+    })
+
+
+def _body(i):
+    return b'body %d ' % i * (i % 50 + 1)
+
+
+def _crawl(tmpdir, worker):
+    from scrapy_httpcache.extensions.cache_storage.lmdb import LmdbCacheStorage
+    spider = Spider('example.com')
+    storage = LmdbCacheStorage(_settings(tmpdir))
+    storage.open_spider(spider)
+    errors = 0
+    try:
+        # every worker writes and reads the same keys in a different order
+        order = list(range(REQUESTS))
+        order = order[worker::PROCESSES] + order
+        for i in order:
+            request = Request('http://www.example.com/%d' % i)
+            response = storage.retrieve_response(spider, request)
+            if response is None:
+                storage.store_response(spider, request, Response(
+                    request.url, status=200, body=_body(i),
+                    headers={'Content-Type': 'text/plain'}))
+            elif response.body != _body(i) or response.url != request.url:
+                errors += 1
+    finally:
+        storage.close_spider(spider)
+    return errors
+
+
+@unittest.skipIf(lmdb is None, 'lmdb is not installed')
+class LmdbMultiprocessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_concurrent_processes(self):
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(PROCESSES) as pool:
+            errors = pool.starmap(_crawl, [(self.tmpdir, worker)
+                                           for worker in range(PROCESSES)])
+        self.assertEqual(errors, [0] * PROCESSES)
+
+        from scrapy_httpcache.extensions.cache_storage.lmdb import LmdbCacheStorage
+        spider = Spider('example.com')
+        storage = LmdbCacheStorage(_settings(self.tmpdir))
+        storage.open_spider(spider)
+        try:
+            for i in range(REQUESTS):
+                response = storage.retrieve_response(
+                    spider, Request('http://www.example.com/%d' % i))
+                self.assertEqual(response.body, _body(i))
+            with storage.env.begin(db=storage.db) as txn:
+                self.assertEqual(txn.stat(storage.db)['entries'], REQUESTS)
+        finally:
+            storage.close_spider(spider)
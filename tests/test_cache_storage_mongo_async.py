@@ -0,0 +1,121 @@
+import email.utils
+import time
+from unittest import mock
+
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from scrapy_httpcache.downloadermiddlewares.httpcache import HttpCacheMiddleware
+
+try:
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError:
+    AsyncMongoMockClient = None
+
+
+class MongoAsyncStorageTest(unittest.TestCase):
+
+    if AsyncMongoMockClient is None:
+        skip = 'mongomock_motor is not installed'
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.mongo.MongoAsyncCacheStorage'
+    policy_class = 'scrapy_httpcache.extensions.policy.rfc2616.RFC2616Policy'
+
+    def setUp(self):
+        patcher = mock.patch(
+            'scrapy_httpcache.extensions.cache_storage.mongo.AsyncIOMotorClient',
+            AsyncMongoMockClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.crawler = get_crawler(Spider)
+        self.spider = self.crawler._create_spider('example.com')
+        self.request = Request('http://www.example.com',
+                               headers={'User-Agent': 'test'})
+        self.response = Response('http://www.example.com',
+                                 headers={'Content-Type': 'text/html',
+                                          'Expires': email.utils.formatdate(time.time() + 86400)},
+                                 body=b'test body',
+                                 status=200)
+        self.crawler.stats.open_spider(self.spider)
+
+    def tearDown(self):
+        self.crawler.stats.close_spider(self.spider, '')
+
+    def _get_settings(self, **new_settings):
+        settings = {
+            'HTTPCACHE_ENABLED': True,
+            'HTTPCACHE_EXPIRATION_SECS': 0,
+            'HTTPCACHE_POLICY': self.policy_class,
+            'HTTPCACHE_STORAGE': self.storage_class,
+            'HTTPCACHE_MONGO_MONGOCLIENT_HOST': 'localhost',
+            'HTTPCACHE_MONGO_MONGOCLIENT_PORT': 27017,
+            'HTTPCACHE_MONGO_DATABASE': 'test_%s' % self.id().replace('.', '_')[-60:],
+            'HTTPCACHE_MONGO_COLLECTION': 'cache',
+        }
+        settings.update(new_settings)
+        return Settings(settings)
+
+    @defer.inlineCallbacks
+    def _middleware(self, **new_settings):
+        mw = HttpCacheMiddleware(self._get_settings(**new_settings), self.crawler.stats)
+        yield mw.spider_opened(self.spider)
+        self.addCleanup(mw.spider_closed, self.spider)
+        return mw
+
+    def test_requires_asyncio_reactor(self):
+        with mock.patch('scrapy_httpcache.extensions.cache_storage.mongo.is_asyncio_reactor_installed',
+                        return_value=False):
+            self.assertRaises(ValueError, HttpCacheMiddleware, self._get_settings(), self.crawler.stats)
+
+    @defer.inlineCallbacks
+    def test_retrieve_responses(self):
+        mw = yield self._middleware()
+        request2 = Request('http://www.example.com/2')
+        yield mw.storage.store_response(self.spider, self.request, self.response)
+        responses = yield mw.storage.retrieve_responses(self.spider, [request2, self.request])
+        self.assertIsNone(responses[0])
+        self.assertEqual(responses[1].body, self.response.body)
+
+    @defer.inlineCallbacks
+    def test_storage(self):
+        mw = yield self._middleware()
+        storage = mw.storage
+        d = storage.retrieve_response(self.spider, self.request)
+        self.assertIsInstance(d, defer.Deferred)
+        self.assertIsNone((yield d))
+
+        yield storage.store_response(self.spider, self.request, self.response)
+        response = yield storage.retrieve_response(self.spider, self.request.copy())
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual(response.url, self.response.url)
+        self.assertEqual(response.status, self.response.status)
+        self.assertEqual(response.headers, self.response.headers)
+        self.assertEqual(response.body, self.response.body)
+
+    @defer.inlineCallbacks
+    def test_storage_expired(self):
+        mw = yield self._middleware(HTTPCACHE_EXPIRATION_SECS=1)
+        yield mw.storage.store_response(self.spider, self.request, self.response)
+        self.assertIsNotNone((yield mw.storage.retrieve_response(self.spider, self.request)))
+        with mock.patch('scrapy_httpcache.extensions.cache_storage.mongo.time',
+                        return_value=time.time() + 2):
+            self.assertIsNone((yield mw.storage.retrieve_response(self.spider, self.request)))
+
+    @defer.inlineCallbacks
+    def test_middleware(self):
+        mw = yield self._middleware()
+        self.assertIsNone((yield mw.process_request(self.request, self.spider)))
+        response = yield mw.process_response(self.request, self.response, self.spider)
+        self.assertIs(response, self.response)
+        cached = yield mw.process_request(self.request, self.spider)
+        self.assertIn('cached', cached.flags)
+        self.assertEqual(cached.body, self.response.body)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/hit'), 1)
+
+    def test_close_unopened(self):
+        mw = HttpCacheMiddleware(self._get_settings(), self.crawler.stats)
+        mw.spider_closed(self.spider)
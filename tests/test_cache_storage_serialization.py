@@ -0,0 +1,55 @@
+import os
+import pickle
+import unittest
+
+from scrapy_httpcache.extensions.cache_storage.serialization import dumps, loads
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        fields = {
+            'status': 200,
+            'timestamp': 1234567890.5,
+            'url': 'http://www.example.com/é',
+            'headers': b'Content-Type: text/html\r\n',
+            'body': b'\x00' * 1000,
+            'codec': None,
+            'empty': '',
+            'negative': -1,
+        }
+        data = dumps(fields)
+        self.assertTrue(data.startswith(b'SHCE'))
+        self.assertEqual(loads(data), fields)
+        self.assertEqual(loads(dumps({})), {})
+
+    def test_unsupported_types(self):
+        for value in (True, [1], {'a': 1}, object()):
+            with self.assertRaises(TypeError):
+                dumps({'value': value})
+
+    def test_unknown_version(self):
+        data = bytearray(dumps({'status': 200}))
+        data[4] = 255
+        with self.assertRaises(ValueError):
+            loads(bytes(data))
+
+    def test_legacy_pickle(self):
+        fields = {
+            'status': 200,
+            'url': 'http://www.example.com',
+            'headers': {b'Content-Type': [b'text/html']},
+            'body': b'test body',
+            'timestamp': 1234567890.5,
+        }
+        self.assertEqual(loads(pickle.dumps(fields, protocol=2)), fields)
+
+    def test_malicious_pickle(self):
+        class Exploit(object):
+            def __reduce__(self):
+                return os.system, ('echo pwned',)
+
+        with self.assertRaises(ValueError):
+            loads(pickle.dumps({'body': Exploit()}, protocol=2))
+        with self.assertRaises(ValueError):
+            loads(b'garbage')
@@ -0,0 +1,259 @@
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from scrapy_httpcache.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy_httpcache.extensions.cache_storage.threaded import ThreadedCacheStorage
+from scrapy_httpcache.extensions.cache_storage.tiered import TieredCacheStorage
+
+
+class ThreadedStorageTest(unittest.TestCase):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
+    policy_class = 'scrapy_httpcache.extensions.policy.dummy.DummyPolicy'
+
+    def setUp(self):
+        self.crawler = get_crawler(Spider)
+        self.spider = self.crawler._create_spider('example.com')
+        self.tmpdir = tempfile.mkdtemp()
+        self.request = Request('http://www.example.com',
+                               headers={'User-Agent': 'test'})
+        self.response = Response('http://www.example.com',
+                                 headers={'Content-Type': 'text/html'},
+                                 body=b'test body',
+                                 status=202)
+        self.crawler.stats.open_spider(self.spider)
+        self.mw = HttpCacheMiddleware(self._get_settings(), self.crawler.stats)
+        self.mw.spider_opened(self.spider)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.mw.spider_closed(self.spider)
+        self.crawler.stats.close_spider(self.spider, '')
+        shutil.rmtree(self.tmpdir)
+
+    def _get_settings(self, **new_settings):
+        settings = {
+            'HTTPCACHE_ENABLED': True,
+            'HTTPCACHE_DIR': self.tmpdir,
+            'HTTPCACHE_EXPIRATION_SECS': 0,
+            'HTTPCACHE_IGNORE_HTTP_CODES': [],
+            'HTTPCACHE_POLICY': self.policy_class,
+            'HTTPCACHE_STORAGE': self.storage_class,
+            'HTTPCACHE_THREADED': True,
+            'HTTPCACHE_THREADPOOL_MAXSIZE': 4,
+        }
+        settings.update(new_settings)
+        return Settings(settings)
+
+    def test_storage_wrapped(self):
+        self.assertIsInstance(self.mw.storage, ThreadedCacheStorage)
+        self.assertEqual(self.mw.storage.threadpool.max, 4)
+
+    def _threaded(self):
+        return self.mw.storage
+
+    def test_iter_shard_entries(self):
+        # the storage reads only the shard
+        storage = self._threaded()
+        with mock.patch.object(storage.storage, 'iter_shard_entries',
+                               return_value=iter([('ab', 1.0, 2)])) as iter_shard_entries:
+            self.assertEqual(list(storage.iter_shard_entries(self.spider, 1, 4)), [('ab', 1.0, 2)])
+        iter_shard_entries.assert_called_once_with(self.spider, 1, 4)
+
+    @defer.inlineCallbacks
+    def test_close_off_reactor_thread(self):
+        from twisted.internet import reactor
+        storage = self._threaded()
+        threads = []
+        stop = storage.threadpool.stop
+
+        def stop_pool():
+            threads.append(threading.current_thread())
+            stop()
+
+        with mock.patch.object(storage.threadpool, 'stop', stop_pool), \
+                mock.patch.object(reactor, 'running', True):
+            d = storage.close_spider(self.spider)
+        self.assertIsInstance(d, defer.Deferred)
+        yield d
+        self.assertIsNot(threads[0], threading.current_thread())
+        self.mw.storage.close_spider = lambda spider: None  # closed
+
+    @defer.inlineCallbacks
+    def test_middleware(self):
+        d = self.mw.process_request(self.request, self.spider)
+        self.assertIsInstance(d, defer.Deferred)
+        self.assertIsNone((yield d))
+
+        d = self.mw.process_response(self.request, self.response, self.spider)
+        self.assertIsInstance(d, defer.Deferred)
+        self.assertIs((yield d), self.response)
+
+        response = yield self.mw.process_request(self.request, self.spider)
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual(response.body, self.response.body)
+        self.assertIn('cached', response.flags)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/hit'), 1)
+
+    @defer.inlineCallbacks
+    def test_response_delete(self):
+        yield self.mw.process_response(self.request, self.response, self.spider)
+        d = self.mw.response_delete(self.request, self.spider)
+        self.assertIsInstance(d, defer.Deferred)
+        yield d
+        self.assertIsNone((yield self.mw.process_request(self.request, self.spider)))
+
+    @defer.inlineCallbacks
+    def test_storage_off_reactor_thread(self):
+        storage = self.mw.storage.storage
+        threads = []
+        retrieve_response = storage.retrieve_response
+
+        def retrieve(spider, request):
+            threads.append(threading.current_thread())
+            return retrieve_response(spider, request)
+
+        storage.retrieve_response = retrieve
+        yield self.mw.process_request(self.request, self.spider)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    @defer.inlineCallbacks
+    def test_concurrent_requests(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(20)]
+        yield defer.gatherResults([
+            self.mw.process_response(r, Response(r.url, body=r.url.encode()),
+                                     self.spider)
+            for r in requests
+        ])
+        responses = yield defer.gatherResults([
+            self.mw.process_request(r, self.spider) for r in requests
+        ])
+        self.assertEqual([r.body for r in responses],
+                         [r.url.encode() for r in requests])
+
+    @defer.inlineCallbacks
+    def test_prefetch(self):
+        self.mw.prefetch_size = 2
+        requests = [Request('http://www.example.com/%d' % i) for i in range(2)]
+        yield self.mw.process_response(requests[1], self.response, self.spider)
+        for request in requests:
+            self.mw.request_scheduled(request, self.spider)
+        self.assertEqual(self.mw.prefetch_queue, [])
+        yield self._wait_staged(2)
+        # staged, not deferred
+        responses = [self.mw.process_request(r, self.spider) for r in requests]
+        self.assertIsNone(responses[0])
+        self.assertEqual(responses[1].body, self.response.body)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/prefetch/staged'), 2)
+
+    @defer.inlineCallbacks
+    def test_prefetch_in_flight(self):
+        self.mw.prefetch_size = 2
+        requests = [Request('http://www.example.com/%d' % i) for i in range(2)]
+        yield self.mw.process_response(requests[1], self.response, self.spider)
+        for request in requests:
+            self.mw.request_scheduled(request, self.spider)
+        # the batch is still queued in the thread pool, the requests wait for it
+        with mock.patch.object(self.mw.storage, 'retrieve_response') as retrieve_response:
+            ds = [self.mw.process_request(r, self.spider) for r in requests]
+            self.assertEqual(len(self.mw.prefetching), 2)
+            responses = yield defer.gatherResults(ds)
+        retrieve_response.assert_not_called()
+        self.assertIsNone(responses[0])
+        self.assertEqual(responses[1].body, self.response.body)
+        self.assertEqual(len(self.mw.staged), 0)
+        self.assertEqual(len(self.mw.prefetching), 0)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/prefetch/awaited'), 2)
+
+    @defer.inlineCallbacks
+    def _wait_staged(self, count):
+        from twisted.internet import reactor
+        from twisted.internet.task import deferLater
+        for _ in range(100):
+            if len(self.mw.staged) >= count:
+                return
+            yield deferLater(reactor, 0.01, lambda: None)
+        self.fail('the responses were not staged')
+
+
+class ThreadedFilesystemStorageTest(ThreadedStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage'
+
+    def test_storage_wrapped(self):
+        super(ThreadedFilesystemStorageTest, self).test_storage_wrapped()
+        self.assertIsNone(self.mw.storage.lock)
+
+
+class ThreadedTieredStorageTest(ThreadedStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.tiered.TieredCacheStorage'
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_TIERED_STORAGE',
+                                'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage')
+        return super(ThreadedTieredStorageTest, self)._get_settings(**new_settings)
+
+    def _threaded(self):
+        return self.mw.storage.storage
+
+    def test_storage_wrapped(self):
+        self.assertIsInstance(self.mw.storage, TieredCacheStorage)
+        self.assertIsInstance(self.mw.storage.storage, ThreadedCacheStorage)
+        self.assertEqual(self.mw.storage.storage.threadpool.max, 4)
+
+    @defer.inlineCallbacks
+    def test_response_delete(self):
+        yield self.mw.process_response(self.request, self.response, self.spider)
+        d = self.mw.response_delete(self.request, self.spider)
+        self.assertIsInstance(d, defer.Deferred)
+        yield d
+        self.assertIsNone((yield self.mw.process_request(self.request, self.spider)))
+
+    @defer.inlineCallbacks
+    def test_storage_off_reactor_thread(self):
+        storage = self.mw.storage.storage.storage
+        threads = []
+        retrieve_response = storage.retrieve_response
+
+        def retrieve(spider, request):
+            threads.append(threading.current_thread())
+            return retrieve_response(spider, request)
+
+        storage.retrieve_response = retrieve
+        yield self.mw.process_request(self.request, self.spider)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    @defer.inlineCallbacks
+    def test_middleware(self):
+        yield self.mw.process_request(self.request, self.spider)
+        yield self.mw.process_response(self.request, self.response, self.spider)
+        # served from memory without a thread
+        response = self.mw.process_request(self.request, self.spider)
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertIn('cached', response.flags)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/tiered/hit'), 1)
+
+    @defer.inlineCallbacks
+    def test_concurrent_requests(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(20)]
+        yield defer.gatherResults([
+            self.mw.process_response(r, Response(r.url, body=r.url.encode()),
+                                     self.spider)
+            for r in requests
+        ])
+        # the hits are not deferred
+        responses = [self.mw.process_request(r, self.spider) for r in requests]
+        self.assertEqual([r.body for r in responses],
+                         [r.url.encode() for r in requests])
@@ -0,0 +1,231 @@
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from scrapy.crawler import CrawlerRunner
+from scrapy.exceptions import UsageError
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+
+from scrapy_httpcache.commands.httpcache import Command, open_storage
+from scrapy_httpcache.extensions.cache_storage.file_system import FilesystemCacheStorage
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class HttpCacheCommandTest(unittest.TestCase):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.requests = [Request('http://www.example.com/%d' % i) for i in range(6)]
+        self.responses = [
+            Response(request.url, status=404 if i % 3 == 2 else 200, body=b'x' * (100 + i),
+                     headers={'Content-Type': 'text/html'})
+            for i, request in enumerate(self.requests)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _get_settings(self, **new_settings):
+        settings = {
+            'HTTPCACHE_DIR': self.tmpdir,
+            'HTTPCACHE_EXPIRATION_SECS': 60,
+            'HTTPCACHE_STORAGE': self.storage_class,
+            'SPIDER_MODULES': [],
+        }
+        settings.update(new_settings)
+        return settings
+
+    def _store(self, age=0, **new_settings):
+        spider, storage = open_storage(self._get_settings(**new_settings), 'example.com')
+        try:
+            for request, response in zip(self.requests, self.responses):
+                storage.store_response(spider, request, response)
+        finally:
+            storage.close_spider(spider)
+        if age:
+            # the filesystem storage dates the entries by their mtime
+            for dirpath, _, filenames in os.walk(self.tmpdir):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    os.utime(path, (time.time() - age, time.time() - age))
+
+    def _keys(self, **new_settings):
+        spider, storage = open_storage(self._get_settings(**new_settings), 'example.com')
+        try:
+            return sorted(storage.iter_keys(spider))
+        finally:
+            storage.close_spider(spider)
+
+    def _run(self, *args, **new_settings):
+        command = Command()
+        command.settings = Settings(self._get_settings(**new_settings))
+        command.crawler_process = CrawlerRunner(command.settings)
+        parser = argparse.ArgumentParser()
+        command.add_options(parser)
+        opts, args = parser.parse_known_args(args)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            command.run(args, opts)
+        return out.getvalue()
+
+    def test_usage(self):
+        with self.assertRaises(UsageError):
+            self._run('stats')
+        with self.assertRaises(UsageError):
+            self._run('frobnicate', 'example.com')
+        with self.assertRaises(UsageError):
+            self._run('export', 'example.com')
+
+    def test_stats(self):
+        self._store()
+        out = self._run('stats', 'example.com')
+        self.assertIn('example.com: 6 entries', out)
+        self.assertIn('age: <1h 6, <1d 0', out)
+        self.assertIn('status: 200 4, 404 2', out)
+
+    def test_stats_jobs(self):
+        self._store()
+        self.assertEqual(self._run('stats', 'example.com', '--jobs', '3'),
+                         self._run('stats', 'example.com'))
+
+    def test_prune_expired(self):
+        self._store(age=120)
+        out = self._run('prune', 'example.com')
+        self.assertIn('example.com: 6 entries, 6 expired', out)
+        self.assertEqual(self._keys(), [])
+
+    def test_prune_filters(self):
+        self._store()
+        out = self._run('prune', 'example.com', '--status', '404', '--url', r'/[0-3]$')
+        self.assertIn('example.com: 6 entries, 1 deleted', out)
+        self.assertEqual(len(self._keys()), 5)
+        out = self._run('prune', 'example.com', '--status', '404,500', '--jobs', '2')
+        self.assertIn('example.com: 5 entries, 1 deleted', out)
+        self.assertEqual(len(self._keys()), 4)
+        self.assertIn('0 deleted', self._run('prune', 'example.com', '--older-than', '60'))
+
+    def test_export_import(self):
+        self._store(age=120)
+        path = os.path.join(self.tmpdir, 'export.gz')
+        out = self._run('export', 'example.com', path, '--jobs', '2')
+        self.assertIn('example.com: 6 entries exported', out)
+        # the expired entries are exported too
+        sqlite = 'scrapy_httpcache.extensions.cache_storage.sqlite.SqliteCacheStorage'
+        out = self._run('import', 'example.com', path, HTTPCACHE_STORAGE=sqlite)
+        self.assertIn('example.com: 6 entries imported', out)
+        self.assertEqual(self._keys(HTTPCACHE_STORAGE=sqlite), self._keys())
+
+        spider, storage = open_storage(self._get_settings(HTTPCACHE_STORAGE=sqlite,
+                                                          HTTPCACHE_EXPIRATION_SECS=0),
+                                       'example.com')
+        try:
+            for request, response in zip(self.requests, self.responses):
+                cached = storage.retrieve_response(spider, request)
+                self.assertEqual(cached.status, response.status)
+                self.assertEqual(cached.body, response.body)
+                self.assertEqual(cached.headers, response.headers)
+        finally:
+            storage.close_spider(spider)
+
+    def test_import_keeps_age(self):
+        self._store(age=120)
+        path = os.path.join(self.tmpdir, 'export')
+        self._run('export', 'example.com', path)
+        module = 'scrapy_httpcache.extensions.cache_storage.'
+        storages = {
+            'dbm': {'HTTPCACHE_STORAGE': module + 'dbm.DbmCacheStorage'},
+            'filesystem': {'HTTPCACHE_DIR': os.path.join(self.tmpdir, 'filesystem')},
+            'record': {'HTTPCACHE_DIR': os.path.join(self.tmpdir, 'record'),
+                       'HTTPCACHE_FILESYSTEM_FORMAT': 'record'},
+            'lmdb': {'HTTPCACHE_STORAGE': module + 'lmdb.LmdbCacheStorage'},
+            'segment_log': {'HTTPCACHE_STORAGE': module + 'segment_log.SegmentLogCacheStorage'},
+            'sqlite': {'HTTPCACHE_STORAGE': module + 'sqlite.SqliteCacheStorage'},
+        }
+        for name, settings in storages.items():
+            self._run('import', 'example.com', path, **settings)
+            spider, storage = open_storage(self._get_settings(**settings), 'example.com')
+            try:
+                entries = list(storage.iter_entries(spider))
+                self.assertEqual(len(entries), 6, name)
+                for _, timestamp, _ in entries:
+                    self.assertAlmostEqual(timestamp, time.time() - 120, delta=10, msg=name)
+                # still expired
+                self.assertIsNone(storage.retrieve_response(spider, self.requests[0]), name)
+            finally:
+                storage.close_spider(spider)
+
+    def test_jobs_fall_back(self):
+        dbm = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
+        self._store(HTTPCACHE_STORAGE=dbm)
+        out = self._run('stats', 'example.com', '--jobs', '2', HTTPCACHE_STORAGE=dbm)
+        self.assertIn('example.com: 6 entries', out)
+
+    @unittest.skipIf(mongomock is None, 'mongomock is not installed')
+    def test_mongo(self):
+        client = mongomock.MongoClient()
+        mongo = {'HTTPCACHE_STORAGE': 'scrapy_httpcache.extensions.cache_storage.mongo.MongoCacheStorage',
+                 'HTTPCACHE_MONGO_MONGOCLIENT_HOST': 'localhost',
+                 'HTTPCACHE_MONGO_DATABASE': 'test_command',
+                 'HTTPCACHE_MONGO_COLLECTION': 'cache'}
+        with mock.patch('scrapy_httpcache.extensions.cache_storage.mongo.MongoClient',
+                        return_value=client):
+            self._store(**mongo)
+            out = self._run('stats', 'example.com', **mongo)
+            self.assertIn('example.com: 6 entries', out)
+            self.assertIn('status: 200 4, 404 2', out)
+            out = self._run('prune', 'example.com', '--status', '404', **mongo)
+            self.assertIn('example.com: 6 entries, 2 deleted', out)
+            self.assertEqual(len(self._keys(**mongo)), 4)
+
+    def test_cannot_list(self):
+        self._store()
+        with mock.patch.object(FilesystemCacheStorage, 'iter_shard_entries',
+                               side_effect=NotImplementedError('cannot list its entries')):
+            for args in (('stats', 'example.com'),
+                         ('prune', 'example.com', '--older-than', '1'),
+                         ('export', 'example.com', os.path.join(self.tmpdir, 'export'))):
+                self.assertIn('example.com: cannot be listed: cannot list its entries', self._run(*args))
+
+    def test_compact(self):
+        segment_log = 'scrapy_httpcache.extensions.cache_storage.segment_log.SegmentLogCacheStorage'
+        self._store(HTTPCACHE_STORAGE=segment_log)
+        self._run('prune', 'example.com', '--status', '404', HTTPCACHE_STORAGE=segment_log)
+        path = os.path.join(self.tmpdir, 'example.com.log')
+
+        def size():
+            return sum(os.path.getsize(os.path.join(path, name))
+                       for name in os.listdir(path) if name.endswith('.seg'))
+
+        before = size()
+        self.assertIn('example.com: compacted',
+                      self._run('compact', 'example.com', HTTPCACHE_STORAGE=segment_log))
+        self.assertLess(size(), before)
+        self.assertEqual(len(self._keys(HTTPCACHE_STORAGE=segment_log)), 4)
+        lmdb = 'scrapy_httpcache.extensions.cache_storage.lmdb.LmdbCacheStorage'
+        self.assertIn('cannot be compacted', self._run('compact', 'example.com',
+                                                       HTTPCACHE_STORAGE=lmdb))
+
+    def test_reshard(self):
+        self._store()
+        keys = self._keys()
+        out = self._run('reshard', 'example.com', HTTPCACHE_FILESYSTEM_SHARD_DEPTH=2,
+                        HTTPCACHE_FILESYSTEM_SHARD_WIDTH=1)
+        self.assertIn('example.com: 6 entries moved to 2 levels of 1-character shards', out)
+        self.assertEqual(self._keys(HTTPCACHE_FILESYSTEM_SHARD_DEPTH=2,
+                                    HTTPCACHE_FILESYSTEM_SHARD_WIDTH=1), keys)
+        dbm = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
+        self.assertIn('cannot be resharded', self._run('reshard', 'example.com',
+                                                       HTTPCACHE_STORAGE=dbm))
@@ -1,16 +1,41 @@
+import os
+import json
 import time
+import pickle
 import tempfile
 import shutil
+import sqlite3
 import unittest
 import email.utils
 from contextlib import contextmanager
+from itertools import islice
+from unittest import mock
 
-from scrapy.http import Response, HtmlResponse, Request
+from scrapy import signals
+from scrapy.http import Response, HtmlResponse, Request, XmlResponse
+from scrapy.responsetypes import responsetypes
 from scrapy.spiders import Spider
 from scrapy.settings import Settings
-from scrapy.exceptions import IgnoreRequest
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.request import request_fingerprint
 from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from scrapy_httpcache import signals as httpcache_signals
 from scrapy_httpcache.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy_httpcache.extensions.cache_storage.lazy import LazyBodyMixin, MissingBodyError
+from scrapy_httpcache.extensions.cache_storage.serialization import loads
+from scrapy_httpcache.extensions.policy import rfc2616
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
 
 
 class _BaseTest(unittest.TestCase):
@@ -122,12 +147,133 @@ class DefaultStorageTest(_BaseTest):
             time.sleep(0.5)  # give the chance to expire
             assert storage.retrieve_response(self.spider, self.request)
 
+    def test_retrieve_responses(self):
+        request2 = Request('http://www.example.com/2')
+        with self._storage() as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            responses = storage.retrieve_responses(self.spider, [request2, self.request.copy(), request2])
+            self.assertEqual(len(responses), 3)
+            self.assertIsNone(responses[0])
+            self.assertEqualResponse(self.response, responses[1])
+            self.assertIsNone(responses[2])
+
+    def test_lazy_body(self):
+        with self._storage(HTTPCACHE_LAZY_BODY=True) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            response = storage.retrieve_response(self.spider, self.request.copy())
+            self.assertIsInstance(response, LazyBodyMixin)
+            self.assertIsInstance(response, HtmlResponse)
+            self.assertFalse(response.body_loaded)
+            self.assertEqualResponse(self.response, response)
+            self.assertTrue(response.body_loaded)
+
+    def test_iter_keys(self):
+        requests = [self.request, Request('http://www.example.com/2')]
+        with self._storage() as storage:
+            self.assertEqual(list(storage.iter_keys(self.spider)), [])
+            for request in requests:
+                storage.store_response(self.spider, request, self.response)
+            self.assertEqual(sorted(storage.iter_keys(self.spider)),
+                             sorted(storage._request_key(r) for r in requests))
+
+    def test_iter_entries(self):
+        requests = [self.request, Request('http://www.example.com/2')]
+        with self._storage() as storage:
+            self.assertEqual(list(storage.iter_entries(self.spider)), [])
+            before = time.time()
+            for request in requests:
+                storage.store_response(self.spider, request, self.response)
+            entries = sorted(storage.iter_entries(self.spider))
+            self.assertEqual([key for key, _, _ in entries],
+                             sorted(storage._request_key(r) for r in requests))
+            for _, timestamp, size in entries:
+                self.assertAlmostEqual(timestamp, before, delta=5)
+                self.assertGreaterEqual(size, len(self.response.body))
+
+    def _assert_shards(self, storage, shards=3):
+        # every entry is listed by exactly one shard
+        requests = [Request('http://www.example.com/%d' % i) for i in range(30)]
+        for request in requests:
+            storage.store_response(self.spider, request, self.response)
+        keys = []
+        for shard in range(shards):
+            keys.extend(key for key, _, _ in storage.iter_shard_entries(self.spider, shard, shards))
+        self.assertEqual(sorted(keys), sorted(storage._request_key(r) for r in requests))
+
+    def test_iter_shard_entries(self):
+        with self._storage() as storage:
+            self._assert_shards(storage)
+            self.assertEqual(len(list(storage.iter_shard_entries(self.spider, 0, 1))), 30)
+
+    def test_delete_responses(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(3)]
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            for request in requests:
+                storage.store_response(self.spider, request, self.response)
+            storage.delete_responses(self.spider, [storage._request_key(r) for r in requests[:2]]
+                                     + ['unknown'])
+            self.assertEqual(list(storage.iter_keys(self.spider)),
+                             [storage._request_key(requests[2])])
+            self.assertIsNone(storage.retrieve_response(self.spider, requests[0]))
+            self.assertIsNotNone(storage.retrieve_response(self.spider, requests[2]))
+
+    def test_delete_response(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+            storage.delete_response(self.request, self.response, self.spider)
+            self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+            # already deleted
+            storage.delete_response(self.request, None, self.spider)
+
+    def test_response_class_recorded(self):
+        response = self.response.replace(url='http://www.example.com/feed',
+                                         headers={'Content-Type': 'text/xml', 'X-Foo': 'a'})
+        with self._storage() as storage:
+            storage.store_response(self.spider, self.request, response)
+            # the hits do not sniff the class anymore
+            with mock.patch.object(responsetypes, 'from_args', side_effect=AssertionError):
+                cached = storage.retrieve_response(self.spider, self.request.copy())
+            self.assertIsInstance(cached, XmlResponse)
+            self.assertEqualResponse(response, cached)
+
+    def test_dates_recorded(self):
+        now = int(time.time())
+        response = self.response.replace(headers={
+            'Date': email.utils.formatdate(now, usegmt=True),
+            'Expires': 'never',
+            'Last-Modified': email.utils.formatdate(now - 86400),
+        })
+        policy = rfc2616.RFC2616Policy(Settings())
+        with self._storage() as storage:
+            storage.store_response(self.spider, self.request, response)
+            # the hits do not parse the dates anymore
+            with mock.patch.object(rfc2616, 'parse_dates', side_effect=AssertionError):
+                cached = storage.retrieve_response(self.spider, self.request.copy())
+                self.assertEqual(policy._get_dates(cached), (now, 0, now - 86400))
+                self.assertFalse(policy.is_cached_response_fresh(cached, self.request.copy()))
+
 
 class DbmStorageTest(DefaultStorageTest):
 
     storage_class = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
 
 
+    def test_read_pickled_entry(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            key = storage._request_key(self.request)
+            # as written by the earlier versions
+            storage.db['%s_data' % key] = pickle.dumps({
+                'status': 202,
+                'url': 'http://www.example.com',
+                'headers': dict(self.response.headers),
+                'body': b'test body',
+            }, protocol=2)
+            storage.db['%s_time' % key] = str(time.time())
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+
 class DbmStorageWithCustomDbmModuleTest(DbmStorageTest):
 
     dbm_module = 'tests.mocks.dummydbm'
@@ -142,10 +288,502 @@ class DbmStorageWithCustomDbmModuleTest(DbmStorageTest):
             self.assertEqual(storage.dbmodule.__name__, self.dbm_module)
 
 
+class DbmStorageCompressionTest(DbmStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_COMPRESSION', 'zlib')
+        new_settings.setdefault('HTTPCACHE_COMPRESSION_MIN_SIZE', 0)
+        return super(DbmStorageCompressionTest, self)._get_settings(**new_settings)
+
+    def test_codec_recorded_per_entry(self):
+        body = b'<html>' + b'compressible ' * 1000 + b'</html>'
+        large = self.response.replace(body=body)
+        request2 = Request('http://www.example.com/2')
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0,
+                           HTTPCACHE_COMPRESSION_MIN_SIZE=100) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            storage.store_response(self.spider, request2, large)
+            data = storage._read_data(self.spider, self.request)
+            self.assertEqual((data['codec'], data['body']), (None, b'test body'))
+            data = storage._read_data(self.spider, request2)
+            self.assertEqual(data['codec'], 'zlib')
+            self.assertLess(len(data['body']), len(body))
+            storage.close_spider(self.spider)
+
+            storage.codec = None  # as if the setting was changed
+            storage.open_spider(self.spider)
+            self.assertEqualResponse(large, storage.retrieve_response(self.spider, request2))
+
+
+class TieredStorageTest(DefaultStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.tiered.TieredCacheStorage'
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_TIERED_STORAGE',
+                                'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage')
+        return super(TieredStorageTest, self)._get_settings(**new_settings)
+
+    def _responses(self, count, size):
+        return [(Request('http://www.example.com/%d' % i),
+                 self.response.replace(url='http://www.example.com/%d' % i, body=b'x' * size))
+                for i in range(count)]
+
+    def test_lazy_body(self):
+        # the tier keeps complete responses, the backend ones are lazy
+        with self._storage(HTTPCACHE_LAZY_BODY=True) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            response = storage.retrieve_response(self.spider, self.request)
+            self.assertNotIsInstance(response, LazyBodyMixin)
+            self.assertEqualResponse(self.response, response)
+            response = storage.storage.retrieve_response(self.spider, self.request)
+            self.assertIsInstance(response, LazyBodyMixin)
+            self.assertEqualResponse(self.response, response)
+
+    def test_promote_counts_decoded_body(self):
+        # the tier holds the decompressed bodies, lazy or not
+        responses = self._responses(5, 5000)
+        for lazy in (False, True):
+            with self._storage(HTTPCACHE_LAZY_BODY=lazy, HTTPCACHE_EXPIRATION_SECS=60,
+                               HTTPCACHE_COMPRESSION='zlib', HTTPCACHE_COMPRESSION_MIN_SIZE=0,
+                               HTTPCACHE_TIERED_MAX_BYTES=12000) as storage:
+                for request, response in responses:
+                    storage.store_response(self.spider, request, response)
+                storage.entries.clear()
+                storage.size = 0
+                for request, response in responses:
+                    self.assertEqualResponse(response, storage.retrieve_response(self.spider, request))
+                self.assertEqual(len(storage.entries), 2)
+                self.assertEqual(storage.size, sum(len(entry[2].body) for entry in storage.entries.values()))
+                self.assertEqual(storage.size, 10000)
+
+    def test_hit_skips_backend(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            with mock.patch.object(storage.storage, 'retrieve_response') as retrieve:
+                response = storage.retrieve_response(self.spider, self.request)
+                response.flags.append('cached')
+                response2 = storage.retrieve_response(self.spider, self.request)
+            retrieve.assert_not_called()
+            self.assertEqualResponse(self.response, response2)
+            self.assertEqual(response2.flags, [])
+            self.assertEqual(self.crawler.stats.get_value('httpcache/tiered/hit'), 2)
+
+    def test_byte_budget_eviction(self):
+        responses = self._responses(5, 100)
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0,
+                           HTTPCACHE_TIERED_MAX_BYTES=300) as storage:
+            for request, response in responses:
+                storage.store_response(self.spider, request, response)
+                storage.retrieve_response(self.spider, responses[0][0])  # keep it hot
+            self.assertEqual(storage.size, 300)
+            self.assertEqual(list(storage.entries),
+                             [storage._request_key(r) for r, _ in responses[3:] + responses[:1]])
+            self.assertEqual(self.crawler.stats.get_value('httpcache/tiered/eviction'), 2)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/tiered/evicted_bytes'), 200)
+            # written through, then promoted again from the backend
+            response = storage.retrieve_response(self.spider, responses[1][0])
+            self.assertEqualResponse(responses[1][1], response)
+            self.assertIn(storage._request_key(responses[1][0]), storage.entries)
+            # too large for the tier
+            storage.store_response(self.spider, self.request, self.response.replace(body=b'x' * 301))
+            self.assertNotIn(storage._request_key(self.request), storage.entries)
+            self.assertEqual(len(storage.retrieve_response(self.spider, self.request).body), 301)
+
+    def test_delete_drops_tier(self):
+        responses = self._responses(3, 100)
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            for request, response in responses:
+                storage.store_response(self.spider, request, response)
+            storage.delete_response(responses[0][0], None, self.spider)
+            storage.delete_responses(self.spider, [storage._request_key(responses[1][0])])
+            self.assertEqual(list(storage.entries), [storage._request_key(responses[2][0])])
+            self.assertEqual(storage.size, 100)
+
+    def test_expiration(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=1) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertIn(storage._request_key(self.request), storage.entries)
+            stored = storage.entries[storage._request_key(self.request)][0]
+            storage.entries.clear()
+            storage.size = 0
+            # promoted with the time of the backend entry, expiring with it
+            self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+            self.assertEqual(len(storage.entries), 1)
+            self.assertAlmostEqual(storage.entries[storage._request_key(self.request)][0], stored, places=0)
+            time.sleep(1.5)
+            self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+            self.assertEqual(self.crawler.stats.get_value('httpcache/tiered/expired'), 1)
+            self.assertEqual(storage.size, 0)
+
+
+class BloomFilterStorageTest(DefaultStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.bloom.BloomFilterCacheStorage'
+    backend_class = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_BLOOM_STORAGE', self.backend_class)
+        new_settings.setdefault('HTTPCACHE_BLOOM_CAPACITY', 1000)
+        return super(BloomFilterStorageTest, self)._get_settings(**new_settings)
+
+    def test_miss_skips_backend(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            with mock.patch.object(storage.storage, 'retrieve_response',
+                                   wraps=storage.storage.retrieve_response) as retrieve:
+                self.assertIsNone(storage.retrieve_response(self.spider, Request('http://a.com')))
+                retrieve.assert_not_called()
+                self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+                retrieve.assert_called_once()
+        self.assertEqual(self.crawler.stats.get_value('httpcache/bloom/skipped'), 1)
+
+    def test_false_positive_rate(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.bloom.add(storage._request_key(self.request))  # not stored
+            storage.retrieve_response(self.spider, self.request)
+            for i in range(3):
+                storage.retrieve_response(self.spider, Request('http://a.com/%d' % i))
+        self.assertEqual(self.crawler.stats.get_value('httpcache/bloom/false_positive'), 1)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/bloom/false_positive_rate'), 0.25)
+
+    def test_persisted(self):
+        path = os.path.join(self.tmpdir, self.spider.name + '.bloom')
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+        self.assertTrue(os.path.exists(path))
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            # stale while the spider is open
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(storage.bloom.count, 1)
+            self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+        # sized for other settings
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0,
+                           HTTPCACHE_BLOOM_CAPACITY=10) as storage:
+            self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+
+    def test_rebuilt_from_keys(self):
+        settings = self._get_settings(HTTPCACHE_EXPIRATION_SECS=0,
+                                      HTTPCACHE_STORAGE=self.backend_class)
+        mw = HttpCacheMiddleware(settings, self.crawler.stats)
+        mw.spider_opened(self.spider)
+        mw.storage.store_response(self.spider, self.request, self.response)
+        mw.spider_closed(self.spider)
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            self.assertEqual(storage.bloom.count, 1)
+            self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+
+    def test_without_keys(self):
+        with mock.patch('scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage.iter_keys',
+                        side_effect=NotImplementedError):
+            with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+                self.assertIsNone(storage.bloom)
+                storage.store_response(self.spider, self.request, self.response)
+                self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+
+
+class SqliteStorageTest(DefaultStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.sqlite.SqliteCacheStorage'
+
+    def test_lazy_body_replaced(self):
+        with self._storage(HTTPCACHE_LAZY_BODY=True, HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            response = storage.retrieve_response(self.spider, self.request)
+            time.sleep(0.01)
+            storage.store_response(self.spider, self.request, self.response.replace(body=b'new'))
+            with self.assertRaises(MissingBodyError):
+                response.body
+
+    def test_wal_and_grouped_commits(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0,
+                           HTTPCACHE_SQLITE_COMMIT_SIZE=3,
+                           HTTPCACHE_SQLITE_COMMIT_INTERVAL=60) as storage:
+            self.assertEqual(storage.db.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+            dbpath = os.path.join(self.tmpdir, '%s.sqlite' % self.spider.name)
+            reader = sqlite3.connect(dbpath)
+            self.addCleanup(reader.close)
+
+            def committed():
+                return reader.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+            for i in range(2):
+                storage.store_response(self.spider, Request('http://a.com/%d' % i), self.response)
+            self.assertEqual(committed(), 0)
+            # read-your-writes before the commit
+            self.assertIsNotNone(storage.retrieve_response(self.spider, Request('http://a.com/0')))
+            storage.store_response(self.spider, Request('http://a.com/2'), self.response)
+            self.assertEqual(committed(), 3)
+            storage.store_response(self.spider, Request('http://a.com/3'), self.response)
+        self.assertEqual(committed(), 4)
+
+    def test_commit_when_idle(self):
+        clock = Clock()
+        with mock.patch('twisted.internet.reactor', clock), \
+                self._storage(HTTPCACHE_EXPIRATION_SECS=0,
+                              HTTPCACHE_SQLITE_COMMIT_INTERVAL=1) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertTrue(storage.db.in_transaction)
+            with mock.patch('scrapy_httpcache.extensions.cache_storage.sqlite.time',
+                            return_value=time.time() + 1):
+                clock.advance(1)
+            # without another write
+            self.assertFalse(storage.db.in_transaction)
+            self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_add_class_name(self):
+        # a database created before the class of the responses was recorded
+        db = sqlite3.connect(os.path.join(self.tmpdir, '%s.sqlite' % self.spider.name))
+        db.execute('CREATE TABLE responses (fingerprint TEXT PRIMARY KEY, timestamp REAL NOT NULL, '
+                   'status INTEGER NOT NULL, url TEXT NOT NULL, headers BLOB NOT NULL, '
+                   'body BLOB NOT NULL, codec TEXT)')
+        key = request_fingerprint(self.request)
+        db.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, NULL)',
+                   (key, time.time(), 202, self.response.url,
+                    b'Content-Type: text/html\r\n', self.response.body))
+        db.commit()
+        db.close()
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            cached = storage.retrieve_response(self.spider, self.request)
+            self.assertIsInstance(cached, HtmlResponse)
+            self.assertEqualResponse(self.response, cached)
+            storage.store_response(self.spider, self.request, self.response)
+            row = storage.db.execute('SELECT class_name, dates FROM responses').fetchone()
+            self.assertEqual(row, ('HtmlResponse', ',,'))
+
+    def test_purge_expired(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=60) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            storage.store_response(self.spider, Request('http://a.com'), self.response)
+            storage.db.execute('UPDATE responses SET timestamp = timestamp - 100 '
+                               'WHERE fingerprint = ?', (storage._request_key(self.request),))
+            self.assertEqual(storage.purge_expired(), 1)
+            self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+            self.assertIsNotNone(storage.retrieve_response(self.spider, Request('http://a.com')))
+            plan = storage.db.execute('EXPLAIN QUERY PLAN DELETE FROM responses '
+                                      'WHERE timestamp < 0').fetchall()
+            self.assertIn('responses_timestamp', str(plan))
+
+    def test_iter_shard_entries_alone(self):
+        # each shard is read by itself, without listing every entry
+        with self._storage() as storage:
+            with mock.patch.object(storage, 'iter_entries', side_effect=AssertionError):
+                self._assert_shards(storage)
+
+
+@unittest.skipIf(lmdb is None, 'lmdb is not installed')
+class LmdbStorageTest(DefaultStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.lmdb.LmdbCacheStorage'
+
+    def test_shared_environment(self):
+        spider2 = self.crawler._create_spider('example.org')
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage2 = type(storage)(self._get_settings(HTTPCACHE_EXPIRATION_SECS=0))
+            storage2.open_spider(spider2)
+            try:
+                self.assertIs(storage.env, storage2.env)
+                storage.store_response(self.spider, self.request, self.response)
+                # a named database per spider
+                self.assertIsNone(storage2.retrieve_response(spider2, self.request))
+                self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+            finally:
+                storage2.close_spider(spider2)
+            self.assertIsNotNone(storage.retrieve_response(self.spider, self.request))
+
+    def test_iter_shard_entries_alone(self):
+        # each shard is read by itself, without listing every entry
+        with self._storage() as storage:
+            with mock.patch.object(storage, 'iter_entries', side_effect=AssertionError):
+                self._assert_shards(storage)
+
+    def test_versioned_value(self):
+        from scrapy_httpcache.extensions.cache_storage.lmdb import VALUE_HEADER, VALUE_VERSION
+        response = self.response.replace(headers={'Content-Type': 'text/html',
+                                                  'Date': 'Sun, 18 Oct 2026 10:00:00 GMT'})
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, response)
+            with storage.env.begin(db=storage.db) as txn:
+                value = txn.get(storage._request_key(self.request).encode())
+            fields = VALUE_HEADER.unpack_from(value)
+            self.assertEqual(fields[0], VALUE_VERSION)
+            # the class and the dates in their own fields
+            self.assertEqual(fields[6], len('HtmlResponse'))
+            self.assertGreater(fields[7], 0)
+            cached = storage.retrieve_response(self.spider, self.request)
+            self.assertIsInstance(cached, HtmlResponse)
+            self.assertEqual(cached.body, response.body)
+
+    def test_other_version_missed(self):
+        with self._storage() as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            key = storage._request_key(self.request).encode()
+            with storage.env.begin(write=True, db=storage.db) as txn:
+                txn.put(key, b'\xff' + txn.get(key)[1:])
+            self.assertIsNone(storage.retrieve_response(self.spider, self.request))
+            self.assertEqual([entry[:2] for entry in storage.iter_entries(self.spider)],
+                             [(key.decode(), 0)])
+
+    def test_iter_keys_paged(self):
+        with self._storage() as storage:
+            with storage.env.begin(write=True, db=storage.db) as txn:
+                for i in range(2500):
+                    txn.put(b'%040x' % i, b'')
+            begin = storage.env.begin
+            transactions = []
+
+            def counted(**kwargs):
+                transactions.append(kwargs)
+                return begin(**kwargs)
+
+            with mock.patch.object(storage, 'env', mock.Mock(wraps=storage.env, begin=counted)):
+                keys = storage.iter_keys(self.spider)
+                self.assertEqual(len(list(islice(keys, 1500))), 1500)
+                self.assertEqual(len(transactions), 2)
+                self.assertEqual(len(list(keys)), 1000)
+            self.assertEqual(len(transactions), 4)
+
+class LmdbStorageCompressionTest(LmdbStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_COMPRESSION', 'gzip')
+        new_settings.setdefault('HTTPCACHE_COMPRESSION_MIN_SIZE', 0)
+        return super(LmdbStorageCompressionTest, self)._get_settings(**new_settings)
+
+
 class FilesystemStorageTest(DefaultStorageTest):
 
     storage_class = 'scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage'
 
+    def test_chunked_body(self):
+        body = b'<html>' + os.urandom(100) + b'</html>'
+        with self._storage(HTTPCACHE_FILESYSTEM_CHUNK_SIZE=7) as storage:
+            response = self.response.replace(body=body)
+            storage.store_response(self.spider, self.request, response)
+            self.assertEqualResponse(response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+    def test_switch_format(self):
+        responses = [self.response.replace(body=body) for body in (b'old', b'new', b'newer')]
+        for response, fmt in zip(responses, ('record', 'directory', 'record')):
+            with self._storage(HTTPCACHE_FILESYSTEM_FORMAT=fmt,
+                               HTTPCACHE_EXPIRATION_SECS=0) as storage:
+                storage.store_response(self.spider, self.request, response)
+                # the entry of the other format is removed
+                self.assertEqualResponse(response,
+                                         storage.retrieve_response(self.spider, self.request))
+                rpath = storage._get_request_path(self.spider, self.request)
+                self.assertEqual(len(os.listdir(os.path.dirname(rpath))), 1)
+                self.assertEqual(len(list(storage.iter_keys(self.spider))), 1)
+
+    def test_iter_entries_once(self):
+        with self._storage(HTTPCACHE_FILESYSTEM_FORMAT='directory') as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            rpath = storage._get_request_path(self.spider, self.request)
+            # left by a process storing in the record format
+            with open(rpath + '.rec', 'wb'):
+                pass
+            entries = list(storage.iter_entries(self.spider))
+            self.assertEqual([key for key, _, _ in entries], [os.path.basename(rpath)])
+            self.assertEqual(entries[0][2], 0)
+
+    def test_read_pickled_meta(self):
+        with self._storage(HTTPCACHE_FILESYSTEM_FORMAT='directory',
+                           HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            rpath = storage._get_request_path(self.spider, self.request)
+            # as written by the earlier versions
+            with storage._open(os.path.join(rpath, 'metadata'), 'rb') as f:
+                metadata = loads(f.read())
+            with storage._open(os.path.join(rpath, 'pickled_meta'), 'wb') as f:
+                pickle.dump(metadata, f, protocol=2)
+            os.remove(os.path.join(rpath, 'metadata'))
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+    def test_debug_meta(self):
+        with self._storage(HTTPCACHE_FILESYSTEM_FORMAT='directory') as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            rpath = storage._get_request_path(self.spider, self.request)
+            self.assertFalse(os.path.exists(os.path.join(rpath, 'meta')))
+        with self._storage(HTTPCACHE_FILESYSTEM_FORMAT='directory',
+                           HTTPCACHE_FILESYSTEM_DEBUG_META=True) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            with storage._open(os.path.join(rpath, 'meta'), 'rb') as f:
+                self.assertIn(b"'status': 202", f.read())
+
+    def test_shard_layout(self):
+        with self._storage(HTTPCACHE_FILESYSTEM_SHARD_DEPTH=3,
+                           HTTPCACHE_FILESYSTEM_SHARD_WIDTH=1) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            key = storage._request_key(self.request)
+            self.assertEqual(storage._get_request_path(self.spider, self.request),
+                             os.path.join(self.tmpdir, self.spider.name, key[0], key[1], key[2], key))
+            self.assertEqual(list(storage.iter_keys(self.spider)), [key])
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+        with open(os.path.join(self.tmpdir, self.spider.name, '.layout')) as f:
+            self.assertEqual(json.load(f), {'depth': 3, 'width': 1})
+        with self.assertRaises(NotConfigured):
+            self._storage(HTTPCACHE_FILESYSTEM_SHARD_WIDTH=0).__enter__()
+
+    def test_known_dirs(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(20)]
+        with self._storage(HTTPCACHE_FILESYSTEM_SHARD_DEPTH=1,
+                           HTTPCACHE_FILESYSTEM_SHARD_WIDTH=1) as storage:
+            with mock.patch('os.makedirs', wraps=os.makedirs) as makedirs:
+                for request in requests:
+                    storage.store_response(self.spider, request, self.response)
+            shards = {storage._request_key(r)[0] for r in requests}
+            self.assertEqual(makedirs.call_count, len(shards))
+            # emptied and removed, by another process
+            storage.delete_responses(self.spider, list(storage.iter_keys(self.spider)))
+            for shard in shards:
+                os.rmdir(os.path.join(self.tmpdir, self.spider.name, shard))
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+    def test_reshard(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(10)]
+        # sharded as the earlier versions did
+        with self._storage(HTTPCACHE_FILESYSTEM_SHARD_DEPTH=1,
+                           HTTPCACHE_FILESYSTEM_SHARD_WIDTH=2) as storage:
+            for request in requests:
+                storage.store_response(self.spider, request, self.response)
+            keys = sorted(storage.iter_keys(self.spider))
+        os.remove(os.path.join(self.tmpdir, self.spider.name, '.layout'))
+        for depth, width in ((2, 1), (0, 1), (1, 2)):
+            with self._storage(HTTPCACHE_FILESYSTEM_SHARD_DEPTH=depth,
+                               HTTPCACHE_FILESYSTEM_SHARD_WIDTH=width) as storage:
+                self.assertEqual(storage.reshard(self.spider), 10)
+                self.assertEqual(storage.reshard(self.spider), 0)
+                self.assertEqual(sorted(storage.iter_keys(self.spider)), keys)
+                for request in requests:
+                    self.assertEqualResponse(self.response,
+                                             storage.retrieve_response(self.spider, request))
+                # the shard directories of the earlier layout are removed
+                spiderdir = os.path.join(self.tmpdir, self.spider.name)
+                names = {n for n in os.listdir(spiderdir) if not n.startswith('.')}
+                self.assertEqual(names, {k[:width] if depth else k + storage.use_record * '.rec'
+                                         for k in keys})
+
+    def test_iter_shard_entries_alone(self):
+        # each shard is read by itself, without listing every entry
+        with self._storage() as storage:
+            with mock.patch.object(storage, 'iter_entries', side_effect=AssertionError):
+                self._assert_shards(storage)
+
+
+
+class FilesystemStorageShardedTest(FilesystemStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_FILESYSTEM_SHARD_DEPTH', 2)
+        new_settings.setdefault('HTTPCACHE_FILESYSTEM_SHARD_WIDTH', 1)
+        return super(FilesystemStorageShardedTest, self)._get_settings(**new_settings)
+
 
 class FilesystemStorageGzipTest(FilesystemStorageTest):
 
@@ -154,6 +792,532 @@ class FilesystemStorageGzipTest(FilesystemStorageTest):
         return super(FilesystemStorageTest, self)._get_settings(**new_settings)
 
 
+class FilesystemStorageRecordTest(FilesystemStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_FILESYSTEM_FORMAT', 'record')
+        return super(FilesystemStorageRecordTest, self)._get_settings(**new_settings)
+
+    def test_lazy_body_replaced(self):
+        with self._storage(HTTPCACHE_LAZY_BODY=True, HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            response = storage.retrieve_response(self.spider, self.request)
+            storage.store_response(self.spider, self.request, self.response.replace(body=b'new'))
+            with self.assertRaises(MissingBodyError):
+                response.body
+
+    def test_single_record_file(self):
+        with self._storage() as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            rpath = storage._get_request_path(self.spider, self.request)
+            self.assertFalse(os.path.exists(rpath))
+            self.assertEqual(os.listdir(os.path.dirname(rpath)),
+                             [os.path.basename(rpath) + '.rec'])
+
+    def test_read_directory_format(self):
+        with self._storage(HTTPCACHE_FILESYSTEM_FORMAT='directory',
+                           HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+            # the record takes over once the entry is stored again
+            response = self.response.replace(body=b'new body')
+            storage.store_response(self.spider, self.request, response)
+            self.assertEqualResponse(response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+
+class FilesystemStorageMmapTest(FilesystemStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_MMAP_MIN_SIZE', 5)
+        return super(FilesystemStorageMmapTest, self)._get_settings(**new_settings)
+
+    def test_mmap_threshold(self):
+        large = self.response.replace(body=b'x' * 100)
+        request2 = Request('http://www.example.com/2')
+        with self._storage(HTTPCACHE_MMAP_MIN_SIZE=50) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            storage.store_response(self.spider, request2, large)
+
+            small = storage.retrieve_response(self.spider, self.request)
+            self.assertNotIsInstance(small, LazyBodyMixin)
+
+            mapped = storage.retrieve_response(self.spider, request2)
+            self.assertIsInstance(mapped, LazyBodyMixin)
+            self.assertIsInstance(mapped, HtmlResponse)
+            self.assertFalse(mapped.body_loaded)
+            self.assertEqual(mapped.body_buffer, b'x' * 100)
+            self.assertFalse(mapped.body_loaded)
+            self.assertEqualResponse(large, mapped)
+            self.assertTrue(mapped.body_loaded)
+            self.assertEqual(mapped.replace(url='http://a.com').body, large.body)
+
+    def test_store_while_mapped(self):
+        large = self.response.replace(body=os.urandom(1024 * 1024))
+        with self._storage(HTTPCACHE_MMAP_MIN_SIZE=4096, HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, self.request, large)
+            mapped = storage.retrieve_response(self.spider, self.request)
+            self.assertFalse(mapped.body_loaded)
+            # the mapped file is replaced, not truncated
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertEqual(mapped.body, large.body)
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+
+class FilesystemStorageRecordMmapTest(FilesystemStorageMmapTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_FILESYSTEM_FORMAT', 'record')
+        return super(FilesystemStorageRecordMmapTest, self)._get_settings(**new_settings)
+
+
+class FilesystemStorageRecordGzipTest(FilesystemStorageRecordTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_GZIP', True)
+        return super(FilesystemStorageRecordGzipTest, self)._get_settings(**new_settings)
+
+
+class FilesystemStorageHashFingerprintTest(FilesystemStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_FINGERPRINTER',
+                                'scrapy_httpcache.extensions.fingerprint.HashFingerprinter')
+        new_settings.setdefault('HTTPCACHE_FINGERPRINT_EXCLUDE_QUERY_PARAMS', ['sid'])
+        return super(FilesystemStorageHashFingerprintTest, self)._get_settings(**new_settings)
+
+    def test_excluded_query_params(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.store_response(self.spider, Request('http://www.example.com/?sid=1'),
+                                   self.response)
+            response = storage.retrieve_response(self.spider,
+                                                 Request('http://www.example.com/?sid=2'))
+            self.assertEqualResponse(self.response, response)
+
+
+class FilesystemStorageCompressionTest(FilesystemStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_COMPRESSION', 'lzma')
+        new_settings.setdefault('HTTPCACHE_COMPRESSION_MIN_SIZE', 0)
+        return super(FilesystemStorageCompressionTest, self)._get_settings(**new_settings)
+
+
+class SegmentLogStorageTest(DefaultStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.segment_log.SegmentLogCacheStorage'
+
+    def _store(self, storage, count, offset=0):
+        requests = [Request('http://www.example.com/%d' % i)
+                    for i in range(offset, offset + count)]
+        for request in requests:
+            storage.store_response(self.spider, request,
+                                   self.response.replace(body=request.url.encode()))
+        return requests
+
+    def test_read_pickled_meta(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            # as written by the earlier versions
+            storage.log.append(storage._request_key(self.request).encode(), time.time(),
+                               pickle.dumps({'url': 'http://www.example.com', 'status': 202,
+                                             'codec': None}, protocol=2),
+                               b'Content-Type: text/html', b'test body')
+            self.assertEqualResponse(self.response,
+                                     storage.retrieve_response(self.spider, self.request))
+
+    def test_index_persisted(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            requests = self._store(storage, 10)
+            path = storage.log.path
+        self.assertTrue(os.path.exists(os.path.join(path, 'index')))
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            self.assertEqual(len(storage.log.index), 10)
+            for request in requests:
+                response = storage.retrieve_response(self.spider, request)
+                self.assertEqual(response.body, request.url.encode())
+
+    def test_index_rebuilt_after_crash(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            requests = self._store(storage, 5)
+            path = storage.log.path
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            # appended after the saved index, then a partial record
+            requests += self._store(storage, 5, offset=5)
+            storage.log.active.write(b'SHCL\x00')
+            storage.log.active.flush()
+            segment = storage.log.active_segment
+            storage.log.active.close()
+            storage.log.active = None  # crash, the index is not saved
+        size = os.path.getsize(os.path.join(path, '%08d.seg' % segment))
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            self.assertEqual(len(storage.log.index), 10)
+            self.assertEqual(os.path.getsize(os.path.join(path, '%08d.seg' % segment)),
+                             size - 5)
+            for request in requests:
+                response = storage.retrieve_response(self.spider, request)
+                self.assertEqual(response.body, request.url.encode())
+
+    def test_segment_rollover_and_compaction(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0,
+                           HTTPCACHE_SEGMENT_LOG_SEGMENT_SIZE=512) as storage:
+            requests = self._store(storage, 10)
+            self._store(storage, 10)  # supersede them all
+            segments = storage.log.segments()
+            self.assertGreater(len(segments), 2)
+            size = sum(os.path.getsize(storage.log.segment_path(s)) for s in segments)
+
+            storage.log.compact()
+            segments = storage.log.segments()
+            compacted = sum(os.path.getsize(storage.log.segment_path(s)) for s in segments)
+            self.assertLess(compacted, size * 0.6)
+            for request in requests:
+                response = storage.retrieve_response(self.spider, request)
+                self.assertEqual(response.body, request.url.encode())
+
+    def test_compaction_drops_expired(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            old = self._store(storage, 3)
+            storage.log.index = {
+                key: entry._replace(timestamp=entry.timestamp - 100)
+                for key, entry in storage.log.index.items()
+            }
+            new = self._store(storage, 3, offset=3)
+            storage.log.compact(expiration_secs=50)
+            self.assertEqual(len(storage.log.index), 3)
+            for request in old:
+                self.assertIsNone(storage.retrieve_response(self.spider, request))
+            for request in new:
+                self.assertIsNotNone(storage.retrieve_response(self.spider, request))
+
+    def test_compaction_keeps_concurrent_store(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            requests = self._store(storage, 3)
+            pread = storage.log.pread
+
+            def store_meanwhile(*args):
+                # stored by another thread once the old record is read
+                data = pread(*args)
+                if len(storage.log.index) == 3:
+                    storage.store_response(self.spider, requests[0], self.response)
+                    storage.delete_responses(self.spider, [storage._request_key(requests[1])])
+                return data
+
+            with mock.patch.object(storage.log, 'pread', store_meanwhile):
+                storage.log.compact()
+            self.assertEqualResponse(self.response, storage.retrieve_response(self.spider, requests[0]))
+            self.assertIsNone(storage.retrieve_response(self.spider, requests[1]))
+            self.assertEqual(storage.retrieve_response(self.spider, requests[2]).body,
+                             requests[2].url.encode())
+
+    def test_compaction_waits_for_readers(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            requests = self._store(storage, 3)
+            segment = storage.log.active_segment
+            with storage.log.lock:
+                fd = storage.log._acquire(segment)  # a pread in progress
+            storage.log.compact()
+            self.assertFalse(os.path.exists(storage.log.segment_path(segment)))
+            self.assertEqual(len(os.pread(fd, 4, 0)), 4)
+            storage.log._release(segment)
+            self.assertNotIn(segment, storage.log.fds)
+            self.assertRaises(OSError, os.fstat, fd)
+            for request in requests:
+                self.assertEqual(storage.retrieve_response(self.spider, request).body,
+                                 request.url.encode())
+
+    def test_tombstone_persisted(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            requests = self._store(storage, 3)
+            path = storage.log.path
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            storage.delete_responses(self.spider, [storage._request_key(requests[0])])
+            storage.log.active.close()
+            storage.log.active = None  # crash, the index is not saved
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            self.assertEqual(len(storage.log.index), 2)
+            self.assertIsNone(storage.retrieve_response(self.spider, requests[0]))
+            self.assertIsNotNone(storage.retrieve_response(self.spider, requests[1]))
+        self.assertTrue(os.path.isdir(path))
+
+
+class SegmentLogStorageMmapTest(SegmentLogStorageTest):
+
+    test_mmap_threshold = FilesystemStorageMmapTest.test_mmap_threshold
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_MMAP_MIN_SIZE', 5)
+        return super(SegmentLogStorageMmapTest, self)._get_settings(**new_settings)
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class MongoStorageTest(DefaultStorageTest):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.mongo.MongoCacheStorage'
+
+    def setUp(self):
+        super(MongoStorageTest, self).setUp()
+        patcher = mock.patch('scrapy_httpcache.extensions.cache_storage.mongo.MongoClient',
+                             mongomock.MongoClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_MONGO_MONGOCLIENT_HOST', 'localhost')
+        new_settings.setdefault('HTTPCACHE_MONGO_MONGOCLIENT_PORT', 27017)
+        new_settings.setdefault('HTTPCACHE_MONGO_DATABASE', 'test_%d' % id(self))
+        new_settings.setdefault('HTTPCACHE_MONGO_COLLECTION', 'cache')
+        return super(MongoStorageTest, self)._get_settings(**new_settings)
+
+    def test_data_for_human(self):
+        response = HtmlResponse('http://www.example.com', body=b'test body',
+                                headers={'Content-Type': 'text/html',
+                                         'Set-Cookie': 'a=b; HttpOnly'})
+        with self._storage(HTTPCACHE_MONGO_WRITE_BATCH_SIZE=1) as storage:
+            storage.store_response(self.spider, self.request, response)
+            doc = storage.collection.find_one()
+            self.assertEqual(doc['data_for_human']['body'], 'test body')
+            self.assertEqual(doc['data_for_human']['headers']['set-cookie'],
+                             [{'a': 'b', 'HttpOnly': ''}])
+
+            # disabled, the projection of the previous response is dropped
+            storage.data_for_human = False
+            storage.store_response(self.spider, self.request, response.replace(body=b'new'))
+            self.assertNotIn('data_for_human', storage.collection.find_one())
+            self.assertEqual(storage.retrieve_response(self.spider, self.request).body, b'new')
+
+            # and can be filled afterwards
+            self.assertEqual(storage.fill_data_for_human(), 1)
+            doc = storage.collection.find_one()
+            self.assertEqual(doc['data_for_human']['body'], 'new')
+            self.assertEqual(storage.fill_data_for_human(), 0)
+
+    def test_iter_entries(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(20)]
+        with self._storage() as storage:
+            for request in requests:
+                storage.store_response(self.spider, request, self.response)
+            entries = sorted(storage.iter_entries(self.spider))
+            self.assertEqual([key for key, _, _ in entries],
+                             sorted(storage._request_key(request) for request in requests))
+            for _, timestamp, size in entries:
+                self.assertAlmostEqual(timestamp, time.time(), delta=5)
+                self.assertEqual(size, len(storage._encode_body(self.response.body)[1]))
+
+    def test_iter_shard_entries(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(20)]
+        with self._storage() as storage:
+            for request in requests:
+                storage.store_response(self.spider, request, self.response)
+            shards = [sorted(storage.iter_shard_entries(self.spider, shard, 3)) for shard in range(3)]
+            self.assertEqual(sorted(sum(shards, [])), sorted(storage.iter_entries(self.spider)))
+            self.assertTrue(all(shards))
+
+    def test_ttl_index(self):
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=60) as storage:
+            index = storage.collection.index_information()['time_ttl']
+            self.assertEqual(index['key'], [('time', 1)])
+            self.assertEqual(index['expireAfterSeconds'], 60)
+            self.assertEqual(storage._ttl_index_change(storage.collection.index_information()),
+                             None)
+            storage.expiration_secs = 30
+            self.assertEqual(storage._ttl_index_change(storage.collection.index_information()),
+                             'modify')
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=0) as storage:
+            self.assertNotIn('time_ttl', storage.collection.index_information())
+        with self._storage(HTTPCACHE_EXPIRATION_SECS=60,
+                           HTTPCACHE_MONGO_TTL_INDEX=False) as storage:
+            self.assertNotIn('time_ttl', storage.collection.index_information())
+
+
+class MongoWriteBehindStorageTest(MongoStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_MONGO_WRITE_BATCH_SIZE', 3)
+        return super(MongoWriteBehindStorageTest, self)._get_settings(**new_settings)
+
+    def test_write_behind(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(4)]
+        with self._storage() as storage:
+            with mock.patch.object(storage.collection, 'bulk_write',
+                                   wraps=storage.collection.bulk_write) as bulk_write:
+                for request in requests[:2]:
+                    storage.store_response(self.spider, request, self.response)
+                self.assertEqual(storage.collection.count_documents({}), 0)
+                # read-your-writes from the buffer
+                self.assertEqualResponse(
+                    self.response, storage.retrieve_response(self.spider, requests[0]))
+
+                storage.store_response(self.spider, requests[2], self.response)
+                self.assertEqual(bulk_write.call_count, 1)
+                self.assertEqual(storage.collection.count_documents({}), 3)
+                self.assertEqual(storage.pending, {})
+
+                storage.store_response(self.spider, requests[3], self.response)
+                self.assertEqual(storage.collection.count_documents({}), 3)
+            collection = storage.collection
+        # flushed on close
+        self.assertEqual(collection.count_documents({}), 4)
+
+    def test_write_behind_interval(self):
+        with self._storage(HTTPCACHE_MONGO_WRITE_BATCH_INTERVAL=60) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertEqual(storage.collection.count_documents({}), 0)
+            storage.last_flush -= 61
+            storage.store_response(self.spider, self.request.replace(url='http://a.com'),
+                                   self.response)
+            self.assertEqual(storage.collection.count_documents({}), 2)
+
+    def test_write_behind_timer(self):
+        clock = Clock()
+        with mock.patch('twisted.internet.reactor', clock), \
+                mock.patch('scrapy_httpcache.extensions.cache_storage.mongo.deferToThread',
+                           side_effect=defer.maybeDeferred), \
+                self._storage(HTTPCACHE_MONGO_WRITE_BATCH_INTERVAL=1) as storage:
+            storage.store_response(self.spider, self.request, self.response)
+            self.assertEqual(storage.collection.count_documents({}), 0)
+            with mock.patch('scrapy_httpcache.extensions.cache_storage.mongo.time',
+                            return_value=time.time() + 1):
+                clock.advance(1)
+            # without another write
+            self.assertEqual(storage.collection.count_documents({}), 1)
+            self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+
+class MongoStorageCompressionTest(MongoStorageTest):
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_COMPRESSION', 'gzip')
+        new_settings.setdefault('HTTPCACHE_COMPRESSION_MIN_SIZE', 0)
+        return super(MongoStorageCompressionTest, self)._get_settings(**new_settings)
+
+
+class PrefetchTest(_BaseTest):
+
+    # with a multi-get
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.sqlite.SqliteCacheStorage'
+    policy_class = 'scrapy_httpcache.extensions.policy.dummy.DummyPolicy'
+
+    def _get_settings(self, **new_settings):
+        new_settings.setdefault('HTTPCACHE_PREFETCH_BATCH_SIZE', 2)
+        new_settings.setdefault('HTTPCACHE_EXPIRATION_SECS', 0)
+        return super(PrefetchTest, self)._get_settings(**new_settings)
+
+    def test_signal_connected(self):
+        crawler = get_crawler(Spider, self._get_settings())
+        mw = HttpCacheMiddleware.from_crawler(crawler)
+        request = Request('http://www.example.com/2')
+        crawler.signals.send_catch_log(signals.request_scheduled, request=request,
+                                       spider=self.spider)
+        self.assertEqual(mw.prefetch_queue, [request])
+
+    def test_response_delete_signal(self):
+        crawler = get_crawler(Spider, self._get_settings())
+        mw = HttpCacheMiddleware.from_crawler(crawler)
+        crawler.stats.open_spider(self.spider)
+        mw.spider_opened(self.spider)
+        requests = [Request('http://www.example.com/%d' % i) for i in range(4)]
+        for request in requests:
+            mw.storage.store_response(self.spider, request, self.response)
+        # staged, then found to be a ban page
+        mw.request_scheduled(requests[0], self.spider)
+        mw.request_scheduled(requests[1], self.spider)
+        crawler.signals.send_catch_log(httpcache_signals.response_delete, request=requests[0],
+                                       response=self.response, spider=self.spider)
+        self.assertNotIn(requests[0], mw.staged)
+        self.assertIsNone(mw.process_request(requests[0], self.spider))
+        crawler.signals.send_catch_log(httpcache_signals.responses_delete, spider=self.spider,
+                                       fingerprints=[mw.storage._request_key(r)
+                                                     for r in requests[1:3]])
+        self.assertEqual(list(mw.storage.iter_keys(self.spider)),
+                         [mw.storage._request_key(requests[3])])
+        self.assertIsNone(mw.process_request(requests[1], self.spider))
+        self.assertEqual(crawler.stats.get_value('httpcache/delete'), 3)
+        mw.spider_closed(self.spider)
+
+    def test_batched_lookups(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(5)]
+        with self._middleware() as mw:
+            mw.storage.store_response(self.spider, requests[1], self.response)
+            with mock.patch.object(mw.storage, 'retrieve_responses',
+                                   wraps=mw.storage.retrieve_responses) as retrieve_responses, \
+                    mock.patch.object(mw.storage, 'retrieve_response') as retrieve_response:
+                for request in requests:
+                    mw.request_scheduled(request, self.spider)
+                mw.request_scheduled(Request('http://a.com', meta={'dont_cache': True}),
+                                     self.spider)
+                self.assertEqual(retrieve_responses.call_count, 2)
+                self.assertEqual(mw.prefetch_queue, requests[4:])
+                # the partial batch is looked up as soon as it is needed
+                responses = [mw.process_request(request, self.spider) for request in requests]
+                self.assertEqual(retrieve_responses.call_count, 3)
+                retrieve_response.assert_not_called()
+            self.assertEqual([r is not None for r in responses],
+                             [False, True, False, False, False])
+            self.assertIn('cached', responses[1].flags)
+            self.assertEqual(len(mw.staged), 0)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/prefetch/staged'), 5)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/hit'), 1)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/miss'), 4)
+
+    def test_max_staged(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(5)]
+        with self._middleware(HTTPCACHE_PREFETCH_MAX_STAGED=3) as mw:
+            for request in requests:
+                mw.request_scheduled(request, self.spider)
+            self.assertEqual(len(mw.staged), 2)
+            self.assertEqual(mw.prefetch_queue, requests[2:3])
+            mw.process_request(requests[4], self.spider)
+            self.assertEqual(len(mw.staged), 3)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/prefetch/staged'), None)
+
+    def test_stored_after_staged(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(2)]
+        with self._middleware() as mw:
+            for request in requests:
+                mw.request_scheduled(request, self.spider)
+            self.assertEqual(len(mw.staged), 2)
+            # stored by a duplicate request, not filtered
+            mw.process_response(requests[0].copy(), self.response, self.spider)
+            self.assertEqual(list(mw.staged.keys()), requests[1:])
+            response = mw.process_request(requests[0], self.spider)
+            self.assertIn('cached', response.flags)
+
+    def test_stored_fingerprints_one_request(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(20)]
+        with self._middleware() as mw:
+            for request in requests:
+                mw.request_scheduled(request, self.spider)
+            self.assertEqual(len(mw.staged_keys), 20)
+            stored = requests[0].copy()
+            with mock.patch.object(mw.storage.fingerprinter, 'fingerprint',
+                                   wraps=mw.storage.fingerprinter.fingerprint) as fingerprint:
+                mw.process_response(stored, self.response, self.spider)
+            self.assertEqual({id(c.args[0]) for c in fingerprint.call_args_list}, {id(stored)})
+            self.assertEqual(list(mw.staged.keys()), requests[1:])
+            for request in requests:
+                mw.process_request(request, self.spider)
+            self.assertEqual(mw.staged_keys, {})
+
+    def test_staged_max_age(self):
+        requests = [Request('http://www.example.com/%d' % i) for i in range(2)]
+        with self._middleware(HTTPCACHE_PREFETCH_MAX_AGE=60) as mw:
+            for request in requests:
+                mw.request_scheduled(request, self.spider)
+            # stored by another process meanwhile
+            mw.storage.store_response(self.spider, requests[0], self.response)
+            mw.storage.store_response(self.spider, requests[1], self.response)
+            self.assertIsNone(mw.process_request(requests[1], self.spider))
+            with mock.patch('scrapy_httpcache.downloadermiddlewares.httpcache.time',
+                            return_value=time.time() + 61):
+                response = mw.process_request(requests[0], self.spider)
+            self.assertIn('cached', response.flags)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/prefetch/outdated'), 1)
+
+
 class DummyPolicyTest(_BaseTest):
 
     policy_class = 'scrapy_httpcache.extensions.policy.dummy.DummyPolicy'
@@ -187,6 +1351,15 @@ class DummyPolicyTest(_BaseTest):
             self.assertEqualResponse(self.response, response)
             assert 'cached' in response.flags
 
+    def test_middleware_max_body_size(self):
+        large = self.response.replace(body=b'x' * 11)
+        with self._middleware(HTTPCACHE_MAX_BODY_SIZE=10) as mw:
+            mw.process_response(self.request, large, self.spider)
+            assert mw.process_request(self.request, self.spider) is None
+            self.assertEqual(self.crawler.stats.get_value('httpcache/too_large'), 1)
+            mw.process_response(self.request, self.response, self.spider)
+            self.assertEqualResponse(self.response, mw.process_request(self.request, self.spider))
+
     def test_middleware_ignore_schemes(self):
         # http responses are cached by default
         req, res = Request('http://test.com/'), Response('http://test.com/')
@@ -404,6 +1577,31 @@ class RFC2616PolicyTest(DefaultStorageTest):
                 self.assertEqualResponse(res1, res3)
                 assert 'cached' in res3.flags
 
+    def test_stale_lazy_body(self):
+        headers = {'Expires': self.yesterday, 'ETag': 'foo'}
+        req0 = Request('http://example.com')
+        res0a = Response(req0.url, headers=headers, body=b'foo')
+        storage = 'scrapy_httpcache.extensions.cache_storage.file_system.FilesystemCacheStorage'
+        with self._middleware(HTTPCACHE_LAZY_BODY=True, HTTPCACHE_EXPIRATION_SECS=0,
+                              HTTPCACHE_STORAGE=storage) as mw:
+            self._process_requestresponse(mw, req0, res0a)
+            # the stale response is kept to revalidate without its body
+            req1 = req0.copy()
+            self.assertIsNone(mw.process_request(req1, self.spider))
+            cached = req1.meta['cached_response']
+            self.assertFalse(cached.body_loaded)
+            self.assertIn(b'If-None-Match', req1.headers)
+            res1 = mw.process_response(req1, res0a.replace(status=304), self.spider)
+            self.assertIs(res1, cached)
+            self.assertEqual(res1.body, b'foo')
+            # nor is it loaded when the resource changed
+            req2 = req0.copy()
+            mw.process_request(req2, self.spider)
+            cached = req2.meta['cached_response']
+            res0b = res0a.replace(body=b'bar')
+            self.assertIs(mw.process_response(req2, res0b, self.spider), res0b)
+            self.assertFalse(cached.body_loaded)
+
     def test_cached_and_stale(self):
         sampledata = [
             (200, {'Date': self.today, 'Expires': self.yesterday}),
@@ -501,5 +1699,30 @@ class RFC2616PolicyTest(DefaultStorageTest):
                 self.assertEqualResponse(res1, res2)
                 assert 'cached' in res2.flags
 
+    def test_rfc1123_to_epoch(self):
+        for timestamp in (0, 784111777, int(time.time()), 2 ** 31 - 1):
+            for date in (email.utils.formatdate(timestamp, usegmt=True),
+                         email.utils.formatdate(timestamp),
+                         time.strftime('%A, %d-%b-%y %H:%M:%S GMT', time.gmtime(timestamp))):
+                self.assertEqual(rfc2616.rfc1123_to_epoch(date.encode()), timestamp, date)
+                self.assertEqual(rfc2616.rfc1123_to_epoch(date), timestamp, date)
+        for date in (None, b'', b'never', b'Sun, 06 Foo 1994 08:49:37 GMT', b'\xff'):
+            self.assertIsNone(rfc2616.rfc1123_to_epoch(date), date)
+        # memoized
+        date = email.utils.formatdate(usegmt=True).encode()
+        rfc2616.rfc1123_to_epoch(date)
+        with mock.patch.object(rfc2616, 'timegm', side_effect=AssertionError):
+            self.assertIsNotNone(rfc2616.rfc1123_to_epoch(date))
+
+    def test_parse_dates_once(self):
+        res0 = Response('http://example.com', headers={
+            'Date': self.yesterday, 'Expires': self.tomorrow, 'Last-Modified': self.yesterday})
+        req0 = Request('http://example.com')
+        with self._policy() as policy, \
+                mock.patch.object(rfc2616, 'parse_dates', wraps=rfc2616.parse_dates) as parse_dates:
+            self.assertTrue(policy.is_cached_response_fresh(res0, req0))
+            self.assertEqual(parse_dates.call_count, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from unittest import mock
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.settings import Settings
+from scrapy.utils.request import request_fingerprint
+
+from scrapy_httpcache.extensions.cache_storage.dbm import DbmCacheStorage
+from scrapy_httpcache.extensions.fingerprint import (
+    HashFingerprinter,
+    RequestFingerprinter,
+    xxhash,
+)
+
+
+class RequestFingerprinterTest(unittest.TestCase):
+
+    fingerprinter_class = RequestFingerprinter
+
+    def _fingerprinter(self, **settings):
+        return self.fingerprinter_class(Settings(settings))
+
+    def test_memoized(self):
+        fingerprinter = self._fingerprinter()
+        request = Request('http://www.example.com/?a=1')
+        with mock.patch.object(fingerprinter, '_fingerprint',
+                               wraps=fingerprinter._fingerprint) as compute:
+            fp = fingerprinter.fingerprint(request)
+            self.assertEqual(fingerprinter.fingerprint(request), fp)
+            self.assertEqual(fingerprinter.fingerprint(request.copy()), fp)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_canonical(self):
+        fingerprinter = self._fingerprinter()
+        self.assertEqual(fingerprinter.fingerprint(Request('http://www.example.com/?a=1&b=2')),
+                         fingerprinter.fingerprint(Request('http://www.example.com/?b=2&a=1')))
+        self.assertNotEqual(fingerprinter.fingerprint(Request('http://www.example.com/?a=1')),
+                            fingerprinter.fingerprint(Request('http://www.example.com/?a=2')))
+        self.assertNotEqual(fingerprinter.fingerprint(Request('http://www.example.com/')),
+                            fingerprinter.fingerprint(Request('http://www.example.com/',
+                                                              method='POST')))
+
+    def test_include_headers(self):
+        request = Request('http://www.example.com/', headers={'Accept-Language': 'en'})
+        request2 = Request('http://www.example.com/', headers={'Accept-Language': 'fr'})
+        fingerprinter = self._fingerprinter()
+        self.assertEqual(fingerprinter.fingerprint(request), fingerprinter.fingerprint(request2))
+        fingerprinter = self._fingerprinter(
+            HTTPCACHE_FINGERPRINT_INCLUDE_HEADERS=['Accept-Language'])
+        self.assertNotEqual(fingerprinter.fingerprint(request),
+                            fingerprinter.fingerprint(request2))
+
+    def test_scrapy_fingerprint(self):
+        request = Request('http://www.example.com/?b=2&a=1', headers={'X-A': '1'})
+        self.assertEqual(RequestFingerprinter(Settings()).fingerprint(request),
+                         request_fingerprint(request))
+        self.assertEqual(
+            RequestFingerprinter(Settings({'HTTPCACHE_FINGERPRINT_INCLUDE_HEADERS': ['X-A']}))
+            .fingerprint(request),
+            request_fingerprint(request, include_headers=['X-A']))
+
+    def test_storage_key(self):
+        request = Request('http://www.example.com/')
+        storage = DbmCacheStorage(Settings({
+            'HTTPCACHE_DIR': 'unused',
+            'HTTPCACHE_DBM_MODULE': 'tests.mocks.dummydbm',
+            'HTTPCACHE_FINGERPRINTER': '%s.%s' % (self.fingerprinter_class.__module__,
+                                                  self.fingerprinter_class.__name__),
+        }))
+        self.assertIsInstance(storage.fingerprinter, self.fingerprinter_class)
+        self.assertEqual(storage._request_key(request),
+                         self._fingerprinter().fingerprint(request))
+
+
+class HashFingerprinterTest(RequestFingerprinterTest):
+
+    fingerprinter_class = HashFingerprinter
+
+    def test_scrapy_fingerprint(self):
+        request = Request('http://www.example.com/?b=2&a=1')
+        fingerprinter = self._fingerprinter(HTTPCACHE_FINGERPRINT_HASH='sha1')
+        self.assertEqual(fingerprinter.fingerprint(request), request_fingerprint(request))
+        self.assertNotEqual(self._fingerprinter().fingerprint(request),
+                            request_fingerprint(request))
+
+    def test_hashes(self):
+        request = Request('http://www.example.com/')
+        self.assertEqual(len(self._fingerprinter().fingerprint(request)), 40)
+        with self.assertRaises(NotConfigured):
+            self._fingerprinter(HTTPCACHE_FINGERPRINT_HASH='md4')
+        with mock.patch.dict('scrapy_httpcache.extensions.fingerprint.HASHES',
+                             {'xxhash': None}):
+            with self.assertRaises(NotConfigured):
+                self._fingerprinter(HTTPCACHE_FINGERPRINT_HASH='xxhash')
+
+    @unittest.skipIf(xxhash is None, 'xxhash is not installed')
+    def test_xxhash(self):
+        fingerprinter = self._fingerprinter(HTTPCACHE_FINGERPRINT_HASH='xxhash')
+        self.assertEqual(len(fingerprinter.fingerprint(Request('http://www.example.com/'))), 32)
+
+    def test_exclude_query_params(self):
+        fingerprinter = self._fingerprinter(
+            HTTPCACHE_FINGERPRINT_EXCLUDE_QUERY_PARAMS=['sid', 'utm_source'])
+        self.assertEqual(
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=1&sid=abc&utm_source=x')),
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=1')))
+        self.assertNotEqual(
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=1&sid=abc')),
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=2&sid=abc')))
+
+    def test_include_query_params(self):
+        fingerprinter = self._fingerprinter(
+            HTTPCACHE_FINGERPRINT_INCLUDE_QUERY_PARAMS=['id', 'page'])
+        self.assertEqual(
+            fingerprinter.fingerprint(Request('http://www.example.com/p?page=2&ts=1&id=1')),
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=1&page=2&ts=2')))
+        self.assertNotEqual(
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=1')),
+            fingerprinter.fingerprint(Request('http://www.example.com/p?id=1&page=2')))
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+
+from scrapy_httpcache.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy_httpcache.extensions.gc import AccessLog, CacheCollector
+
+
+class CacheCollectorTest(unittest.TestCase):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
+
+    def setUp(self):
+        self.crawler = get_crawler(Spider)
+        self.spider = self.crawler._create_spider('example.com')
+        self.tmpdir = tempfile.mkdtemp()
+        self.requests = [Request('http://www.example.com/%d' % i) for i in range(4)]
+        self.response = Response('http://www.example.com', body=b'x' * 100)
+        self.crawler.stats.open_spider(self.spider)
+
+    def tearDown(self):
+        self.crawler.stats.close_spider(self.spider, '')
+        shutil.rmtree(self.tmpdir)
+
+    def _get_settings(self, **new_settings):
+        settings = {
+            'HTTPCACHE_ENABLED': True,
+            'HTTPCACHE_DIR': self.tmpdir,
+            'HTTPCACHE_EXPIRATION_SECS': 60,
+            'HTTPCACHE_POLICY': 'scrapy_httpcache.extensions.policy.dummy.DummyPolicy',
+            'HTTPCACHE_STORAGE': self.storage_class,
+            'HTTPCACHE_GC_ENABLED': True,
+        }
+        settings.update(new_settings)
+        return Settings(settings)
+
+    @contextmanager
+    def _middleware(self, **new_settings):
+        mw = HttpCacheMiddleware(self._get_settings(**new_settings), self.crawler.stats)
+        mw.spider_opened(self.spider)
+        try:
+            yield mw
+        finally:
+            mw.spider_closed(self.spider)
+
+    def _store(self, storage, age=0):
+        for request in self.requests:
+            storage.store_response(self.spider, request, self.response)
+        if age:
+            for request in self.requests:
+                key = storage._request_key(request)
+                storage.db['%s_time' % key] = str(time.time() - age)
+
+    def _max_size(self, storage, count):
+        # the size of that many entries, the same size for all
+        return count * next(iter(storage.iter_entries(self.spider)))[2]
+
+    def _keys(self, storage, requests):
+        return sorted(storage._request_key(r) for r in requests)
+
+    def test_expired(self):
+        with self._middleware() as mw:
+            mw.collector.stop()
+            self._store(mw.storage, age=120)
+            request = Request('http://www.example.com/new')
+            mw.storage.store_response(self.spider, request, self.response)
+            counts = mw.collector.collect(self.spider)
+            self.assertEqual(counts['entries'], 5)
+            self.assertEqual(counts['expired'], 4)
+            self.assertEqual(list(mw.storage.iter_keys(self.spider)),
+                             [mw.storage._request_key(request)])
+        self.assertEqual(self.crawler.stats.get_value('httpcache/gc/expired'), 4)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/gc/pass'), 1)
+
+    def test_lru(self):
+        with self._middleware() as mw:
+            mw.collector.stop()
+            self._store(mw.storage)
+            mw.collector.max_size = self._max_size(mw.storage, 2)
+            mw.collector.touch(mw.storage._request_key(self.requests[0]))
+            counts = mw.collector.collect(self.spider)
+            self.assertEqual(counts['evicted'], 2)
+            self.assertLessEqual(counts['size'], mw.collector.max_size)
+            kept = sorted(mw.storage.iter_keys(self.spider))
+            self.assertEqual(len(kept), 2)
+            self.assertIn(mw.storage._request_key(self.requests[0]), kept)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/gc/evicted'), 2)
+
+    def test_lfu(self):
+        with self._middleware(HTTPCACHE_GC_EVICTION='lfu') as mw:
+            mw.collector.stop()
+            self._store(mw.storage)
+            mw.collector.max_size = self._max_size(mw.storage, 2)
+            for request, hits in zip(self.requests, (3, 1, 2, 0)):
+                for _ in range(hits):
+                    mw.collector.touch(mw.storage._request_key(request))
+            mw.collector.collect(self.spider)
+            self.assertEqual(sorted(mw.storage.iter_keys(self.spider)),
+                             self._keys(mw.storage, [self.requests[0], self.requests[2]]))
+
+    def test_unknown_eviction(self):
+        with self.assertRaises(NotConfigured):
+            CacheCollector(None, self._get_settings(HTTPCACHE_GC_EVICTION='fifo'))
+
+    def test_access_log(self):
+        with self._middleware(HTTPCACHE_EXPIRATION_SECS=0) as mw:
+            self._store(mw.storage)
+            mw.process_request(self.requests[0].copy(), self.spider)
+            mw.process_request(self.requests[0].copy(), self.spider)
+            key = mw.storage._request_key(self.requests[0])
+            self.assertEqual(mw.collector.accesses.entries[key][1], 2)
+        path = os.path.join(self.tmpdir, 'example.com.access')
+        self.assertEqual(AccessLog.load(path).entries[key][1], 2)
+        with self._middleware(HTTPCACHE_EXPIRATION_SECS=0) as mw:
+            self.assertEqual(mw.collector.accesses.entries[key][1], 2)
+
+        with open(path, 'wb') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            AccessLog.load(path)
+        with self._middleware(HTTPCACHE_EXPIRATION_SECS=0) as mw:
+            self.assertEqual(mw.collector.accesses.entries, {})
+
+    def test_background_slices(self):
+        with self._middleware(HTTPCACHE_GC_SLICE_SIZE=3) as mw:
+            collector = mw.collector
+            # the first pass is scheduled when the spider is opened
+            self.assertTrue(collector.call.active())
+            self._store(mw.storage, age=120)
+            collector.call.cancel()
+            collector._run_slice(self.spider)
+            self.assertEqual(collector.counts['expired'], 3)
+            self.assertIsNotNone(collector.slices)
+            collector.call.cancel()
+            collector._run_slice(self.spider)
+            self.assertEqual(collector.counts['expired'], 4)
+            self.assertIsNone(collector.slices)
+            # the next pass
+            self.assertAlmostEqual(collector.call.getTime(), time.time() + 600, delta=5)
+            self.assertEqual(list(mw.storage.iter_keys(self.spider)), [])
+        self.assertIsNone(collector.call)
+
+    def test_not_implemented(self):
+        with self._middleware() as mw:
+            collector = mw.collector
+            collector.call.cancel()
+            with mock.patch.object(mw.storage, 'iter_entries',
+                                   side_effect=NotImplementedError('no entries')):
+                with self.assertLogs('scrapy_httpcache.extensions.gc', 'WARNING'):
+                    collector._run_slice(self.spider)
+            # not retried
+            self.assertIsNone(collector.call)
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+
+from scrapy_httpcache.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy_httpcache.extensions.metrics import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+        for us in range(1, 10001):
+            histogram.record(us / 1e6)
+        self.assertEqual(histogram.count, 10000)
+        self.assertAlmostEqual(histogram.max, 0.01)
+        for percent in (1, 50, 90, 99):
+            expected = percent * 100 / 1e6
+            self.assertGreaterEqual(histogram.percentile(percent), expected)
+            self.assertLessEqual(histogram.percentile(percent), expected * (1 + 1 / 16))
+        self.assertEqual(histogram.percentile(100), 0.01)
+
+    def test_buckets(self):
+        histogram = Histogram()
+        for seconds in (0.000001, 0.00002, 0.00002, 0.5):
+            histogram.record(seconds)
+        buckets = list(histogram.iter_buckets())
+        # every power of two of microseconds
+        self.assertEqual([bound for bound, _ in buckets[:3]], [16e-6, 32e-6, 64e-6])
+        self.assertEqual([count for _, count in buckets[:3]], [1, 3, 3])
+        self.assertEqual(buckets[-1][1], 4)
+        # the upper bounds are those of the buckets
+        for index in range(len(histogram.counts)):
+            self.assertLess(Histogram.lower_bound(index), Histogram.lower_bound(index + 1))
+
+
+class CacheMetricsTest(unittest.TestCase):
+
+    storage_class = 'scrapy_httpcache.extensions.cache_storage.dbm.DbmCacheStorage'
+
+    def setUp(self):
+        self.crawler = get_crawler(Spider)
+        self.spider = self.crawler._create_spider('example.com')
+        self.tmpdir = tempfile.mkdtemp()
+        self.request = Request('http://www.example.com')
+        self.response = Response('http://www.example.com', body=b'x' * 4096,
+                                 headers={'Cache-Control': 'max-age=86400'})
+        self.crawler.stats.open_spider(self.spider)
+
+    def tearDown(self):
+        self.crawler.stats.close_spider(self.spider, '')
+        shutil.rmtree(self.tmpdir)
+
+    def _get_settings(self, **new_settings):
+        settings = {
+            'HTTPCACHE_ENABLED': True,
+            'HTTPCACHE_DIR': self.tmpdir,
+            'HTTPCACHE_POLICY': 'scrapy_httpcache.extensions.policy.rfc2616.RFC2616Policy',
+            'HTTPCACHE_STORAGE': self.storage_class,
+            'HTTPCACHE_COMPRESSION': 'zlib',
+            'HTTPCACHE_METRICS_ENABLED': True,
+        }
+        settings.update(new_settings)
+        return Settings(settings)
+
+    @contextmanager
+    def _middleware(self, **new_settings):
+        mw = HttpCacheMiddleware(self._get_settings(**new_settings), self.crawler.stats)
+        mw.spider_opened(self.spider)
+        try:
+            yield mw
+        finally:
+            mw.spider_closed(self.spider)
+
+    def _crawl(self, mw):
+        # a miss, stored, then a hit
+        for _ in range(2):
+            request = self.request.copy()
+            response = mw.process_request(request, self.spider)
+            if response is None:
+                mw.process_response(request, self.response, self.spider)
+
+    def test_stats(self):
+        with self._middleware() as mw:
+            self._crawl(mw)
+            self.assertIsNone(self.crawler.stats.get_value('httpcache/latency/retrieve/count'))
+        stats = self.crawler.stats
+        self.assertEqual(stats.get_value('httpcache/hit'), 1)
+        self.assertEqual(stats.get_value('httpcache/latency/fingerprint/count'), 2)
+        self.assertEqual(stats.get_value('httpcache/latency/retrieve/count'), 2)
+        self.assertEqual(stats.get_value('httpcache/latency/store/count'), 1)
+        self.assertEqual(stats.get_value('httpcache/latency/encode/count'), 1)
+        self.assertEqual(stats.get_value('httpcache/latency/decode/count'), 1)
+        # should_cache_request twice, should_cache_response and the freshness
+        self.assertEqual(stats.get_value('httpcache/latency/policy/count'), 4)
+        self.assertLessEqual(stats.get_value('httpcache/latency/retrieve/p50'),
+                             stats.get_value('httpcache/latency/retrieve/max'))
+        self.assertEqual(stats.get_value('httpcache/body_bytes/written_raw'), 4096)
+        self.assertEqual(stats.get_value('httpcache/body_bytes/read_raw'), 4096)
+        self.assertLess(stats.get_value('httpcache/body_bytes/written'), 4096)
+        self.assertGreater(stats.get_value('httpcache/compression_ratio'), 1)
+
+    def test_disabled(self):
+        with self._middleware(HTTPCACHE_METRICS_ENABLED=False) as mw:
+            self.assertIsNone(mw.metrics)
+            self.assertIsNone(mw.storage.metrics)
+            self._crawl(mw)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/hit'), 1)
+        self.assertFalse([key for key in self.crawler.stats.get_stats()
+                          if key.startswith(('httpcache/latency/', 'httpcache/body_bytes/'))])
+
+    def test_threaded(self):
+        with self._middleware(HTTPCACHE_THREADED=True) as mw:
+            # the storage records from its threads
+            self.assertIs(mw.storage.metrics, mw.storage.storage.metrics)
+            mw.storage.storage.store_response(self.spider, self.request, self.response)
+        self.assertEqual(self.crawler.stats.get_value('httpcache/latency/encode/count'), 1)
+
+    def test_periodic_dump(self):
+        path = os.path.join(self.tmpdir, 'httpcache.prom')
+        with self._middleware(HTTPCACHE_METRICS_INTERVAL=30,
+                              HTTPCACHE_METRICS_PROMETHEUS_PATH=path) as mw:
+            call = mw.metrics.call
+            self.assertTrue(call.active())
+            self._crawl(mw)
+            call.cancel()
+            mw.metrics._dump(self.spider)
+            self.assertEqual(self.crawler.stats.get_value('httpcache/latency/store/count'), 1)
+            # the next dump
+            self.assertTrue(mw.metrics.call.active())
+            with open(path) as f:
+                text = f.read()
+        self.assertIsNone(mw.metrics.call)
+        self.assertIn('# TYPE httpcache_latency_seconds histogram', text)
+        self.assertIn('httpcache_latency_seconds_count{spider="example.com",phase="retrieve"} 2',
+                      text)
+        self.assertIn('httpcache_latency_seconds_bucket{spider="example.com",phase="retrieve",'
+                      'le="+Inf"} 2', text)
+        self.assertIn('httpcache_body_bytes_total{spider="example.com",direction="written",'
+                      'encoding="raw"} 4096', text)
+        self.assertEqual(os.listdir(self.tmpdir).count('httpcache.prom'), 1)